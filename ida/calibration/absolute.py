@@ -21,11 +21,15 @@
 # Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################
 from datetime import datetime
-import os.path
+import copy
+import json
+import os
 from pathlib import Path
+import threading
 from trace import Trace
 import yaml
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 # import matplotlib
@@ -46,8 +50,9 @@ import scipy.signal as ss
 from fabulous.color import red
 
 from ida import IDA_PKG_VERSION_HASH_STR, IDA_PKG_VERSION_DATETIME
-from ida.utils import i10get, pimseed
-from ida.signals.utils import time_offset, taper_high_freq_resp, \
+from ida.calibration.waveform_sources import MiniSEEDFileSource, MiniSEEDArchiveSource, \
+        IDA10ArchiveSource
+from ida.signals.utils import time_offset_fft, taper_high_freq_resp, \
         dynlimit_resp_min
 # from ida.calibration.shaketable import rename_chan
 
@@ -235,6 +240,129 @@ class APSurveySegmentResult(object):
     def can_use(self):
         return self._use_segment
 
+class SysSensCache(object):
+    """
+    Cache of overall system sensitivities computed from RESP files.
+
+    Parsing RESP files with obspy.read_inventory is slow and the same files are needed for
+    each dataset (azi/abs) and sensor in a survey. Parsed inventories are kept in memory keyed
+    by (RESP path, mtime) and computed sensitivities are keyed by
+    (RESP path, mtime, SEED id, response epoch, frequency).
+
+    If a cache filename is supplied, the sensitivities are loaded from and saved to that file
+    (JSON) so repeated survey runs can skip RESP parsing entirely. Entries for a RESP file are
+    ignored once its mtime changes.
+    """
+
+    def __init__(self, cache_fn=None):
+        """
+        Constructor for SysSensCache
+
+        Args:
+            cache_fn (str): Optional path of JSON file used to persist sensitivities
+        """
+        self.cache_fn = cache_fn
+        self._inventories = {}  # (respfn, mtime) -> Inventory
+        self._sensitivities = {}  # (respfn, mtime, seed_id, freq) -> [(epoch_start, epoch_end, value), ...]
+        self._dirty = False
+        # APSurvey reads sensor data (and computes sensitivities) in concurrent threads
+        self._lock = threading.Lock()
+
+        if self.cache_fn and os.path.isfile(self.cache_fn):
+            self.load()
+
+    def load(self):
+        """
+        Load persisted sensitivities from self.cache_fn. An unreadable cache file is ignored.
+
+        Returns: None
+
+        """
+        try:
+            with open(self.cache_fn, 'rt') as cfl:
+                records = json.load(cfl)
+        except (OSError, ValueError):
+            logging.getLogger(__name__).warning('Ignoring unreadable sensitivity cache file: ' + self.cache_fn)
+            return
+
+        for rec in records:
+            key = (rec['resp_file'], rec['mtime'], rec['seed_id'], rec['freq'])
+            self._sensitivities.setdefault(key, []).append(
+                (rec['epoch_start'], rec['epoch_end'], rec['sensitivity']))
+
+    def save(self):
+        """
+        Write sensitivities to self.cache_fn if any have been added since it was loaded.
+        The file is written to a temporary name and renamed so it is replaced atomically.
+
+        Returns: None
+
+        """
+        if not (self.cache_fn and self._dirty):
+            return
+
+        records = []
+        for (respfn, mtime, seed_id, freq), epochs in self._sensitivities.items():
+            for epoch_start, epoch_end, value in epochs:
+                records.append({'resp_file': respfn, 'mtime': mtime, 'seed_id': seed_id, 'freq': freq,
+                                'epoch_start': epoch_start, 'epoch_end': epoch_end, 'sensitivity': value})
+
+        tmpfn = self.cache_fn + '.tmp'
+        with open(tmpfn, 'wt') as cfl:
+            json.dump(records, cfl, indent=1)
+        os.replace(tmpfn, self.cache_fn)
+        self._dirty = False
+
+    def _inventory(self, respfn, mtime):
+        key = (respfn, mtime)
+        if key not in self._inventories:
+            self._inventories[key] = read_inventory(respfn)
+        return self._inventories[key]
+
+    def sensitivity(self, respfn, seed_id, time, freq=None):
+        """
+        Retrieves the overall system sensitivity for seed_id at time from RESP file respfn
+
+        Args:
+            respfn (str): RESP file path
+            seed_id (str): NET.STA.LOC.CHN SEED identifier
+            time (UTCDateTime): Time used to select the response epoch
+            freq (float): Optional frequency (hz) at which to recalculate the sensitivity
+
+        Returns:
+            (float): overall system sensitivity
+
+        """
+        respfn = os.path.abspath(respfn)
+        mtime = os.path.getmtime(respfn)
+        key = (respfn, mtime, seed_id, freq)
+        epoch_t = float(time.timestamp)
+
+        for epoch_start, epoch_end, value in self._sensitivities.get(key, []):
+            if (epoch_start is None or epoch_start <= epoch_t) and (epoch_end is None or epoch_t < epoch_end):
+                return value
+
+        with self._lock:
+            inv = self._inventory(respfn, mtime)
+            net, sta, loc, chn = seed_id.split('.')
+            cha = inv.select(network=net, station=sta, location=loc, channel=chn, time=time)[0][0][0]
+            # copy response so recalculating the sensitivity does not alter the cached inventory
+            resp = copy.deepcopy(inv.get_response(seed_id, time))
+
+        # recalculate sensitivity at requested frequency
+        if freq:
+            resp.recalculate_overall_sensitivity(freq)
+
+        value = float(resp.instrument_sensitivity.value)
+        epoch_start = float(cha.start_date.timestamp) if cha.start_date else None
+        epoch_end = float(cha.end_date.timestamp) if cha.end_date else None
+        with self._lock:
+            self._sensitivities.setdefault(key, []).append((epoch_start, epoch_end, value))
+            self._dirty = True
+
+        return value
+
+
 class APSurvey(object):
     """
     Performs relative azimuth and sensitivity calculations for two or more sensors in pairs. Structured on
@@ -285,6 +413,8 @@ class APSurvey(object):
           # station sensor meta data used to retrieve data from IDA archives
           # and to find the correct sensor RESP file for convolution/deconvolution
          'station': 'DGAR'
+         # OPTIONAL network code of the station. Default 'II'
+         'network': 'II',
          'pri_sensor_installed': True,
          # channels should be in Z, 1, 2 order
          'pri_sensor_chans': 'BHZ,BH1,BH2',
@@ -313,9 +443,18 @@ class APSurvey(object):
          # NOTE: This may also be a MINISEED file, if a non-IDA sensor is being analyzed.
          # in this case, the metadata from the 'pri_sensor' above is used in output of results'
 
+         # OPTIONAL format of archive at arc_raw_dir. 'ida10' (default) retrieves IDA10 data and
+         # converts it to miniseed with imseed. 'mseed' reads the IDA miniseed archive day files
+         # directly into memory.
+         'arc_raw_format': 'ida10',
+
          # location of RESP files used for comuting sensors responses
          'resp_file_dir': '/ida/dcc/response/RESP',
 
+         # OPTIONAL file used to persist system sensitivities computed from RESP files
+         # between survey runs
+         'sys_sens_cache_file': './apsurvey_sys_sens.json',
+
          }
 
     """
@@ -389,6 +528,12 @@ class APSurvey(object):
             }
         }
 
+        # conditioned (detrended, bandpassed and resampled) component timeseries, memoized per
+        # (dataset, sensor, component, bandpass, analysis sr) so each trace is only processed
+        # once across all sensor pair comparisons. Sensitivity is NOT removed in the cache: each
+        # comparison divides by the sensitivity of its own component (see _conditioned_data)
+        self._conditioned_cache = {}
+
         # time correction flags so only do it once
         self.ref_clock_adjustment = 0.0
         self.ref_clock_adjusted = False
@@ -414,6 +559,9 @@ class APSurvey(object):
         else:
             self._process_config()
 
+        # system sensitivities from RESP files, shared by the azi and abs datasets
+        self._sys_sens_cache = SysSensCache(self._config.get('sys_sens_cache_file'))
+
     def _process_config(self):
         """
         Checks for existance of keys and some existance of some file/directory values
@@ -591,6 +739,10 @@ class APSurvey(object):
     def station(self):
         return self._config['station'].lower()
 
+    @property
+    def network(self):
+        return self._config.get('network', 'II').upper()
+
     @property
     def segment_size_secs(self):
         return self._config['segment_size_secs']
@@ -680,6 +832,10 @@ class APSurvey(object):
     def arc_raw_dir(self):
         return self._config['arc_raw_dir']
 
+    @property
+    def arc_raw_format(self):
+        return self._config.get('arc_raw_format', 'ida10').lower()
+
     @property
     def resp_file_dir(self):
         return self._config['resp_file_dir']
@@ -710,7 +866,8 @@ class APSurvey(object):
 
         Teh two timeseries are bandpass filter from config bp_start (default is 0.1hz) to 2hz.
 
-        The correlation calculation is performed by the obspy.signal.xcorr function underneath.
+        The correlation calculation is performed by ida.signals.utils.time_offset_fft underneath,
+        which works on the correlation window only and returns a sub-sample offset.
 
         Adjusts the starttime of the traces from sens1 to remove clock discrepancy. Positive offset
         adjustment value indicates that the sens1 clock is slow (behind) sens2. Negative indicates the opposite.
@@ -763,28 +920,23 @@ class APSurvey(object):
         cfunc = []
         emsg = ''
 
-        ref_z = self.trtpls[dataset][sens1].z.copy()
-        sensor_z = self.trtpls[dataset][sens2].z.copy()
-
-        # need to interpolate if ref data sampling rate > sensor sampling rate
-        if ref_z.stats.sampling_rate > sensor_z.stats.sampling_rate:
-            sensor_z.interpolate(ref_z.stats.sampling_rate, method='linear')
+        ref_z = self.trtpls[dataset][sens1].z
+        sensor_z = self.trtpls[dataset][sens2].z
 
         if sensor_z and ref_z:
-            ref_z.filter('bandpass', freqmin=self.bp_start, freqmax=2.0)
-            sensor_z.filter('bandpass', freqmin=self.bp_start, freqmax=2.0)
-
             # take middle for time series correlation
             dur = sensor_z.stats.endtime - sensor_z.stats.starttime
             start_t = sensor_z.stats.starttime + dur/2 - self.correlation_segment_size/2
             end_t = start_t + self.correlation_segment_size
-            ref_z.trim(start_t, end_t)
-            sensor_z.trim(start_t, end_t)
 
-            # compute time offset and adjust starttime of sens1 traces
-            # use window isze of 1 minute at 40hz
-            offset, cval, cfunc, emsg = time_offset(sensor_z, ref_z,
-                                                    winsize=4800)
+            # compute time offset and adjust starttime of sens1 traces.
+            # Only the correlation window is filtered and, if sample rates differ, resampled.
+            # Search offsets up to 2 minutes
+            offset, cval, cfunc, emsg = time_offset_fft(sensor_z, ref_z, start_t, end_t,
+                                                        bpfreqmin=self.bp_start, bpfreqmax=2.0,
+                                                        max_shift=120.0)
+            if emsg:
+                self.logmsg(logging.ERROR, 'ERROR (time_offset): ' + emsg)
             for tr in self.streams[dataset][sens1]:
                 tr.stats.starttime = tr.stats.starttime + offset
 
@@ -891,8 +1043,8 @@ class APSurvey(object):
 
     def _read_sensor_data(self, dataset, sensor):
         """
-        Retrieve IDA10 data from IDA Archive and convert to miniseed for indicated
-        azi or abs time period.
+        Retrieve sensor data for indicated azi or abs time period from the waveform source
+        selected in the config (see _waveform_source).
 
         ALTERNATELY, if the ARC_RAW_DIR config setting is a file, it is ASSUMED to be a miniseed file.
         This is ONLY to run single analysis (not both 'azi' and 'abs') on an existing miniseed file
@@ -935,72 +1087,28 @@ class APSurvey(object):
         if dataset == 'abs' and not self.process_absolute:
             return False
 
-        # check for non IDA sensor data supplied as miniseed file.
-        # TODO: this is a kludge and this situation needs to be reworked
-        # if os.path.isfile(self.arc_raw_dir):
-        if not os.path.isdir(self.arc_raw_dir):
-            # assume pri, and possibly sec,  miniseed file names with ONLY needed
-            # channels (Z12/ZNE) and time period
-
-            self.logmsg(logging.INFO, 'Reading local target sensor data file(s)...')
-
-            fns = self.arc_raw_dir.split(',')
-            fns = [fn.strip() for fn in fns]
-            if (sensor == 'pri') and (len(fns) > 0) and os.path.isfile(fns[0]):
-                ms_name = fns[0]
-                self.waveform_files.append(fns[0])
-            elif (sensor == 'sec') and (len(fns) > 1) and os.path.isfile(fns[1]):
-                ms_name = fns[1]
-                self.waveform_files.append(fns[1])
-            else:
-                self.logmsg(logging.ERROR,
-                            'Error finding ms file [{}] for {} sensor.'.format(
-                                self.arc_raw_dir, sensor
-                            ))
-
-                return False
-        else:
-            # retrieve data from IDA IDA10 archive
+        source = self._waveform_source(dataset, sensor)
+        if not source:
+            return False
 
-            # construct root of output file names
-            outname = './{}_{}_{}'.format(self.station,
-                                          self.station_sensor_loc(sensor),
-                                          dataset)
-            ms_name = outname + '.ms'
-            i10_name = outname + '.i10'
-            if os.path.exists(i10_name):
-                os.remove(i10_name)
-            if os.path.exists(ms_name):
-                os.remove(ms_name)
-
-            self.waveform_files.append(i10_name)
-            self.waveform_files.append(ms_name)
-
-            self.logmsg(logging.INFO, 'Retrieving {} sensor {} data from archive' \
-                        ' and saving in {}'.format(sensor.upper(),
-                                                   dataset.upper(),
-                                                   ms_name))
-
-            try:
-                # get IDA10 data and convert to miniseed
-                i10get(self.arc_raw_dir,
-                       self.station,
-                       self._chanloc_codes(sensor),
-                       self.starttime(dataset), self.endtime(dataset),
-                       outfn=i10_name)
-                pimseed(self.station, i10_name, ms_name)
-            except:
-                self.logmsg(logging.ERROR,
-                            'Error reading and converting IDA10 data for sensor ({}/{})'.format(dataset, sensor))
-                self.logmsg(logging.ERROR,
-                            'Can not use {} sensor data in sensor comparisons.'.format(sensor))
-                return False
+        self.logmsg(logging.INFO, 'Retrieving {} sensor {} data from {}'.format(sensor.upper(),
+                                                                           dataset.upper(),
+                                                                           source.label))
+        try:
+            strm = source.read()
+        except:
+            self.logmsg(logging.ERROR,
+                        'Error retrieving data for sensor ({}/{})'.format(dataset, sensor))
+            self.logmsg(logging.ERROR,
+                        'Can not use {} sensor data in sensor comparisons.'.format(sensor))
+            return False
+        finally:
+            self.waveform_files.extend(source.files)
 
         try:
             # TODO: Split up, too much in this block
-            # read ms file, merge traces, check for gaps and split trces into ChanTpl for processing
-            self.logmsg(logging.DEBUG, 'Reading {} sensor data.'.format(sensor))
-            self.streams[dataset][sensor] = read(ms_name)
+            # trim and merge traces, check for gaps and split trces into ChanTpl for processing
+            self.streams[dataset][sensor] = strm
             self.logmsg(logging.DEBUG, 'trimming {} sensor data.'.format(sensor))
             self.streams[dataset][sensor].trim(starttime=self.starttime(dataset),
                                                endtime=self.endtime(dataset))
@@ -1035,12 +1143,14 @@ class APSurvey(object):
                 self.logmsg(logging.ERROR, 'Could not find EAST component trace in miniseed data for sensor {}'.format(sensor))
 
             self.trtpls[dataset][sensor] = self.ChanTpl(z=tr_z, n=tr_1, e=tr_2)
-            self.msfiles[dataset][sensor] = os.path.abspath(ms_name)
-
-            self.logmsg(logging.DEBUG, 'Writing prepped {} sensor data.'.format(sensor))
-
-            self.streams[dataset][sensor].write(self.msfiles[dataset][sensor], format='MSEED')
-            self.logmsg(logging.DEBUG, 'Wrote prepped {} sensor data.'.format(sensor))
+            self.msfiles[dataset][sensor] = source.label
+
+            # sources that produce a local miniseed file get the prepped data written back to it.
+            # archive data read directly into memory is not written out.
+            if source.prepped_file:
+                self.logmsg(logging.DEBUG, 'Writing prepped {} sensor data.'.format(sensor))
+                self.streams[dataset][sensor].write(source.prepped_file, format='MSEED')
+                self.logmsg(logging.DEBUG, 'Wrote prepped {} sensor data.'.format(sensor))
         except:
             self.logmsg(logging.ERROR,
                         'Error reading processing miniseed data for sensor ({}/{})'.format(dataset, sensor))
@@ -1059,27 +1169,71 @@ class APSurvey(object):
 
         return True
 
-    def _calculate_sys_sens(self, tr: Trace, freq: float = None):
+    def _waveform_source(self, dataset, sensor):
         """
-        Retrieves the overall system sensitivity the supplied trace
-        using the RESP files.
+        Construct the waveform source for the sensor data of a dataset.
+
+        If ARC_RAW_DIR is not a directory it is ASSUMED to be a comma separated list of
+        pri and sec miniseed file names (see _read_sensor_data).
+        Otherwise the ARC_RAW_FORMAT config setting selects between the IDA10 archive ('ida10', default),
+        retrieved with i10get and converted with imseed, and the IDA miniseed archive ('mseed'), which
+        is read directly into memory.
+
+        Args:
+            dataset (str): 'azi' or 'abs'
+            sensor (str): 'pri' or 'sec'
+
+        Returns:
+            (MiniSEEDFileSource, MiniSEEDArchiveSource or IDA10ArchiveSource): source for the
+                sensor data or None if source could not be determined.
+
         """
 
-        # if type(tr) == Trace:
-        respfn = self._respfilename(tr.stats.network, tr.stats.station, tr.stats.channel, tr.stats.location)
-        # else:
-        #     return 1.0
+        chans = self._config.get(sensor + '_sensor_chans', '').split(',')
+        loc = self.station_sensor_loc(sensor)
 
-        inv = read_inventory(respfn)
-        resp = inv.get_response(f'{tr.stats.network}.{tr.stats.station}.{tr.stats.location}.{tr.stats.channel}', tr.stats.starttime)
+        # check for non IDA sensor data supplied as miniseed file.
+        # TODO: this is a kludge and this situation needs to be reworked
+        if not os.path.isdir(self.arc_raw_dir):
+            # assume pri, and possibly sec,  miniseed file names with ONLY needed
+            # channels (Z12/ZNE) and time period
+            fns = self.arc_raw_dir.split(',')
+            fns = [fn.strip() for fn in fns]
+            if (sensor == 'pri') and (len(fns) > 0) and os.path.isfile(fns[0]):
+                return MiniSEEDFileSource(fns[0])
+            elif (sensor == 'sec') and (len(fns) > 1) and os.path.isfile(fns[1]):
+                return MiniSEEDFileSource(fns[1])
+            else:
+                self.logmsg(logging.ERROR,
+                            'Error finding ms file [{}] for {} sensor.'.format(
+                                self.arc_raw_dir, sensor
+                            ))
+                return None
 
-        # recalculate sensitivity at midpoint (in hz) of the analysis bandpass
-        if freq:
-            resp.recalculate_overall_sensitivity(freq)
+        elif self.arc_raw_format == 'mseed':
+            return MiniSEEDArchiveSource(self.arc_raw_dir, self.network, self.station, chans, loc,
+                                         self.starttime(dataset), self.endtime(dataset))
+
+        elif self.arc_raw_format == 'ida10':
+            # construct root of output file names
+            outname = './{}_{}_{}'.format(self.station, loc, dataset)
+            return IDA10ArchiveSource(self.arc_raw_dir, self.station, chans, loc,
+                                      self.starttime(dataset), self.endtime(dataset), outname)
+
+        else:
+            self.logmsg(logging.ERROR, 'Invalid arc_raw_format in config: {}'.format(self.arc_raw_format))
+            return None
+
+    def _calculate_sys_sens(self, tr: Trace, freq: float = None):
+        """
+        Retrieves the overall system sensitivity the supplied trace
+        using the RESP files. Lookups go through the survey's SysSensCache.
+        """
 
-        # print(f'{tr.stats.network}, {tr.stats.station}, {tr.stats.channel}, {tr.stats.location}: {resp.instrument_sensitivity.value}')
+        respfn = self._respfilename(tr.stats.network, tr.stats.station, tr.stats.channel, tr.stats.location)
 
-        return resp.instrument_sensitivity.value
+        # sensitivity recalculated at freq (in hz), if supplied
+        return self._sys_sens_cache.sensitivity(respfn, tr.id, tr.stats.starttime, freq)
 
     def _sensor_sample_rate_str(self, dataset, sensor):
         """
@@ -1262,8 +1416,8 @@ class APSurvey(object):
         """
         Called externally to perform the analysis and write out results for a given 'dataset'.
 
-        The refernce data is read first. Then the secondary station sensor is read. The secondary sensor is read
-        first because in most cases it will be sampling at the same rate (40hz) as the reference sensor and is
+        The refernce and station sensors data are read concurrently. Then the secondary sensor is used first
+        because in most cases it will be sampling at the same rate (40hz) as the reference sensor and is
         therefor better to use to run a correlation to identify and time offset between the reference and
         station sensors' timeseries
 
@@ -1283,8 +1437,22 @@ class APSurvey(object):
         self.waveform_files = []
         sensors_available = 0  # need 2+ to do any comparisons
 
-        # read reference sensor data
-        data_ok = self._read_ref_data(dataset)
+        # drop conditioned data left over from a previous run of this dataset
+        self._conditioned_cache = {key: data for key, data in self._conditioned_cache.items()
+                                   if key[0] != dataset}
+
+        # read reference and station sensor data concurrently. Each load is dominated by
+        # subprocess and disk I/O, so this takes about as long as the slowest single load.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            ref_load = executor.submit(self._read_ref_data, dataset)
+            sec_load = executor.submit(self._read_sensor_data, dataset, 'sec') \
+                if self.sec_sensor_installed else None
+            pri_load = executor.submit(self._read_sensor_data, dataset, 'pri') \
+                if self.pri_sensor_installed else None
+        # all loads are complete here, before any ref clock correction
+
+        # check reference sensor data
+        data_ok = ref_load.result()
         compare_ref = data_ok
         if not data_ok:
             self.logmsg(logging.WARN, 'Unable to process {} REFERENCE sensor data.'.format(
@@ -1293,9 +1461,9 @@ class APSurvey(object):
         else:
             sensors_available += 1
 
-        # read 'sec' sta sensor if enabled/active in config
-        if self.sec_sensor_installed:
-            data_ok = self._read_sensor_data(dataset, 'sec')
+        # check 'sec' sta sensor if enabled/active in config
+        if sec_load:
+            data_ok = sec_load.result()
             compare_sec = data_ok
             if not data_ok:
                 self.logmsg(logging.WARN, 'Unable to process {} SECONDARY sensor data.'.format(
@@ -1313,9 +1481,9 @@ class APSurvey(object):
         else:
             compare_sec = False  # not installed
 
-        # read 'pri' sta sensor if enabled/active in config
-        if self.pri_sensor_installed:
-            data_ok = self._read_sensor_data(dataset, 'pri')
+        # check 'pri' sta sensor if enabled/active in config
+        if pri_load:
+            data_ok = pri_load.result()
             compare_pri = data_ok
             if not data_ok:
                 self.logmsg(logging.WARN, 'Unable to process {} PRIMARY sensor data.'.format(
@@ -1378,6 +1546,9 @@ class APSurvey(object):
                 sumf.write('#'*144 + '\n')
                 detf.write('#'*144 + '\n')
 
+        # persist any newly computed sensitivities
+        self._sys_sens_cache.save()
+
         return sumfn, detfn, self.waveform_files
 
     def _compare_streams(self, datatype, sens1, sens2):
@@ -1419,27 +1590,21 @@ class APSurvey(object):
         # grab Traces for both sensors
         strm1_z = self.trtpls[datatype][sens1].z
         strm1_1 = self.trtpls[datatype][sens1].n
-        strm1_2 = self.trtpls[datatype][sens1].e
         strm2_z = self.trtpls[datatype][sens2].z
         strm2_1 = self.trtpls[datatype][sens2].n
         strm2_2 = self.trtpls[datatype][sens2].e
 
-        # get responnse of sens1 computed for SR of sens2
-        # to convolve into timeseries of sens2
-        # strm1_z_resp = self.responses[sens1][sens2].z
-        # strm1_1_resp = self.responses[sens1][sens2].n
-        # strm1_2_resp = self.responses[sens1][sens2].e
-        strm1_z_sens = self.system_sensitivities[datatype][sens1].z
-        strm1_1_sens = self.system_sensitivities[datatype][sens1].n
-        strm1_2_sens = self.system_sensitivities[datatype][sens1].e
-
-        # get response of sens2 for deconvolving response
-        # strm2_z_resp = self.responses[sens2][sens2].z
-        # strm2_1_resp = self.responses[sens2][sens2].n
-        # strm2_2_resp = self.responses[sens2][sens2].e
-        strm2_z_sens = self.system_sensitivities[datatype][sens2].z
-        strm2_1_sens = self.system_sensitivities[datatype][sens2].n
-        strm2_2_sens = self.system_sensitivities[datatype][sens2].e
+        # get conditioned timeseries for both sensors. Sensor 1 N/E data is shared by
+        # both horizontal comparisons and is only processed once. As before, both sensor 1
+        # horizontals are scaled by the sensitivity of the sensor 1 component being compared
+        data1_z = self._conditioned_data(datatype, sens1, 'z')
+        data1_1_n = self._conditioned_data(datatype, sens1, 'n', sens_comp='n')
+        data1_2_n = self._conditioned_data(datatype, sens1, 'e', sens_comp='n')
+        data1_1_e = self._conditioned_data(datatype, sens1, 'n', sens_comp='e')
+        data1_2_e = self._conditioned_data(datatype, sens1, 'e', sens_comp='e')
+        data2_z = self._conditioned_data(datatype, sens2, 'z')
+        data2_1 = self._conditioned_data(datatype, sens2, 'n')
+        data2_2 = self._conditioned_data(datatype, sens2, 'e')
 
         # create a set of empty component results
         self.results = self.ChanTpl(z=APSurveyComponentResult('Z'),
@@ -1448,79 +1613,94 @@ class APSurvey(object):
 
         # analyze components
         self.logmsg(logging.DEBUG, 'Comparing verticals...')
-        self._compare_verticals(strm1_z, strm2_z, strm1_z_sens, strm2_z_sens, self.results.z)
+        self._compare_verticals(strm1_z, strm2_z, data1_z, data2_z, self.results.z)
         self.logmsg(logging.DEBUG, "Comparing '1' horizontals...")
-        self._compare_horizontals(strm1_1, strm1_2, strm2_1, strm1_1_sens, strm2_1_sens, self.results.n)  #CHECK PARAMS HERE
+        self._compare_horizontals(strm1_1, strm2_1, data1_1_n, data1_2_n, data2_1, self.results.n)
         self.logmsg(logging.DEBUG, "Comparing '2' horizontals...")
-        self._compare_horizontals(strm1_1, strm1_2, strm2_2, strm1_2_sens, strm2_2_sens, self.results.e)
+        self._compare_horizontals(strm1_1, strm2_2, data1_1_e, data1_2_e, data2_2, self.results.e)
         self.logmsg(logging.DEBUG, "Done comparing.")
 
         return self.results
 
-    def _compare_horizontals(self, tr1_n, tr1_e, tr2, tr1_resp, tr2_resp, results):
+    def _conditioned_data(self, dataset, sensor, comp, sens_comp=None):
         """
-        Compares tr2 from one sensor with the north and east (tr1_n, tr1_e) traces from the another sensor
-        to determine the relative orientation of tr2 WRT tr1_n and relative sensitivities.
-        The traces is are analyzed in segments of length specified in the config.
-        The current tr2 response is removed and the response from tr1 is applied
+        Returns the conditioned timeseries for one component of a sensor. The raw trace data is
+        rounded to an even number of samples, detrended, bandpassed, resampled to the analysis
+        sample rate and divided by the system sensitivity of component sens_comp (default comp).
 
-        Result is expressed as tr2 angle WRT to tr1_n.
-
-        Positive relative angles are clock-wise adn saved in radians
+        The conditioned data before sensitivity removal is memoized by (dataset, sensor, component,
+        bandpass, analysis sr) so each trace is processed once per survey run no matter how many
+        comparisons it takes part in. All conditioning steps are linear, so dividing by the
+        sensitivity last gives the same result as removing it first.
 
         Args:
-            tr1_n (Trace): sensor 1 ('baseline') north trace
-            tr1_e (Trace): sensor 1 ('baseline') east trace
-            tr2 (Trace): sensor 2 trace
-            tr1_resp (np.array): sensor 1 response to apply to tr2
-            tr2_resp (np.array): tr2 response to deconvolve
-            results (APSurveyComponentResult): COmponent results to assumulating individual segments results
+            dataset (str): 'azi' or 'abs'
+            sensor (str): 'ref', 'pri' or 'sec'
+            comp (str): 'z', 'n' or 'e' (ChanTpl field name)
+            sens_comp (str): ChanTpl field name of the system sensitivity to remove. Defaults to comp.
 
-        Returns: None
+        Returns:
+            (np.array): Conditioned float64 timeseries
 
         """
 
-        start_t = max(tr1_n.stats.starttime, tr2.stats.starttime)
-        tr1_sr = tr1_n.stats.sampling_rate
-        tr2_sr = tr2.stats.sampling_rate
+        sys_sens = getattr(self.system_sensitivities[dataset][sensor], sens_comp or comp)
+
+        key = (dataset, sensor, comp, self.bp_start, self.bp_stop, self.analysis_sample_rate)
+        if key in self._conditioned_cache:
+            return self._conditioned_cache[key] / sys_sens
 
-        # get raw float data
-        tr1_n_data = tr1_n.data.astype(float64)
-        tr1_e_data = tr1_e.data.astype(float64)
-        tr2_data = tr2.data.astype(float64)
+        tr = getattr(self.trtpls[dataset][sensor], comp)
+        tr_sr = tr.stats.sampling_rate
+
+        self.logmsg(logging.DEBUG, 'Conditioning {} {} {} timeseries...'.format(
+            dataset.upper(), sensor.upper(), tr.stats.channel))
+
+        # get timeseries data as numpy float64 array from insde Obspy trace objects
+        data = tr.data.astype(float64)
 
         # round timeseries to even number of samples
-        tr1_n_data = tr1_n_data[:round(len(tr1_n_data)/2)*2]
-        tr1_e_data = tr1_e_data[:round(len(tr1_e_data)/2)*2]
-        tr2_data = tr2_data[:round(len(tr2_data)/2)*2]
+        data = data[:round(len(data)/2)*2]
 
-        self.logmsg(logging.DEBUG, "Detrending/demeaning timeseries...")
+        # demean/detrend
+        data = ss.detrend(data, type='linear')
 
-        # need to demean/detrend
-        tr1_n_data = ss.detrend(tr1_n_data, type='linear')
-        tr1_e_data = ss.detrend(tr1_e_data, type='linear')
-        tr2_data = ss.detrend(tr2_data, type='linear')
+        # apply band pass filter with bounds from config
+        data = osf.bandpass(data, self.bp_start, self.bp_stop, tr_sr, zerophase=True)
 
-        self.logmsg(logging.DEBUG, "Dividing out system sensitivity from timeseries...")
+        # down sample to analysis SR
+        data = ss.resample(data, round(len(data) / (tr_sr / self.analysis_sample_rate)))
 
-        # remove system sensitivities from each timeseries
-        tr1_n_data /= tr1_resp # new 2022-07-06
-        tr1_e_data /= tr1_resp # new 2022-07-06
-        tr2_data /=  tr2_resp # new 2022-07-06
+        data.flags.writeable = False
+        self._conditioned_cache[key] = data
 
-        self.logmsg(logging.DEBUG, "Bandpassing timeseries...")
+        # remove system sensitivity from timeseries
+        return data / sys_sens
 
-        # apply band pass filter with bounds from config
-        tr1_n_data = osf.bandpass(tr1_n_data, self.bp_start, self.bp_stop, tr1_sr, zerophase=True)
-        tr1_e_data = osf.bandpass(tr1_e_data, self.bp_start, self.bp_stop, tr1_sr, zerophase=True)
-        tr2_data = osf.bandpass(tr2_data, self.bp_start, self.bp_stop, tr2_sr, zerophase=True)
+    def _compare_horizontals(self, tr1_n, tr2, tr1_n_data, tr1_e_data, tr2_data, results):
+        """
+        Compares tr2 from one sensor with the north and east (tr1_n, tr1_e) traces from the another sensor
+        to determine the relative orientation of tr2 WRT tr1_n and relative sensitivities.
+        The traces is are analyzed in segments of length specified in the config.
+        The timeseries data must already be conditioned (see _conditioned_data).
 
-        self.logmsg(logging.DEBUG, "Downsampling  timeseries...")
+        Result is expressed as tr2 angle WRT to tr1_n.
 
-        # resample all 3 timeseries to analisys SR
-        tr1_n_data = ss.resample(tr1_n_data, round(len(tr1_n_data) / (tr1_sr / self.analysis_sample_rate)))
-        tr1_e_data = ss.resample(tr1_e_data, round(len(tr1_e_data) / (tr1_sr / self.analysis_sample_rate)))
-        tr2_data = ss.resample(tr2_data, round(len(tr2_data) / (tr2_sr / self.analysis_sample_rate)))
+        Positive relative angles are clock-wise adn saved in radians
+
+        Args:
+            tr1_n (Trace): sensor 1 ('baseline') north trace
+            tr2 (Trace): sensor 2 trace
+            tr1_n_data (np.array): conditioned sensor 1 north timeseries
+            tr1_e_data (np.array): conditioned sensor 1 east timeseries
+            tr2_data (np.array): conditioned sensor 2 timeseries
+            results (APSurveyComponentResult): COmponent results to assumulating individual segments results
+
+        Returns: None
+
+        """
+
+        start_t = max(tr1_n.stats.starttime, tr2.stats.starttime)
 
         segment_size_samples = self.segment_size_secs * self.analysis_sample_rate
         trace_size = min(len(tr1_n_data), len(tr1_e_data), len(tr2_data))
@@ -1618,18 +1798,18 @@ class APSurvey(object):
             cur_sample += segment_size_samples
 
 
-    def _compare_verticals(self, tr1, tr2, tr1_resp, tr2_resp, results):
+    def _compare_verticals(self, tr1, tr2, tr1_data, tr2_data, results):
         """
         Compares the vertical component amplitudes of two traces from different sensors to determine the
         relative sensitivities of hte two components.
         The traces is are analyzed in segments of length specified in the config.
-        The current tr2 response is removed and the response from tr1 is applied
+        The timeseries data must already be conditioned (see _conditioned_data).
 
         Args:
             tr1 (Trace): sensor 1 ('baseline') trace
             tr2 (Trace): sensor 2 trace
-            tr1_resp (np.array): sensor 1 response to apply to tr2
-            tr2_resp (np.array): tr2 response to deconvolve
+            tr1_data (np.array): conditioned sensor 1 timeseries
+            tr2_data (np.array): conditioned sensor 2 timeseries
             results (APSurveyComponentResult): COmponent results to assumulating individual segments results
 
         Returns: None
@@ -1639,37 +1819,6 @@ class APSurvey(object):
         # find latest astarttime of the two traces.
         # The trace starttimes will be different when due to non-zero clock offset adjustment.
         start_t = max(tr1.stats.starttime, tr2.stats.starttime)
-        tr1_sr = tr1.stats.sampling_rate
-        tr2_sr = tr2.stats.sampling_rate
-
-        # get timeseries data as numpy float64 array from insde Obspy trace objects
-        tr1_data = tr1.data.astype(float64)
-        tr2_data = tr2.data.astype(float64)
-
-        # round timeseries to even number of samples
-        tr1_data = tr1_data[:round(len(tr1_data)/2)*2]
-        tr2_data = tr2_data[:round(len(tr2_data)/2)*2]
-
-        self.logmsg(logging.DEBUG, "Detrending/demeaning  timeseries...")
-        # demean/detrend
-        tr1_data = ss.detrend(tr1_data, type='linear')
-        tr2_data = ss.detrend(tr2_data, type='linear')
-
-        self.logmsg(logging.DEBUG, "Dividing out system sensitivities...")
-        # remove system sensitivities from each timeseries
-        tr1_data /= tr1_resp
-        tr2_data /= tr2_resp
-
-        self.logmsg(logging.DEBUG, "Bandpassing  timeseries...")
-        # apply band pass filter with bounds from config
-        tr1_data = osf.bandpass(tr1_data, self.bp_start, self.bp_stop, tr1_sr, zerophase=True)
-        tr2_data = osf.bandpass(tr2_data, self.bp_start, self.bp_stop, tr2_sr, zerophase=True)
-
-        self.logmsg(logging.DEBUG, f"Downsampling  timeseries of size {len(tr1_data)} to {len(tr1_data)/(tr1_sr / self.analysis_sample_rate)} ...")
-        # down sample to analysis SR
-        tr1_data = ss.resample(tr1_data, round(len(tr1_data) / (tr1_sr / self.analysis_sample_rate)))
-        self.logmsg(logging.DEBUG, f"Downsampling  timeseries of size {len(tr2_data)} to {len(tr2_data)/(tr2_sr / self.analysis_sample_rate)} ...")
-        tr2_data = ss.resample(tr2_data, round(len(tr2_data) / (tr2_sr / self.analysis_sample_rate)))
 
         segment_size_samples = self.segment_size_secs * self.analysis_sample_rate
         trace_size = min(len(tr1_data), len(tr2_data))
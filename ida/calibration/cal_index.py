@@ -0,0 +1,208 @@
+#######################################################################################################################
+# Copyright (C) 2016  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+"""Persistent index of the raw calibration archive directory tree and its qcal log files"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from ida.calibration.qcal_utils import parse_qcal_log
+
+# <cal_raw_dir>/<sta>/<loc>/<sensor>/<cal type>/<date dir>/<qcal files>
+CAL_ARCHIVE_DEPTH = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    PRIMARY KEY (parent, name)
+);
+CREATE TABLE IF NOT EXISTS qcal_logs (
+    relpath TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sta TEXT, loc TEXT, sensor TEXT, cal_type TEXT, datedir TEXT, stem TEXT,
+    fields TEXT,
+    dup_keys TEXT
+);
+"""
+
+
+class CalArchiveIndex(object):
+    """sqlite index of a raw calibration archive (IDA_CAL_RAW_DIR).
+
+    refresh() walks the directory tree, or a subtree of it, recording every entry down to the qcal files, and
+    parses all keys of new or modified qcal log files. The index persists between runs so later refreshes only
+    re-read changed logs and directory listings and log contents can be queried without touching the archive.
+    """
+
+    def __init__(self, cal_raw_dir, index_fn=None):
+        """
+        :param cal_raw_dir: Root of raw calibration archive
+        :type cal_raw_dir: str
+        :param index_fn: sqlite index file. Defaults to env IDA_CAL_INDEX_FILE or a file
+            per archive in ~/.cache/ida/cal_index
+        :type index_fn: str
+        """
+
+        self.cal_raw_dir = os.path.abspath(cal_raw_dir)
+        if not index_fn:
+            index_fn = os.environ.get('IDA_CAL_INDEX_FILE')
+        if not index_fn:
+            index_fn = os.path.join(os.path.expanduser('~'), '.cache', 'ida', 'cal_index',
+                                    hashlib.sha256(self.cal_raw_dir.encode()).hexdigest()[:16] + '.sqlite')
+        self.index_fn = index_fn
+
+        os.makedirs(os.path.dirname(os.path.abspath(index_fn)), exist_ok=True)
+        self._conn = sqlite3.connect(index_fn)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _walk(self, relparts, entries, logfiles):
+
+        dpath = os.path.join(self.cal_raw_dir, *relparts)
+        parent = '/'.join(relparts)
+        try:
+            with os.scandir(dpath) as dir_entries:
+                dir_entries = [entry for entry in dir_entries if not entry.name.startswith('.')]
+        except OSError as e:
+            logging.warning('Unable to index calibration directory {}: {}'.format(dpath, e))
+            return
+
+        for entry in dir_entries:
+            is_dir = entry.is_dir()
+            entries.append((parent, entry.name, int(is_dir)))
+            if is_dir and (len(relparts) < CAL_ARCHIVE_DEPTH - 1):
+                self._walk(relparts + (entry.name,), entries, logfiles)
+            elif (not is_dir) and (len(relparts) == CAL_ARCHIVE_DEPTH - 1) and entry.name.endswith('.log'):
+                stat = entry.stat()
+                logfiles[parent + '/' + entry.name] = (relparts, entry.name, stat.st_mtime, stat.st_size)
+
+    def refresh(self, *relparts):
+        """Walk the archive, or only the <cal_raw_dir>/<relparts...> subtree, and bring the index up to date.
+        Returns number of qcal logs (re)parsed."""
+
+        entries = []
+        logfiles = {}
+        self._walk(tuple(relparts), entries, logfiles)
+
+        prefix = '/'.join(relparts)
+        if prefix:
+            # rows of the subtree: parent is the subtree root or below it
+            entry_where = ' WHERE parent = ? OR substr(parent, 1, ?) = ?'
+            entry_args = (prefix, len(prefix) + 1, prefix + '/')
+            log_where = ' WHERE substr(relpath, 1, ?) = ?'
+            log_args = (len(prefix) + 1, prefix + '/')
+        else:
+            entry_where, entry_args, log_where, log_args = '', (), '', ()
+
+        indexed = {relpath: (mtime, size) for relpath, mtime, size in
+                   self._conn.execute('SELECT relpath, mtime, size FROM qcal_logs' + log_where, log_args)}
+
+        log_rows = []
+        for relpath, (log_relparts, fname, mtime, size) in logfiles.items():
+            if indexed.get(relpath) == (mtime, size):
+                continue
+            try:
+                with open(os.path.join(self.cal_raw_dir, relpath), 'rt', errors='replace') as logfl:
+                    fields, dup_keys = parse_qcal_log(logfl)
+            except OSError as e:
+                logging.warning('Unable to read qcal log {}: {}'.format(relpath, e))
+                continue
+            log_rows.append((relpath, mtime, size) + tuple(log_relparts) + (fname[:-len('.log')],
+                            json.dumps(fields), json.dumps(sorted(dup_keys))))
+
+        with self._conn:
+            self._conn.execute('DELETE FROM entries' + entry_where, entry_args)
+            self._conn.executemany('INSERT INTO entries VALUES (?, ?, ?)', entries)
+            self._conn.executemany('DELETE FROM qcal_logs WHERE relpath = ?',
+                                   [(relpath,) for relpath in indexed if relpath not in logfiles])
+            self._conn.executemany('INSERT OR REPLACE INTO qcal_logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   log_rows)
+
+        return len(log_rows)
+
+    def listdir(self, *relparts):
+        """Sorted names of the non-hidden entries in <cal_raw_dir>/<relparts...>, as of the last refresh"""
+
+        return [name for name, in self._conn.execute('SELECT name FROM entries WHERE parent = ? ORDER BY name',
+                                                     ('/'.join(relparts),))]
+
+    def qcal_log(self, sta, loc, sensor, cal_type, datedir, stem):
+        """All key values of a qcal log file, or None if it is not in the index"""
+
+        row = self._conn.execute('SELECT fields FROM qcal_logs WHERE sta = ? AND loc = ? AND sensor = ? AND '
+                                 'cal_type = ? AND datedir = ? AND stem = ?',
+                                 (sta, loc, sensor, cal_type, datedir, stem)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def qcal_log_file(self, logfilename):
+        """(key values, duplicated keys) of a qcal log file as indexed, or None if it is not in the index
+        or has changed since it was indexed"""
+
+        relpath = os.path.relpath(os.path.abspath(logfilename), self.cal_raw_dir)
+        if relpath.startswith(os.pardir):
+            return None
+        row = self._conn.execute('SELECT mtime, size, fields, dup_keys FROM qcal_logs WHERE relpath = ?',
+                                 (relpath.replace(os.sep, '/'),)).fetchone()
+        if not row:
+            return None
+        try:
+            stat = os.stat(logfilename)
+        except OSError:
+            return None
+        if (stat.st_mtime, stat.st_size) != (row[0], row[1]):
+            return None
+
+        return json.loads(row[2]), set(json.loads(row[3]))
+
+    def qcal_logs(self, **criteria):
+        """Query indexed qcal logs. Criteria may be any of sta, loc, sensor, cal_type, datedir and stem.
+
+        :return: List of dicts with the archive path keys, 'path' and the parsed log key values
+        :rtype: list
+        """
+
+        cols = ['sta', 'loc', 'sensor', 'cal_type', 'datedir', 'stem']
+        unknown = set(criteria) - set(cols)
+        if unknown:
+            raise ValueError('Invalid qcal log criteria: ' + ', '.join(sorted(unknown)))
+
+        where = ' AND '.join('{} = ?'.format(col) for col in criteria)
+        sql = 'SELECT relpath, {}, fields FROM qcal_logs'.format(', '.join(cols))
+        if where:
+            sql += ' WHERE ' + where
+        sql += ' ORDER BY relpath'
+
+        logs = []
+        for row in self._conn.execute(sql, tuple(criteria.values())):
+            log = dict(zip(cols, row[1:-1]))
+            log['path'] = os.path.join(self.cal_raw_dir, row[0])
+            log.update(json.loads(row[-1]))
+            logs.append(log)
+
+        return logs
@@ -33,6 +33,7 @@ from pandas.core.frame import DataFrame
 from ida.tui import select, SelectResult
 from ida.instruments import CALTYPE_RBLF, CALTYPE_RBHF, SEISMOMETER_MODELS
 from ida.calibration import nom_resp_for_model, cur_resp_for_model_station_comp, local_resp_files
+from ida.calibration.cal_index import CalArchiveIndex
 from ida.signals.paz import PAZ
 from ida.db.io import read
 from ida.db.query import get_stages
@@ -105,6 +106,8 @@ class CalInfo():
         self._hf_chn_stages = None
 
         self.ok = True
+        self.cal_index = None
+        self._cal_index_refreshed = set()
 
         if not config_file:
             self.mode = 'interactive'
@@ -115,6 +118,10 @@ class CalInfo():
             self.cur_paz_dir = cur_paz_dir
             self.db_dir = db_dir
 
+            # persistent index of the cal archive, each station/location subtree is refreshed when first listed
+            if cal_raw_dir and exists(cal_raw_dir):
+                self.cal_index = CalArchiveIndex(cal_raw_dir)
+
             # if not using configuration file, must access datascopedb
             # from db_dir and then to read stages into pandas dataframe
             self.db_dir = db_dir
@@ -254,6 +261,34 @@ class CalInfo():
 
         return valid
 
+    def refresh_cal_index(self, *relparts, force=False):
+        """Bring the archive index up to date for cal_raw_dir/<relparts...>, once per session unless force"""
+
+        if not self.cal_index:
+            return
+        relparts = tuple(relparts)
+        if not force and any(relparts[:len(done)] == done for done in self._cal_index_refreshed):
+            return
+        self.cal_index.refresh(*relparts)
+        self._cal_index_refreshed.add(relparts)
+
+    def raw_dir_list(self, *relparts):
+        """Sorted names in cal_raw_dir/<relparts...> from the archive index, if available"""
+
+        if self.cal_index:
+            self.refresh_cal_index(*relparts[:2])
+            return self.cal_index.listdir(*relparts)
+        else:
+            return sorted(Path(item).name for item in glob.glob(join(self.cal_raw_dir, *relparts, '*')))
+
+    def raw_paired_qcal_stems(self, cal_type, datedir):
+        """stems with both .ms and .log files in a raw cal date directory"""
+
+        names = self.raw_dir_list(self.sta, self.loc, self.sensor, cal_type, datedir)
+        log_stems = [name[:-len('.log')] for name in names if name.endswith('.log')]
+
+        return [name[:-len('.ms')] for name in names if name.endswith('.ms') and name[:-len('.ms')] in log_stems]
+
     def reset(self, key_list):
         for key in key_list:
             self._info[key] = None
@@ -455,11 +490,7 @@ class CalInfo():
                         self._info['lfdatedir'] = value
                         self.reset(['lffile', 'respfn', 'fullpaz', 'lfpert', 'hfpert'])
 
-                        ms_files = glob.glob(join(rbpath, '*.ms'))
-                        log_files = glob.glob(join(rbpath, '*.log'))
-                        ms_stems = [Path(msfn).stem for msfn in ms_files]
-                        log_stems = [Path(logfn).stem for logfn in log_files]
-                        paired_files = [stem for stem in ms_stems if stem in log_stems]
+                        paired_files = self.raw_paired_qcal_stems(CALTYPE_RBLF, value)
                         if len(paired_files) == 1:
                             self.lffile = paired_files[0]
 
@@ -500,11 +531,7 @@ class CalInfo():
                         self._info['hfdatedir'] = value
                         self.reset(['hffile'])
 
-                        ms_files = glob.glob(join(rbpath, '*.ms'))
-                        log_files = glob.glob(join(rbpath, '*.log'))
-                        ms_stems = [Path(msfn).stem for msfn in ms_files]
-                        log_stems = [Path(logfn).stem for logfn in log_files]
-                        paired_files = [stem for stem in ms_stems if stem in log_stems]
+                        paired_files = self.raw_paired_qcal_stems(CALTYPE_RBHF, value)
                         if len(paired_files) == 1:
                             self.hffile = paired_files[0]
 
@@ -671,7 +698,7 @@ class CalInfo():
     def select_raw_cal_sensordir(self):
 
         staloc_path = join(self.cal_raw_dir, self.sta, self.loc)
-        sensordirlist = glob.glob(join(staloc_path, '*'))
+        sensordirlist = self.raw_dir_list(self.sta, self.loc)
         sensordirlist = sorted([Path(item).stem for item in sensordirlist if Path(item).stem.upper() in SEISMOMETER_MODELS])
         list_len = len(sensordirlist)
 
@@ -845,7 +872,7 @@ class CalInfo():
         if cal_type not in [CALTYPE_RBLF, CALTYPE_RBHF]:
             raise ValueError('Invalid CAL TYPE supplied: ' + cal_type)
 
-        datedirlist = glob.glob(join(self.cal_raw_dir, self.sta, self.loc, self.sensor, cal_type, '*'))
+        datedirlist = self.raw_dir_list(self.sta, self.loc, self.sensor, cal_type)
         datedirlist = sorted([Path(item).stem for item in datedirlist])
 
         omit_option = [('S', 'Skip {} processing'.format(CalInfo.CAL_TYPE_TITLE[cal_type]))]
@@ -1015,7 +1042,7 @@ class CalInfo():
     def sensor_cnt(self):
 
         if self.sta and self.loc:
-            return len(glob.glob(join(self.cal_raw_dir, self.sta, self.loc, '*')))
+            return len(self.raw_dir_list(self.sta, self.loc))
         else:
             return 0
 
@@ -1024,7 +1051,7 @@ class CalInfo():
             raise ValueError('Invalid CAL TYPE supplied: ' + cal_type)
 
         if self.sta and self.loc and self.sensor:
-            return len(glob.glob(join(self.cal_raw_dir, self.sta, self.loc, self.sensor, cal_type, '*')))
+            return len(self.raw_dir_list(self.sta, self.loc, self.sensor, cal_type))
         else:
             return 0
 
@@ -1044,8 +1071,9 @@ class CalInfo():
             dpath = abspath(join(self.cal_raw_dir, self.sta, self.loc, self.sensor, cal_type, adate))
 
             if exists(dpath):
-                msfiles = glob.glob(join(dpath, '*.ms'))
-                logfiles = glob.glob(join(dpath, '*.log'))
+                datedir_names = self.raw_dir_list(self.sta, self.loc, self.sensor, cal_type, adate)
+                msfiles = [join(dpath, name) for name in datedir_names if name.endswith('.ms')]
+                logfiles = [join(dpath, name) for name in datedir_names if name.endswith('.log')]
 
                 if (len(msfiles) == 1) and (len(logfiles) == 1):
                     if cal_type == CALTYPE_RBLF:
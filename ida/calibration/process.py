@@ -19,29 +19,42 @@
 # If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
 # by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################################################
+import hashlib
 import logging
+import os
 from os.path import join
 
 from numpy import complex128, pi, ceil, sin, cos, angle, abs, linspace, multiply, \
     logical_and, less_equal, polyfit, polyval, \
-    divide, subtract, concatenate
+    divide, subtract, concatenate, empty, float64
 from numpy.fft import rfft, irfft
 from scipy.signal.windows import tukey
 import scipy.signal as ss
 
 from scipy.optimize import least_squares
-import obspy.signal.filter as osf
+from obspy import UTCDateTime
+import numpy as np
 
 import ida.calibration.qcal_utils
 from ida.signals.paz import PAZ
 import ida.signals.utils
 from ida.instruments import CALTYPE_RBLF, CALTYPE_RBHF, TRIAXIAL_SEIS_MODELS, \
-        TRIAXIAL_TRANSFORMS, XFRM_TYPE_XYZ2UVW, XFRM_TYPE_UVW2ENZ_ABS
+        TRIAXIAL_TRANSFORMS, XFRM_TYPE_XYZ2ENZ_ABS, \
+        SEIS_INVERT_CAL_CHAN, SEIS_INVERT_NORTH_CHAN, SEIS_INVERT_EAST_CHAN
 
 import matplotlib.pyplot as plt
 
 """utility functions for processing of IDA Random Binary calibration data"""
 
+# order of the values returned by prepare_cal_data, also the member names of cached bundles
+CAL_DATA_FIELDS = ('samp_rate_lf', 'start_time_lf', 'lf_inp_wth_resp', 'lf_out',
+                   'samp_rate_hf', 'start_time_hf', 'hf_inp_wth_resp', 'hf_out',
+                   'freqs_lf', 'freqs_hf', 'lf_snr', 'hf_snr')
+
+# part of the cached bundle key. Increment whenever prepare_cal_data processing or its
+# hard-coded constants (bandpass corners, taper fraction, etc) change
+CAL_DATA_PIPELINE_VERSION = 2
+
 def compare_component_response(freqs, paz1, paz2, norm_freq=0.05, mode='vel', phase_detrend=False):
     """Compute amp and pha response of paz1 against paz2.
 
@@ -253,7 +266,164 @@ def analyze_cal_component(fullpaz, lfpertndxs, hfpertndxs, opsr, lftf_f, lf_tf,
     return new_paz
 
 
-def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr):
+def cal_data_cache_fn(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr, cache_dir):
+    """Path of the cached prepare_cal_data bundle for the given qcal files and parameters.
+
+    The key is a hash of the LF and HF MiniSEED and log file contents, plus the sensor, component,
+    operating sample rate, the poles, zeros and fitting counts of fullpaz, CAL_DATA_PIPELINE_VERSION and
+    the sensor's polarity and component transform tables.
+
+    Args:
+        cache_dir (str): cache directory
+
+    Returns:
+        (str): .npz file path
+    """
+
+    hasher = hashlib.sha256()
+    for fpath, fname in ((lfpath, lffile), (hfpath, hffile)):
+        if fpath:
+            for ext in ('.ms', '.log'):
+                with open(join(fpath, fname + ext), 'rb') as calfl:
+                    for chunk in iter(lambda: calfl.read(1 << 20), b''):
+                        hasher.update(chunk)
+        else:
+            hasher.update(b'-')
+    hasher.update(repr((sensor.upper(), comp, float(opsr),
+                        fullpaz.mode, fullpaz.units, float(fullpaz.h0),
+                        tuple(fullpaz._poles_no_fitting_count),
+                        tuple(fullpaz._zeros_no_fitting_count))).encode())
+    hasher.update(fullpaz._poles.astype(complex128).tobytes())
+    hasher.update(fullpaz._zeros.astype(complex128).tobytes())
+    hasher.update(repr((CAL_DATA_PIPELINE_VERSION,
+                        sensor.upper() in SEIS_INVERT_CAL_CHAN,
+                        sensor.upper() in SEIS_INVERT_NORTH_CHAN,
+                        sensor.upper() in SEIS_INVERT_EAST_CHAN)).encode())
+    for xfrm_type, xfrm in sorted(TRIAXIAL_TRANSFORMS.get(sensor.upper(), {}).items()):
+        hasher.update(xfrm_type.encode())
+        hasher.update(np.asarray(xfrm, dtype=float64).tobytes())
+
+    return join(cache_dir, hasher.hexdigest() + '.npz')
+
+
+def load_cal_data_cache(cache_fn):
+    """Load a bundle written by save_cal_data_cache. Returns None if it is missing or unreadable."""
+
+    try:
+        with np.load(cache_fn, allow_pickle=False) as bundle:
+            vals = []
+            for field in CAL_DATA_FIELDS:
+                if field not in bundle.files:
+                    vals.append(None)
+                elif field.startswith('start_time'):
+                    vals.append(UTCDateTime(str(bundle[field])))
+                elif bundle[field].ndim == 0:
+                    vals.append(bundle[field].item())
+                else:
+                    vals.append(bundle[field])
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(cache_fn):
+            logging.warning('Ignoring unreadable calibration cache file {}: {}'.format(cache_fn, e))
+        return None
+
+    return tuple(vals)
+
+
+def save_cal_data_cache(cache_fn, cal_data):
+    """Write prepare_cal_data results to cache_fn as a compressed .npz bundle. None values are omitted."""
+
+    members = {}
+    for field, val in zip(CAL_DATA_FIELDS, cal_data):
+        if val is None:
+            continue
+        members[field] = str(val) if field.startswith('start_time') else val
+
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        tmp_fn = '{}.{}.tmp'.format(cache_fn, os.getpid())
+        with open(tmp_fn, 'wb') as cachefl:
+            np.savez_compressed(cachefl, **members)
+        os.replace(tmp_fn, cache_fn)
+    except OSError as e:
+        logging.warning('Unable to cache calibration data in {}: {}'.format(cache_fn, e))
+
+
+def zerophase_bandpass_response(freqs, freqmin, freqmax, samp_rate, corners=4):
+    """Amplitude response at freqs of obspy.signal.filter.bandpass(..., zerophase=True).
+
+    As with bandpass, a highpass at freqmin is used when freqmax is at or above Nyquist.
+    The forward/backward filtering of zerophase squares the amplitude response of the filter.
+
+    Args:
+        freqs (numpy.ndarray): Frequencies (Hz) to evaluate the response at
+        freqmin (float): Low corner (Hz)
+        freqmax (float): High corner (Hz)
+        samp_rate (float): Sample rate of the timeseries being filtered
+        corners (int): Filter corners (order)
+
+    Returns:
+        (numpy.ndarray): real amplitude response
+    """
+
+    fe = 0.5 * samp_rate
+    if freqmax / fe - 1.0 > -1e-6:
+        sos = ss.iirfilter(corners, freqmin / fe, btype='highpass', ftype='butter', output='sos')
+    else:
+        sos = ss.iirfilter(corners, [freqmin / fe, freqmax / fe], btype='band', ftype='butter', output='sos')
+    _, resp = ss.sosfreqz(sos, worN=freqs, fs=samp_rate)
+
+    return resp.real ** 2 + resp.imag ** 2
+
+
+def condition_hf_cal_data(inp, out, resp, bp_resp, taper, taper_bin_cnt):
+    """Condition HF cal input and output timeseries for fitting.
+
+    Equivalent to: demean, taper, bandpass, trim taper region, normalize and demean of the output and
+    demean, taper, convolve with resp, bandpass, trim, normalize and demean of the input. Both bandpass and
+    resp are applied as a single multiplication in frequency domain and the time domain steps reuse
+    one work buffer.
+
+    Args:
+        inp (numpy.ndarray): Cal input timeseries
+        out (numpy.ndarray): Measured output timeseries. Not modified.
+        resp (numpy.ndarray): Complex normalized response at the rfft frequencies of the timeseries
+        bp_resp (numpy.ndarray): Bandpass amplitude response at the same frequencies
+        taper (numpy.ndarray): Taper window, length of the timeseries
+        taper_bin_cnt (int): Samples trimmed off each end after filtering
+
+    Returns:
+        hf_inp_wth_resp (numpy.ndarray): conditioned input convolved with resp
+        hf_out (numpy.ndarray): conditioned output
+    """
+
+    npts = taper.size
+    work = empty(npts, dtype=float64)
+
+    def tapered_spectrum(data):
+        data = data[:npts]
+        subtract(data, data.mean(), out=work)
+        multiply(work, taper, out=work)
+        return rfft(work)
+
+    def trimmed_normalized(spec):
+        data = irfft(spec, npts)[taper_bin_cnt:npts - taper_bin_cnt]
+        data /= data.std()
+        data -= data.mean()
+        return data
+
+    spec = tapered_spectrum(out)
+    multiply(spec, bp_resp, out=spec)
+    hf_out = trimmed_normalized(spec)
+
+    spec = tapered_spectrum(inp)
+    multiply(spec, resp, out=spec)
+    multiply(spec, bp_resp, out=spec)
+    hf_inp_wth_resp = trimmed_normalized(spec)
+
+    return hf_inp_wth_resp, hf_out
+
+
+def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr, cache_dir=None, cal_index=None):
     """Prepares cal input and measured (output) timeseries for analysis.
 
 
@@ -284,6 +454,11 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
         sensor (str): sensor key string (should be one of SEISMOMETER_MODELS)
         comp (str): Component 'Z', '1', or '2'
         fullpaz (PAZ): Instance of PAZ that should be convolved with input signal
+        opsr (float): Operating sample rate of the channel
+        cache_dir (str): Directory of cached results. Defaults to env IDA_CAL_CACHE_DIR.
+            If neither is set, results are not cached.
+        cal_index (CalArchiveIndex): Index of the raw cal archive. qcal log values are taken from it
+            for indexed, unchanged log files.
 
     Returns:
         samp_rate_lf (float or int): Sample rate of LF calibration data
@@ -302,14 +477,28 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
 
     """
 
+    cache_fn = None
+    cache_dir = cache_dir or os.environ.get('IDA_CAL_CACHE_DIR')
+    if cache_dir:
+        try:
+            cache_fn = cal_data_cache_fn(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr, cache_dir)
+        except OSError as e:
+            logging.warning('Unable to hash calibration files for caching: {}'.format(e))
+        else:
+            cal_data = load_cal_data_cache(cache_fn)
+            if cal_data:
+                logging.info('Using cached calibration data: ' + cache_fn)
+                return cal_data
+
     if lfpath:
         ms_fpath_lf = join(lfpath, lffile + '.ms')
         log_fpath_lf = join(lfpath, lffile + '.log')
 
-        strm_lf, log_lf = ida.calibration.qcal_utils.read_qcal_files(ms_fpath_lf, log_fpath_lf)
+        raw_strm_lf, log_lf = ida.calibration.qcal_utils.load_qcal_files(ms_fpath_lf, log_fpath_lf,
+                                                                         cal_index=cal_index)
 
-        # trim settling and trailing times from traces
-        ida.signals.utils.trim_stream(strm_lf, left=log_lf['settling_time'], right=log_lf['trailing_time'])
+        # trim settling and trailing times from traces, only the trimmed samples are converted to float
+        strm_lf = ida.calibration.qcal_utils.qcal_analysis_stream(raw_strm_lf, log_lf)
 
         # reverse polarity for those seismometers that are funky...
         ida.signals.utils.check_and_fix_polarities(strm_lf, sensor.upper())
@@ -344,16 +533,16 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
 
         # prep output channels
         if comp == 'Z':
-            lf_out = cal_lf_tpl.vertical.data.copy()
+            lf_out_raw = cal_lf_tpl.vertical.data
         elif comp == '1':
-            lf_out = cal_lf_tpl.one.data.copy()
+            lf_out_raw = cal_lf_tpl.one.data
         elif comp == '2':
-            lf_out = cal_lf_tpl.two.data.copy()
+            lf_out_raw = cal_lf_tpl.two.data
         else:
             raise ValueError('Invalid component: ' + comp)
 
-        # trim of amount used to input time-series
-        lf_out = lf_out[taper_bin_cnt_lf:-taper_bin_cnt_lf]
+        # trim of amount used to input time-series, copying only the samples kept
+        lf_out = lf_out_raw[taper_bin_cnt_lf:-taper_bin_cnt_lf].copy()
 
         # normalize and de-mean
         lf_out.__itruediv__(lf_out.std())
@@ -381,10 +570,11 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
         ms_fpath_hf = join(hfpath, hffile + '.ms')
         log_fpath_hf = join(hfpath, hffile + '.log')
 
-        strm_hf, log_hf = ida.calibration.qcal_utils.read_qcal_files(ms_fpath_hf, log_fpath_hf)
+        raw_strm_hf, log_hf = ida.calibration.qcal_utils.load_qcal_files(ms_fpath_hf, log_fpath_hf,
+                                                                         cal_index=cal_index)
 
-        # trim settling and trailing times from traces
-        ida.signals.utils.trim_stream(strm_hf, left=log_hf['settling_time'], right=log_hf['trailing_time'])
+        # trim settling and trailing times from traces, only the trimmed samples are converted to float
+        strm_hf = ida.calibration.qcal_utils.qcal_analysis_stream(raw_strm_hf, log_hf)
         # for those seismometers that are funky...
         ida.signals.utils.check_and_fix_polarities(strm_hf, sensor.upper())
 
@@ -414,38 +604,18 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
 
         # prep output channels
         if comp == 'Z':
-            hf_out = cal_hf_tpl.vertical.data.copy()
+            hf_out_raw = cal_hf_tpl.vertical.data
         elif comp == '1':
-            hf_out = cal_hf_tpl.one.data.copy()
+            hf_out_raw = cal_hf_tpl.one.data
         elif comp == '2':
-            hf_out = cal_hf_tpl.two.data.copy()
+            hf_out_raw = cal_hf_tpl.two.data
         else:
             raise ValueError('Invalid component: ' + comp)
 
-        # new filtering
-        hf_out.__isub__(hf_out.mean())
-        hf_out = multiply(hf_out, taper_hf)
-        hf_out = osf.bandpass(hf_out, 0.45, opsr/2, samp_rate_hf, zerophase=True)
-        hf_out = hf_out[taper_bin_cnt_hf:-taper_bin_cnt_hf]
-
-        hf_out.__itruediv__(hf_out.std())
-        hf_out = ss.detrend(hf_out, type='constant')
-
-        cal_hf_tpl.input.data = ss.detrend(cal_hf_tpl.input.data, type='constant')
-
-        input_tapered       = multiply(cal_hf_tpl.input.data, taper_hf)
-        input_fft           = rfft(input_tapered)
-        inp_freqs_cnv_resp  = multiply(input_fft, resp_hf)
-        hf_inp_wth_resp     = irfft(inp_freqs_cnv_resp, npts_hf)
-
-        # apply bandpass filter
-        hf_inp_wth_resp.__isub__(hf_inp_wth_resp.mean())
-        hf_inp_wth_resp = osf.bandpass(hf_inp_wth_resp, 0.45, opsr/2, samp_rate_hf, zerophase=True)
-
-        # remove taper region, normalize and de-mean
-        hf_inp_wth_resp     = hf_inp_wth_resp[taper_bin_cnt_hf:-taper_bin_cnt_hf]
-        hf_inp_wth_resp.__itruediv__(hf_inp_wth_resp.std())
-        hf_inp_wth_resp = ss.detrend(hf_inp_wth_resp, type='constant')
+        # condition output and input in one pass each, bandpass applied with the response in frequency domain
+        hf_bp_resp = zerophase_bandpass_response(freqs_hf, 0.45, opsr/2, samp_rate_hf)
+        hf_inp_wth_resp, hf_out = condition_hf_cal_data(cal_hf_tpl.input.data, hf_out_raw, resp_hf, hf_bp_resp,
+                                                        taper_hf, taper_bin_cnt_hf)
 
         # plt.figure(111, figsize=(12, 8))
         # plt.plot(hf_inp_wth_resp[50000:52000], 'g')
@@ -459,9 +629,14 @@ def prepare_cal_data(lfpath, lffile, hfpath, hffile, sensor, comp, fullpaz, opsr
     else:
         samp_rate_hf, start_time_hf, hf_inp_wth_resp, hf_out, freqs_hf, hf_snr = None, None, None, None, None, None
 
-    return samp_rate_lf, start_time_lf, lf_inp_wth_resp, lf_out, \
-           samp_rate_hf, start_time_hf, hf_inp_wth_resp, hf_out, \
-           freqs_lf, freqs_hf, lf_snr, hf_snr
+    cal_data = samp_rate_lf, start_time_lf, lf_inp_wth_resp, lf_out, \
+               samp_rate_hf, start_time_hf, hf_inp_wth_resp, hf_out, \
+               freqs_lf, freqs_hf, lf_snr, hf_snr
+
+    if cache_fn:
+        save_cal_data_cache(cache_fn, cal_data)
+
+    return cal_data
 
 
 def triaxial_horizontal_magnitudes(cal_tpl, seis_model):
@@ -477,11 +652,11 @@ def triaxial_horizontal_magnitudes(cal_tpl, seis_model):
     """
 
     if seis_model in TRIAXIAL_SEIS_MODELS:
-        uvw = ida.signals.utils.channel_xform((cal_tpl.two,
+        # XYZ -> UVW -> ENZ_ABS in one pass using the fused transform
+        enz = ida.signals.utils.channel_xform((cal_tpl.two,
                                                cal_tpl.one,
                                                cal_tpl.vertical),
-                                              TRIAXIAL_TRANSFORMS[seis_model][XFRM_TYPE_XYZ2UVW])
-        enz = ida.signals.utils.channel_xform(uvw, TRIAXIAL_TRANSFORMS[seis_model][XFRM_TYPE_UVW2ENZ_ABS])
+                                              TRIAXIAL_TRANSFORMS[seis_model][XFRM_TYPE_XYZ2ENZ_ABS])
         new_cal_tpl = ida.calibration.qcal_utils.QCalData(two=enz[0],
                                                           one=enz[1],
                                                           vertical=enz[2],
@@ -24,7 +24,8 @@ import logging
 import os.path
 
 from numpy import float64
-from obspy.core.stream import read
+from obspy.core.stream import read, Stream
+from obspy.core.trace import Trace
 # from ida.ida_obspy import read_mseed
 
 """Methods, types and constants specifically for processing data produced by the IDA qcal binary application"""
@@ -107,23 +108,162 @@ def read_qcal_files(qcal_ms_filename, qcal_log_filename):
     return cal_strm, log_info
 
 
-def read_qcal_log(logfilename):
+def load_qcal_files(qcal_ms_filename, qcal_log_filename, cal_index=None):
+    """Reads QCal miniseed and log files keeping the raw integer samples.
+
+    Unlike read_qcal_files, samples are not converted to float and aligning the traces to a common end time
+    only shortens views of the raw data. Use qcal_analysis_stream to get float timeseries of the portions
+    actually analyzed.
+
+    :param qcal_ms_filename: Miniseed filename (with path)
+    :type qcal_ms_filename: str
+    :param qcal_log_filename: Log filename (with path)
+    :type qcal_log_filename: str
+    :param cal_index: Index of the raw cal archive used for the log values, see read_qcal_log
+    :type cal_index: ida.calibration.cal_index.CalArchiveIndex
+    :return:
+        (IDAStream object containing raw timeseries from miniseed file,
+        dictionary with qcal log file information.
+    :rtype: (ida.signals.stream.IDAStream, dict)
+    """
+
+    # imported here so the vendored libmseed is only needed when reading natively
+    from ida.ida_obspy import read_mseed
+
+    qcal_ms_filename = os.path.abspath(qcal_ms_filename)
+    if not os.path.exists(qcal_ms_filename):
+        msg = "QCal Miniseed file not found '{}'".format(qcal_ms_filename)
+        logging.error(msg)
+        raise Exception(msg)
+
+    qcal_log_filename = os.path.abspath(qcal_log_filename)
+    if not os.path.exists(qcal_log_filename):
+        msg = "QCal Log file not found '{}'".format(qcal_log_filename)
+        logging.error(msg)
+        raise Exception(msg)
+
+    cal_strm = read_mseed(qcal_ms_filename)
+
+    if len(cal_strm) < 4:
+        msg = "Fewer than 4 traces found in qcal miniseed file '{}'".format(qcal_ms_filename)
+        logging.error(msg)
+        raise Exception(msg)
+
+    inp_strm = cal_strm.select(channel=INPUT_CHANNEL_WILDCARD)
+    if len(inp_strm) != 1:
+        msg = "Invalid number of input traces: {} found in qcal miniseed file '{}'".format(
+            len(inp_strm),
+            qcal_ms_filename
+        )
+        logging.error(msg)
+        raise Exception(msg)
+
+    # trim to same end time to account for qcal 'watchdog exit'
+    end_time_min = min([tr.endtime for tr in cal_strm])
+    for tr in cal_strm:
+        extra = int(round((tr.endtime - end_time_min) * tr.sampling_rate))
+        if extra > 0:
+            tr.data = tr.data[:tr.npts - extra]
+
+    log_info = read_qcal_log(qcal_log_filename, cal_index=cal_index)
+
+    return cal_strm, log_info
+
+
+def qcal_analysis_stream(cal_strm, log_info, dtype=float64):
+    """Stream with the settling and trailing time trimmed portion of each raw qcal trace, converted to dtype.
+
+    Only the trimmed samples are converted. The result matches read_qcal_files followed by
+    ida.signals.utils.trim_stream with the log settling and trailing times.
+
+    :param cal_strm: Raw qcal traces as returned by load_qcal_files
+    :type cal_strm: ida.signals.stream.IDAStream
+    :param log_info: qcal log information with 'settling_time' and 'trailing_time'
+    :type log_info: dict
+    :param dtype: numpy datatype of returned samples
+    :type dtype: np.dtype
+    :return: Trimmed traces
+    :rtype: obspy.core.stream.Stream
+    """
+
+    traces = []
+    for tr in cal_strm:
+        sr = tr.sampling_rate
+        start_ndx = int(round(log_info['settling_time'] * sr))
+        end_ndx = tr.npts - int(round(log_info['trailing_time'] * sr))
+        header = {
+            'network': tr.network,
+            'station': tr.station,
+            'location': tr.location,
+            'channel': tr.channel,
+            'sampling_rate': sr,
+            'starttime': tr.starttime + start_ndx / sr,
+        }
+        traces.append(Trace(header=header, data=tr.data[start_ndx:max(start_ndx, end_ndx)].astype(dtype)))
+
+    return Stream(traces=traces)
+
+
+# qcal log key names that differ from the names used in the log info dict
+QCAL_LOG_KEY_ALIASES = {
+    'trailer_time': 'trailing_time',
+}
+QCAL_LOG_REQUIRED_KEYS = ['settling_time', 'trailing_time']
+
+
+def qcal_log_key(file_key):
+    """Dictionary key for a qcal log 'key = value' line key, ie 'settling time' => 'settling_time'"""
+
+    key = '_'.join(file_key.lower().split())
+    return QCAL_LOG_KEY_ALIASES.get(key, key)
+
+
+def parse_qcal_log(logfl):
+    """parse all 'key = value' lines of an open qcal v 2.1 log file in a single pass.
+
+    Values whose first word is numeric are returned as float, others as the stripped text after the '='.
+
+    :param logfl: Open qcal log file (or any iterable of lines)
+    :type logfl: file
+    :return: Dictionary containing log file information and set of keys found on more than one line
+    :rtype: (dict, set)
+    """
+
+    cal_log = {}
+    dup_keys = set()
+
+    for line in logfl:
+        file_key, sep, val = line.partition(' = ')
+        if not sep:
+            continue
+        key = qcal_log_key(file_key)
+        if not key:
+            continue
+        if key in cal_log:
+            dup_keys.add(key)
+
+        val = val.strip()
+        try:
+            cal_log[key] = float(val.split()[0])
+        except (IndexError, ValueError):
+            cal_log[key] = val
+
+    return cal_log, dup_keys
+
+
+def read_qcal_log(logfilename, cal_index=None):
     """parse qcal v 2.1 log file
-    Currently only care about 'settling time' and 'trailing time'
+    All 'key = value' lines are returned. 'settling time' and 'trailer time' (as 'trailing_time') are required.
 
     :param logfilename: Log filename (with path)
     :type logfilename: str
+    :param cal_index: Index of the raw cal archive. Log values are taken from the index when the file
+        is indexed and unchanged
+    :type cal_index: ida.calibration.cal_index.CalArchiveIndex
     :return: Dictionary containinglog file information
     :rtype: dict
     """
 
-    # for now, only
-    log_key_info = [
-        ('settling time', 'settling_time', 3),
-        ('trailer time', 'trailing_time', 3)
-        ]
-
-    cal_log = {}
     logfilename = os.path.abspath(logfilename)
 
     if not os.path.exists(logfilename):
@@ -131,18 +271,18 @@ def read_qcal_log(logfilename):
         logging.error(msg)
         raise Exception(msg)
 
-    with open(logfilename, 'rt') as logfl:
-        lines = logfl.readlines()
-
-        for file_key, dict_key, val_pos in log_key_info:
-            matches = [line.strip() for line in lines if line.find(file_key + ' =') > -1]
-            if len(matches) != 1:
-                raise Exception("Zero or multiple '{}' lines in qcal log file '{}'".format(file_key, logfilename))
-            val = matches[0].split()[val_pos]
-            cal_log[dict_key] = float(val)
-
-    if len(cal_log) != len(log_key_info):
-        raise Exception("Error parsing file: '{}'. Expected {} keys to be found".format(logfilename, len(log_key_info)))
+    indexed = cal_index.qcal_log_file(logfilename) if cal_index else None
+    if indexed:
+        cal_log, dup_keys = indexed
+    else:
+        with open(logfilename, 'rt') as logfl:
+            cal_log, dup_keys = parse_qcal_log(logfl)
+
+    for key in QCAL_LOG_REQUIRED_KEYS:
+        if (key not in cal_log) or (key in dup_keys):
+            raise Exception("Zero or multiple '{}' lines in qcal log file '{}'".format(key, logfilename))
+        if not isinstance(cal_log[key], float):
+            raise Exception("Error parsing file: '{}'. Invalid '{}' value".format(logfilename, key))
 
     return cal_log
 
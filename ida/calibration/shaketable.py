@@ -25,7 +25,9 @@ from os.path import exists, join, isfile  #  , abspath, split, isdir
 #from pathlib import Path
 import yaml
 import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import logging
+import multiprocessing
 
 from numpy import float32, logical_and, less_equal, greater_equal, greater, \
     polyfit, polyval, subtract, log10, ceil, floor
@@ -37,10 +39,10 @@ plt.ion()
 
 #from fabulous.color import red, bold
 from obspy.core import read, Stream, UTCDateTime
-from obspy.signal.invsim import evalresp
 
 from ida import IDA_PKG_VERSION_HASH_STR, IDA_PKG_VERSION_DATETIME
 from ida.calibration.cross import cross_correlate
+from ida.signals.utils import cached_evalresp
 
 def rename_chan(inchan):
 
@@ -120,6 +122,65 @@ def shake_table_tf_plot(figid, datadir, comp, freqs, amp, pha, coh, add_title_te
 
     return fig
 
+# Deferred plot: kind is a key of PLOT_FUNCS, args/kwargs are passed to the plot function
+# after the figure id (the filename).
+PlotSpec = collections.namedtuple('PlotSpec', ['kind', 'filename', 'args', 'kwargs', 'dpi'])
+
+PLOT_FUNCS = {
+    'psd': shake_table_psd_plot,
+    'tf': shake_table_tf_plot,
+}
+
+PLOT_FORMATS = ['png', 'svg', 'none']
+
+
+def render_plot(spec):
+    """Render a PlotSpec, save it and close the figure.
+
+    :param spec: plot to render
+    :type spec: PlotSpec
+    :return: plot filename
+    :rtype: str
+    """
+
+    fig = PLOT_FUNCS[spec.kind](spec.filename, *spec.args, **spec.kwargs)
+    fig.savefig(spec.filename, dpi=spec.dpi)
+    plt.close(fig)
+
+    return spec.filename
+
+
+def _init_plot_worker():
+    plt.switch_backend('Agg')
+
+
+def render_plots(specs, workers=1):
+    """Render a list of PlotSpecs, serially or in a process pool using the Agg backend.
+
+    The pool uses the 'spawn' start method, which re-imports the calling script's main module
+    in each worker. Scripts using more than 1 worker must guard their top level code with
+    ``if __name__ == '__main__':``.
+
+    :param specs: plots to render
+    :type specs: list
+    :param workers: Number of worker processes. Default 1 renders plots serially in this process.
+        None uses the number of CPUs.
+    :type workers: int
+    :return: plot filenames, in specs order
+    :rtype: list
+    """
+
+    if not specs:
+        return []
+
+    if workers == 1:
+        return [render_plot(spec) for spec in specs]
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_plot_worker) as executor:
+        return list(executor.map(render_plot, specs))
+
 class ShakeConfig(object):
 
     # for cleanup of (mostly) past crud.
@@ -167,6 +228,15 @@ class ShakeConfig(object):
         self.stream = None
         self.traces = {}
 
+        # per channel miniseed files written in the background by prepare_traces
+        self._ms_writer = None
+        self._ms_writes = []
+
+        # reference responses and reference data convolved with them, shared by all channels
+        # analyzed in this session (see _ref_response and _ref_with_resp)
+        self._ref_resps = {}
+        self._refs_with_resp = {}
+
         self._config = yaml.load('')
         with open(fn, 'rt') as cfl:
             config_txt = cfl.read()
@@ -258,6 +328,10 @@ class ShakeConfig(object):
         if 'plot_settings' not in self._config:
             self.ok = False
             self.logger.error('Missing entry in configuration file: ' + 'plot_settings')
+        elif self._config['plot_settings'].get('format', 'png').lower() not in PLOT_FORMATS:
+            self.ok = False
+            self.logger.error('Invalid plot_settings/format in configuration file. Must be one of: ' +
+                              ', '.join(PLOT_FORMATS))
         if 'smoothing_factor' not in self._config:
             self.ok = False
             self.logger.error('Missing entry in configuration file: ' + 'smoothing_factor')
@@ -285,6 +359,21 @@ class ShakeConfig(object):
     def plot_max_freq(self):
         return self._config['plot_settings']['end_freq']
 
+    @property
+    def plot_format(self):
+        # 'png' (default), 'svg' or 'none' to skip plotting
+        return self._config['plot_settings'].get('format', 'png').lower()
+
+    @property
+    def plot_dpi(self):
+        return self._config['plot_settings'].get('dpi', 400)
+
+    @property
+    def plot_workers(self):
+        # number of plot rendering processes. Default 1 renders serially. More than 1
+        # requires the calling script to have an "if __name__ == '__main__':" guard
+        return self._config['plot_settings'].get('workers', 1)
+
     @property
     def coherence_cutoff(self):
         return self._config['coherence_cutoff']
@@ -293,6 +382,16 @@ class ShakeConfig(object):
     def smoothing_factor(self):
         return self._config['smoothing_factor']
 
+    @property
+    def save_chan_ms(self):
+        # optional. write traces for each channel to <data_dir>_<chan>.ms
+        return self._config.get('save_chan_ms', True)
+
+    @property
+    def resp_cache_dir(self):
+        # optional. cached_evalresp picks default if None
+        return self._config.get('resp_cache_dir')
+
     @property
     def components(self):
         return self._config['components']
@@ -331,11 +430,28 @@ class ShakeConfig(object):
 
         return res
 
+    def _components_time_window(self):
+        """Earliest starttime and latest endtime of the components in config.
+        Returns (None, None) if they can not be determined."""
+
+        try:
+            starts = [UTCDateTime(meta['starttime']) for meta in self.components]
+            ends = [UTCDateTime(meta['endtime']) for meta in self.components]
+        except:
+            return None, None
+
+        if not starts:
+            return None, None
+
+        return min(starts), max(ends)
+
     def read_msfile(self):
 
         if exists(self.ms_filename) and isfile(self.ms_filename):
+            # only decode records within the time span of the components being analyzed
+            starttime, endtime = self._components_time_window()
             try:
-                self.stream = read(self.ms_filename)
+                self.stream = read(self.ms_filename, starttime=starttime, endtime=endtime)
             except:
                 self.logger.critical('Error reading miniseed file: ' + self.ms_filename)
             else:
@@ -346,6 +462,38 @@ class ShakeConfig(object):
 
         return self.stream
 
+    def _save_chan_traces_async(self, chan, fn, strm):
+        """Write strm to fn in a background thread. Call wait_chan_traces_saved() to collect results"""
+
+        if not self._ms_writer:
+            self._ms_writer = ThreadPoolExecutor(max_workers=1)
+        self._ms_writes.append((chan, fn, self._ms_writer.submit(self.save_chan_traces, fn, strm)))
+
+    def wait_chan_traces_saved(self):
+        """Wait for background channel trace writes to finish, record the files written and stop the writer thread.
+
+        Called by analyze(). Callers using prepare_traces() without analyze() must call it, or use
+        the ShakeConfig as a context manager, to check the writes.
+        """
+
+        for chan, fn, future in self._ms_writes:
+            if not future.result():
+                print('Error writing shaketable traces for channel: {} to file: {}.'.format(chan, fn))
+            else:
+                self.ms_fns.append(fn)
+                self.logger.debug('Saved {} traces in: {}'.format(chan, fn))
+        self._ms_writes = []
+
+        if self._ms_writer:
+            self._ms_writer.shutdown(wait=True)
+            self._ms_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wait_chan_traces_saved()
+
     def save_chan_traces(self, fn, strm):
 
         try:
@@ -356,10 +504,7 @@ class ShakeConfig(object):
             return True
 
 
-    def correlate_channel_traces(self, chan_trace, ref_trace, sample_rate, shake_m_per_volt, digi_sens_cnts_per_volt, **kwargs):
-
-        cross_results = {}
-        npts = ref_trace.stats.npts
+    def _ref_resp_filepath(self, ref_trace):
 
         # construct RESP file filename for ref_trace
         resp_file = 'RESP.{}.{}.{}.{}'.format(
@@ -368,40 +513,68 @@ class ShakeConfig(object):
             ref_trace.stats.location,
             ref_trace.stats.channel
         )
-        resp_filepath = join(self.respfile_dir, resp_file)
-
-        fresp, f = evalresp(1/sample_rate,
-                            ref_trace.stats.npts,
-                            resp_filepath,
-                            ref_trace.stats.starttime,
-                            station=ref_trace.stats.station,
-                            channel=ref_trace.stats.channel,
-                            network=ref_trace.stats.network,
-                            locid=ref_trace.stats.location,
-                            units='DIS', freq=True )
-
-        # Convolving ref data with nominal response...
-        refdata    = ref_trace.data.astype(float32)
-        mean       = refdata.mean()
-        refdata   -= mean
-        refdata_fft    = rfft(refdata)
-        refdata_fft   *= fresp
-        ref_wth_resp  = irfft(refdata_fft, npts)
-        ref_wth_resp *= (shake_m_per_volt/digi_sens_cnts_per_volt)
+        return join(self.respfile_dir, resp_file)
+
+    def _ref_response(self, ref_trace, sample_rate):
+        """Displacement response of ref_trace sensor on the rfft freq grid of ref_trace.
+        Each distinct (RESP file, npts, sample rate, time) is only evaluated once per session,
+        and evaluated responses are cached on disk across sessions (see cached_evalresp)."""
+
+        resp_filepath = self._ref_resp_filepath(ref_trace)
+        key = (resp_filepath, ref_trace.stats.npts, sample_rate, str(ref_trace.stats.starttime))
+        if key not in self._ref_resps:
+            fresp, f = cached_evalresp(1/sample_rate,
+                                       ref_trace.stats.npts,
+                                       resp_filepath,
+                                       ref_trace.stats.starttime,
+                                       station=ref_trace.stats.station,
+                                       channel=ref_trace.stats.channel,
+                                       network=ref_trace.stats.network,
+                                       locid=ref_trace.stats.location,
+                                       units='DIS', freq=True,
+                                       cache_dir=self.resp_cache_dir)
+            self._ref_resps[key] = fresp
+
+        return self._ref_resps[key]
+
+    def _ref_with_resp(self, ref_trace, sample_rate, shake_m_per_volt, digi_sens_cnts_per_volt):
+        """Reference data convolved with the nominal reference response and scaled to meters,
+        with 20 samples trimmed from both ends. Computed once for channels sharing a reference
+        channel and time window. The returned array is read-only."""
+
+        key = (ref_trace.id, str(ref_trace.stats.starttime), ref_trace.stats.npts, sample_rate,
+               shake_m_per_volt, digi_sens_cnts_per_volt)
+        if key not in self._refs_with_resp:
+            npts = ref_trace.stats.npts
+            fresp = self._ref_response(ref_trace, sample_rate)
+
+            # Convolving ref data with nominal response...
+            refdata    = ref_trace.data.astype(float32)
+            mean       = refdata.mean()
+            refdata   -= mean
+            refdata_fft    = rfft(refdata)
+            refdata_fft   *= fresp
+            ref_wth_resp  = irfft(refdata_fft, npts)
+            ref_wth_resp *= (shake_m_per_volt/digi_sens_cnts_per_volt)
+
+            # trim 20 smaples off both ends.
+            ref_wth_resp = ref_wth_resp[20:-20]
+            ref_wth_resp.flags.writeable = False
+            self._refs_with_resp[key] = ref_wth_resp
+
+        return self._refs_with_resp[key]
+
+    @staticmethod
+    def _cross_channel(chan_trace, ref_wth_resp, sample_rate, smoothing_factor):
 
         # trim 20 smaples off both ends.
-        ref_wth_resp = ref_wth_resp[20:-20]
         outdata = chan_trace.data[20:-20].astype(float32)
 
-    #    if 'smoothing_factor' in kwargs:
-    #        sf = kwargs['smoothing_factor']
-    #    else:
-    #        sf = 0.5
-        sf = kwargs.get('smoothing_factor', 0.5)
         # noinspection PyTupleAssignmentBalance
         freqs, amp, pha, coh, psd1, psd2, _, _, _ = cross_correlate(sample_rate,
                                                                     outdata,
-                                                                    ref_wth_resp, smoothing_factor=sf)
+                                                                    ref_wth_resp,
+                                                                    smoothing_factor=smoothing_factor)
 
         cross_results = {
             'freqs': freqs,
@@ -416,6 +589,47 @@ class ShakeConfig(object):
 
         return cross_results
 
+    def correlate_channel_traces(self, chan_trace, ref_trace, sample_rate, shake_m_per_volt, digi_sens_cnts_per_volt, **kwargs):
+
+        ref_wth_resp = self._ref_with_resp(ref_trace, sample_rate, shake_m_per_volt, digi_sens_cnts_per_volt)
+
+    #    if 'smoothing_factor' in kwargs:
+    #        sf = kwargs['smoothing_factor']
+    #    else:
+    #        sf = 0.5
+        sf = kwargs.get('smoothing_factor', 0.5)
+
+        return self._cross_channel(chan_trace, ref_wth_resp, sample_rate, sf)
+
+    def correlate_all_channels(self, max_workers=None):
+        """Cross correlate every prepared channel with its reference channel.
+
+        The reference responses and convolved reference data are computed first, serially,
+        since evalresp is not thread safe and channels may share them. The per channel
+        cross spectral work then runs in a thread pool.
+
+        :param max_workers: Max number of threads. Default is ThreadPoolExecutor default.
+        :type max_workers: int
+        :return: cross correlation results for each channel, in self.traces order
+        :rtype: collections.OrderedDict
+        """
+
+        refs = {}
+        for chan, chaninfo in self.traces.items():
+            refs[chan] = self._ref_with_resp(chaninfo['wf_ref'],
+                                             self.sample_rate,
+                                             self.shake_table_meters_per_volt(chan[2],
+                                                                              chaninfo['wf'].stats.starttime.datetime),
+                                             self.digi_cnts_per_volt())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = collections.OrderedDict()
+            for chan, chaninfo in self.traces.items():
+                futures[chan] = executor.submit(self._cross_channel, chaninfo['wf'], refs[chan],
+                                                self.sample_rate, self.smoothing_factor)
+
+        return collections.OrderedDict((chan, future.result()) for chan, future in futures.items())
+
     def prepare_traces(self):
 
         if self.stream:
@@ -446,8 +660,10 @@ class ShakeConfig(object):
                     end = UTCDateTime(meta['endtime'])
                 except:
                     raise ValueError('\nError parsing endtime: ' + meta['endtime'])
-                wf = self.stream.select(channel=chan).copy().trim(start, end)
-                wf_ref = self.stream.select(channel=ref_chan).copy().trim(start, end)
+                # slice returns traces with their own stats but data that is a view
+                # into self.stream. Data must not be modified in place.
+                wf = self.stream.select(channel=chan).slice(start, end)
+                wf_ref = self.stream.select(channel=ref_chan).slice(start, end)
                 #print('CHAN:', chan, wf)
                 #print('REF: ', ref_chan, wf_ref)
                 if wf and wf_ref:
@@ -463,12 +679,9 @@ class ShakeConfig(object):
                     #self.traces[chan]['wf_ref'].stats.loc = vals['loc']
                     self.traces[chan]['wf_ref'].stats.station = self.ref_sensor_station
 
-                    fn = '{}_{}.ms'.format(self.data_dir, chan)
-                    if not self.save_chan_traces(fn, Stream([wf[0], wf_ref[0]])):
-                        print('Error writing shaketable traces for channel: {} to file: {}.'.format(chan, fn))
-                    else:
-                        self.ms_fns.append(fn)
-                        self.logger.debug('Saved {} traces in: {}'.format(chan, fn))
+                    if self.save_chan_ms:
+                        fn = '{}_{}.ms'.format(self.data_dir, chan)
+                        self._save_chan_traces_async(chan, fn, Stream([wf[0], wf_ref[0]]))
                 else:
                     self.logger.debug(str(self.stream))
                     if not wf:
@@ -535,6 +748,12 @@ class ShakeConfig(object):
     def save_footer(self, resfl):
         resfl.write('#'*144 + '\n')
 
+    def _add_plot(self, plot_specs, kind, fn_root, *args):
+        """Append PlotSpec for plot kind to plot_specs unless plotting is turned off in config"""
+
+        if self.plot_format != 'none':
+            plot_specs.append(PlotSpec(kind, '{}.{}'.format(fn_root, self.plot_format), args, {}, self.plot_dpi))
+
     def analyze(self):
 
 # TODO: Add header to results file with all parameters
@@ -545,24 +764,24 @@ class ShakeConfig(object):
             resfl = open(resfn, 'wt')
         except:
             self.logger.critical('\nError opening results file: ' + resfn + '\n')
+            self.wait_chan_traces_saved()
             return self.plot_fns, self.ms_fns, ''
 
         self.save_header(resfl, analdate)
 
+        # cross spectral analysis of all channels, sharing reference spectra
+        all_cross_res = self.correlate_all_channels()
+
+        # plots are collected during analysis and rendered after all channels are done
+        plot_specs = []
+
         for chan, chaninfo in self.traces.items():
 
             wf = chaninfo['wf']
-            wf_ref = chaninfo['wf_ref']
             starttime = wf.stats.starttime
             endtime = wf.stats.endtime
 
-            cross_res = self.correlate_channel_traces(wf,
-                                                      wf_ref,
-                                                      self.sample_rate,
-                                                      self.shake_table_meters_per_volt(chan[2],
-                                                                                       starttime.datetime),
-                                                      self.digi_cnts_per_volt(),
-                                                      smoothing_factor=self.smoothing_factor)
+            cross_res = all_cross_res[chan]
 
             # get ndxs of good coh in freq_band
             min_freq = self.plot_min_freq
@@ -577,17 +796,10 @@ class ShakeConfig(object):
             am = cross_res['amp'][use_freqs]
             ph = cross_res['pha'][use_freqs]
 
-            fig_fn = '{}_{}_psd_fig.png'.format(self.data_dir, chan)
-            psd_fig = shake_table_psd_plot(fig_fn, self.data_dir, chan, fr, ps1, ps2, co)
-            psd_fig.savefig(fig_fn, dpi=400)
-            self.plot_fns.append(fig_fn)
-            self.logger.debug('{} PSD plot saved in: {}'.format(chan, fig_fn))
-
-            fig_fn = '{}_{}_tf_fig1.png'.format(self.data_dir, chan)
-            tf_fig_1 = shake_table_tf_plot(fig_fn, self.data_dir, chan, fr, am, ph, co)
-            tf_fig_1.savefig(fig_fn, dpi=400)
-            self.plot_fns.append(fig_fn)
-            self.logger.debug('{} TF plot saved in: {}'.format(chan, fig_fn))
+            self._add_plot(plot_specs, 'psd', '{}_{}_psd_fig'.format(self.data_dir, chan),
+                           self.data_dir, chan, fr, ps1, ps2, co)
+            self._add_plot(plot_specs, 'tf', '{}_{}_tf_fig1'.format(self.data_dir, chan),
+                           self.data_dir, chan, fr, am, ph, co)
 
             # detrend and take only "good" coh points
             # now just coh >= coh_min
@@ -605,12 +817,9 @@ class ShakeConfig(object):
             ph = subtract(ph, correction)
 
             # construct plot with only good coh points
-            fig_fn = '{}_{}_tf_fig2.png'.format(self.data_dir, chan)
-            tf_fig_2 = shake_table_tf_plot(fig_fn, self.data_dir, chan, fr, am, ph, co,
-                                           '\n(coh**2 >= {}; Phase de-trended)'.format(coh_min))
-            tf_fig_2.savefig(fig_fn, dpi=400)
-            self.plot_fns.append(fig_fn)
-            self.logger.debug('{} TF (coh filtered) plot saved in: {}'.format(chan, fig_fn))
+            self._add_plot(plot_specs, 'tf', '{}_{}_tf_fig2'.format(self.data_dir, chan),
+                           self.data_dir, chan, fr, am, ph, co,
+                           '\n(coh**2 >= {}; Phase de-trended)'.format(coh_min))
 
             # calculate overall values to save
             amp_mn = am.mean()
@@ -632,5 +841,11 @@ class ShakeConfig(object):
 
         self.logger.debug('Results saved to: ' + resfn)
 
+        for fig_fn in render_plots(plot_specs, workers=self.plot_workers):
+            self.plot_fns.append(fig_fn)
+            self.logger.debug('Plot saved in: {}'.format(fig_fn))
+
+        self.wait_chan_traces_saved()
+
         return self.plot_fns, self.ms_fns, resfn
 
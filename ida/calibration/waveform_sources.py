@@ -0,0 +1,138 @@
+#######################################################################################################################
+# Copyright (C) 2016  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+"""Waveform sources used by APSurvey to retrieve station sensor timeseries.
+
+Each source is constructed for one sensor and time window and provides:
+
+    read()        returns an obspy Stream with the sensor's data
+    files         list of waveform files created or read, to report to the user
+    label         name reported as the sensor's ms file in the results files
+    prepped_file  file the trimmed/merged data should be written back to, or None
+                  if the data is kept only in memory
+"""
+import os
+
+from obspy import read, Stream
+
+from ida.utils import i10get, pimseed, arc_raw_ms_files
+
+
+class MiniSEEDFileSource(object):
+    """Sensor data in a local miniseed file with ONLY the needed channels and time period."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = [filename]
+        self.label = os.path.abspath(filename)
+        self.prepped_file = os.path.abspath(filename)
+
+    def read(self):
+        return read(self.filename)
+
+
+class MiniSEEDArchiveSource(object):
+    """Sensor data read directly, in memory, from the day files of the IDA miniseed archive.
+
+    Only the records within starttime/endtime are decoded. No intermediate files are written.
+    """
+
+    def __init__(self, ms_arc_dir, net, sta, chans, loc, starttime, endtime):
+        """
+        Args:
+            ms_arc_dir (str): Root of miniseed archive with structure <ms_arc_dir>/sta/year/oday
+            net (str): Network code
+            sta (str): Station code
+            chans (list): Channel codes
+            loc (str): Location code
+            starttime (UTCDateTime): Start of time window
+            endtime (UTCDateTime): End of time window
+        """
+        self.ms_arc_dir = ms_arc_dir
+        self.net = net.upper()
+        self.sta = sta.upper()
+        self.chans = [chan.upper() for chan in chans]
+        self.loc = loc.upper()
+        self.starttime = starttime
+        self.endtime = endtime
+        self.files = []
+        self.label = '{}.{}.{}.{}'.format(self.net, self.sta, self.loc, ','.join(self.chans))
+        self.prepped_file = None
+
+    def read(self):
+        traces = []
+        for chan in self.chans:
+            ms_files = arc_raw_ms_files(self.ms_arc_dir, self.net, self.sta, chan, self.loc,
+                                        self.starttime, self.endtime)
+            for ms_file in ms_files:
+                traces.extend(read(ms_file, format='MSEED',
+                                   starttime=self.starttime, endtime=self.endtime))
+            self.files.extend(ms_files)
+
+        if not traces:
+            raise ValueError('No miniseed archive data found for {}'.format(self.label))
+
+        return Stream(traces=traces)
+
+
+class IDA10ArchiveSource(object):
+    """Sensor data retrieved from the IDA10 archive with i10get and converted to miniseed with imseed.
+
+    The .i10 and .ms files are written using outname as the root of the file names.
+    """
+
+    def __init__(self, i10_arc_dir, sta, chans, loc, starttime, endtime, outname):
+        """
+        Args:
+            i10_arc_dir (str): Root of IDA10 archive
+            sta (str): Station code
+            chans (list): Channel codes
+            loc (str): Location code
+            starttime (UTCDateTime): Start of time window
+            endtime (UTCDateTime): End of time window
+            outname (str): Root of output file names
+        """
+        self.i10_arc_dir = i10_arc_dir
+        self.sta = sta
+        self.chanlocs = ','.join([chan.lower() + loc.upper() for chan in chans])
+        self.starttime = starttime
+        self.endtime = endtime
+        self.i10_name = outname + '.i10'
+        self.ms_name = outname + '.ms'
+        self.files = [self.i10_name, self.ms_name]
+        self.label = os.path.abspath(self.ms_name)
+        self.prepped_file = os.path.abspath(self.ms_name)
+
+    def read(self):
+        if os.path.exists(self.i10_name):
+            os.remove(self.i10_name)
+        if os.path.exists(self.ms_name):
+            os.remove(self.ms_name)
+
+        # get IDA10 data and convert to miniseed
+        i10get(self.i10_arc_dir,
+               self.sta,
+               self.chanlocs,
+               self.starttime, self.endtime,
+               outfn=self.i10_name)
+        pimseed(self.sta, self.i10_name, self.ms_name)
+
+        return read(self.ms_name)
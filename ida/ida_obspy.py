@@ -27,20 +27,27 @@ from ida.signals.stream import IDAStream
 
 """IDA Wrapper around subset of Obspy functionality"""
 
-def read_mseed(file_name_or_object, dtype=None):
+def read_mseed(file_name_or_object, dtype=None, starttime=None, endtime=None):
     """Read miniseed data from specified file and optionally cast to type dtype.
 
+    With starttime and/or endtime only the records needed for the time window are decoded when the file
+    holds a single channel in chronological order (e.g. an archive day file).
+
     :param file_name_or_object: filename or stream to read from
     :type file_name_or_object: str, file
     :param dtype: numpy datatype to cast raw sample values to
     :type dtype: np.dtype
+    :param starttime: Only read samples at or after starttime
+    :type starttime: ida.obspy.core.utcdatetime.UTCDateTime
+    :param endtime: Only read samples at or before endtime
+    :type endtime: ida.obspy.core.utcdatetime.UTCDateTime
     :return: IDAStream instance consting of IDATraces with miniseed raw data
     :rtype: IDAStream
     """
 
     if _is_mseed(file_name_or_object):
 
-        tracelist = _read_mseed(file_name_or_object)
+        tracelist = _read_mseed(file_name_or_object, starttime=starttime, endtime=endtime) or []
 
         idatracelist = []
         for trace in tracelist:
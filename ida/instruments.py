@@ -21,7 +21,7 @@
 #######################################################################################################################
 
 from collections import namedtuple
-from numpy import sqrt
+from numpy import sqrt, dot
 
 """Instrument properties and related application constants and structures.
 
@@ -233,6 +233,7 @@ TR360SV_UVW2ENZ_ABS = [
 
 XFRM_TYPE_XYZ2UVW = 'XYZ2UVW'
 XFRM_TYPE_UVW2ENZ_ABS = 'UVW2ENZ_ABS'
+XFRM_TYPE_XYZ2ENZ_ABS = 'XYZ2ENZ_ABS'
 
 TRIAXIAL_TRANSFORMS = {
     SEISTYPE_STS2: {
@@ -282,6 +283,11 @@ TRIAXIAL_TRANSFORMS = {
 
 }
 
+# XYZ -> UVW -> ENZ_ABS fused into a single matrix so the components are only transformed once
+for _xfrms in TRIAXIAL_TRANSFORMS.values():
+    _xfrms[XFRM_TYPE_XYZ2ENZ_ABS] = dot(_xfrms[XFRM_TYPE_UVW2ENZ_ABS], _xfrms[XFRM_TYPE_XYZ2UVW])
+del _xfrms
+
 CTBTO_SEIS_MODELS = [
     SEISTYPE_STS25,
     SEISTYPE_STS25F
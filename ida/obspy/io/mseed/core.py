@@ -8,13 +8,14 @@ from future.builtins import *  # NOQA
 from future.utils import native_str
 
 import ctypes as C
+import mmap
 import os
 import warnings
 from struct import pack
 import sys
 
 # import numpy as np
-from numpy import empty, array, fromfile, fromstring, int8
+from numpy import empty, array, frombuffer, int8
 
 # from obspy import Stream, Trace
 from ida.obspy.core.utcdatetime import UTCDateTime
@@ -108,6 +109,84 @@ def _is_mseed(filename):
         return False
 
 
+def _window_record_range(bfr_np, record_length, byteorder, starttime=None,
+                         endtime=None):
+    """
+    Record numbers of the records that may contain samples between starttime
+    and endtime, found by binary search of the record start times.
+
+    Only valid for files of fixed length data records of a single channel in
+    chronological order (e.g. archive day files). Only the fixed headers of
+    the first and last record and of the records probed by the search are
+    read, so only their pages of a memory-mapped file are touched. Each of
+    them is checked to be a valid data record of the channel of the first
+    record and their start times to be in record order. Returns (first, stop)
+    record numbers, or None if the buffer is not such a file and has to be
+    decoded completely.
+    """
+    if not record_length or len(bfr_np) % record_length:
+        return None
+    nrecs = len(bfr_np) // record_length
+    if nrecs < 2:
+        return None
+
+    # record number: (SEED id bytes, start time in epoch ns)
+    probed = {}
+
+    def record_start(recno):
+        if recno not in probed:
+            hdrs = util._record_header_view(bfr_np, 1, record_length,
+                                            byteorder,
+                                            offset=recno * record_length)
+            hdr = hdrs[0]
+            if hdr['dataquality'] not in (b'D', b'R', b'Q', b'M') or \
+                    not 1 <= hdr['julday'] <= 366 or hdr['hour'] > 23 or \
+                    hdr['minute'] > 59 or hdr['second'] > 60 or \
+                    hdr['fract'] > 9999:
+                raise ValueError('not a data record')
+            seed_id = (hdr['network'], hdr['station'], hdr['location'],
+                       hdr['channel'])
+            start_ns = int(util._record_start_ns(hdrs)[0])
+            probed[recno] = (seed_id, start_ns)
+        seed_id, start_ns = probed[recno]
+        if seed_id != probed[0][0]:
+            raise ValueError('not a single channel file')
+        return start_ns
+
+    def first_record_after(time_ns):
+        # first record number starting after time_ns
+        lo, hi = 0, nrecs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record_start(mid) > time_ns:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    try:
+        record_start(0)
+        record_start(nrecs - 1)
+        first = 0
+        stop = nrecs
+        if starttime is not None:
+            # records before the last one starting at or before starttime end
+            # before starttime
+            first = max(first_record_after(util._to_ns(starttime)) - 1, 0)
+        if endtime is not None:
+            stop = first_record_after(util._to_ns(endtime))
+    except ValueError:
+        return None
+
+    # a search through records out of time order may miss the window
+    starts = [probed[recno][1] for recno in sorted(probed)]
+    if any(later < earlier for earlier, later in zip(starts, starts[1:])):
+        return None
+
+    # keep at least one record, the selection in libmseed drops it if needed
+    return first, max(stop, first + 1)
+
+
 def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
                 sourcename=None, reclen=None, details=False,
                 header_byteorder=None, verbose=None, **kwargs):
@@ -254,12 +333,20 @@ def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
             'byteorder': info['byteorder'],
             'number_of_records': info['number_of_records']}
 
-    # If it's a file name just read it.
+    # If it's a file name map it, only the pages of records actually decoded
+    # are read from disk. The copy-on-write mapping keeps the buffer writable
+    # for libmseed without touching the file.
+    mm = None
     if isinstance(mseed_object, (str, native_str)):
-        # Read to NumPy array which is used as a buffer.
-        bfr_np = fromfile(mseed_object, dtype=int8)
+        with open(mseed_object, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+        if mm is not None:
+            bfr_np = frombuffer(mm, dtype=int8)
+        else:
+            bfr_np = empty(0, dtype=int8)
     elif hasattr(mseed_object, 'read'):
-        bfr_np = fromstring(mseed_object.read(), dtype=int8)
+        bfr_np = frombuffer(bytearray(mseed_object.read()), dtype=int8)
 
     # Get the record length
     try:
@@ -289,7 +376,6 @@ def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
             continue
         break
     bfr_np = bfr_np[offset:]
-    buflen = len(bfr_np)
 
     # If no selection is given pass None to the C function.
     if starttime is None and endtime is None and sourcename is None:
@@ -327,6 +413,22 @@ def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
                 encode('ascii', 'ignore')
         else:
             selections.srcname = b'*'
+
+    # Skip records outside of the requested time window without decoding (or
+    # paging in) them.
+    window_offset = 0
+    if starttime is not None or endtime is not None:
+        rec_range = _window_record_range(
+            bfr_np, info['record_length'], bo or info['byteorder'],
+            starttime=starttime, endtime=endtime)
+        if rec_range is not None:
+            if mm is not None and hasattr(mmap, 'MADV_RANDOM'):
+                mm.madvise(mmap.MADV_RANDOM)
+            window_offset = rec_range[0] * info['record_length']
+            bfr_np = bfr_np[window_offset:
+                            rec_range[1] * info['record_length']]
+    buflen = len(bfr_np)
+
     all_data = []
 
     # Use a callback function to allocate the memory and keep track of the
@@ -363,6 +465,11 @@ def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
                        "beginning. Make sure to add that to the reported "
                        "offset to get the actual location in the file." % (
                            msg, offset))
+            if window_offset and "offset" in msg:
+                msg = ("%s Only the records of the requested time window were "
+                       "read, starting %i bytes after the dataless part. Add "
+                       "that to the reported offset as well." % (
+                           msg, window_offset))
             _errs_and_warnings.append((msg, InternalMSEEDReadingWarning))
 
     diag_print = C.CFUNCTYPE(C.c_void_p, C.c_char_p)(log_error_or_warning)
@@ -381,6 +488,12 @@ def _read_mseed(mseed_object, starttime=None, endtime=None, headonly=False,
         reclen, C.c_int8(verbose), C.c_int8(details), header_byteorder,
         alloc_data, diag_print, log_print)
 
+    # decoded samples are in the arrays from allocate_data, the file mapping
+    # is no longer needed
+    del bfr_np
+    if mm is not None:
+        mm.close()
+
     for _i in _errs_and_warnings:
         if isinstance(_i, InternalMSEEDReadingError):
             raise _i
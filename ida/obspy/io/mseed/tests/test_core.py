@@ -0,0 +1,124 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import numpy as np
+import obspy
+
+from ida.ida_obspy import read_mseed
+from ida.obspy.core.utcdatetime import UTCDateTime
+from ida.obspy.io.mseed import util
+from ida.obspy.io.mseed.core import _window_record_range
+
+RECLEN = 512
+
+
+def write_day_file(fn, channels=('BHZ',), sampling_rate=2.0, npts=86400):
+    """Archive style file, one channel after the other, returns the samples"""
+
+    data = np.arange(npts, dtype=np.int32) % 1000
+    traces = [obspy.Trace(data, header={'network': 'II', 'station': 'PFO', 'location': '00', 'channel': chan,
+                                        'sampling_rate': sampling_rate,
+                                        'starttime': obspy.UTCDateTime(2020, 1, 1)})
+              for chan in channels]
+    obspy.Stream(traces).write(str(fn), format='MSEED', reclen=RECLEN, encoding='STEIM2', byteorder='>')
+    return data
+
+
+def test_window_record_range(tmp_path):
+
+    fn = tmp_path / 'day.ms'
+    write_day_file(fn)
+    bfr = np.fromfile(str(fn), dtype=np.int8)
+    nrecs = len(bfr) // RECLEN
+    t0 = UTCDateTime(2020, 1, 1)
+
+    first, stop = _window_record_range(bfr, RECLEN, '>', t0 + 3600, t0 + 7200)
+    assert 0 < first < stop < nrecs
+    assert _window_record_range(bfr, RECLEN, '>', t0 - 10, None) == (0, nrecs)
+    assert _window_record_range(bfr, RECLEN, '>', t0 + 90000, None) == (nrecs - 1, nrecs)
+    assert _window_record_range(bfr, RECLEN, '>', None, t0 - 10) == (0, 1)
+
+    # second half of the records in reverse order, seen by the probes of the search
+    shuffled = bfr.copy().reshape(nrecs, RECLEN)
+    shuffled[nrecs // 2:] = shuffled[nrecs // 2:][::-1]
+    assert _window_record_range(shuffled.ravel(), RECLEN, '>', t0 + 3600, t0 + 7200) is None
+
+
+def test_window_record_range_reads_few_headers(tmp_path, monkeypatch):
+
+    fn = tmp_path / 'day.ms'
+    write_day_file(fn)
+    bfr = np.fromfile(str(fn), dtype=np.int8)
+    nrecs = len(bfr) // RECLEN
+    t0 = UTCDateTime(2020, 1, 1)
+
+    rows = []
+    record_header_view = util._record_header_view
+
+    def counting_view(buf, count, *args, **kwargs):
+        rows.append(count)
+        return record_header_view(buf, count, *args, **kwargs)
+
+    monkeypatch.setattr(util, '_record_header_view', counting_view)
+    assert _window_record_range(bfr, RECLEN, '>', t0 + 3600, t0 + 7200) is not None
+    # first and last record plus the probes of two binary searches
+    assert sum(rows) <= 2 + 2 * nrecs.bit_length()
+    assert sum(rows) < nrecs // 5
+
+
+def test_window_record_range_multiple_channels(tmp_path):
+
+    fn = tmp_path / 'multi.ms'
+    write_day_file(fn, channels=('BHZ', 'BH1'))
+    bfr = np.fromfile(str(fn), dtype=np.int8)
+    t0 = UTCDateTime(2020, 1, 1)
+
+    assert _window_record_range(bfr, RECLEN, '>', t0 + 3600, t0 + 7200) is None
+
+
+def assert_window_samples(strm, data, t0, starttime, endtime):
+    """Traces hold the window (selection is at record granularity) and the matching samples"""
+
+    for tr in strm:
+        first = int(round((tr.starttime.timestamp - t0.timestamp) * tr.sampling_rate))
+        assert tr.starttime.timestamp <= starttime.timestamp
+        assert tr.endtime.timestamp >= endtime.timestamp
+        assert tr.npts < len(data)
+        np.testing.assert_array_equal(tr.data, data[first:first + tr.npts])
+
+
+def test_read_mseed_window(tmp_path):
+
+    fn = tmp_path / 'day.ms'
+    data = write_day_file(fn)
+    t0 = UTCDateTime(2020, 1, 1)
+
+    strm = read_mseed(str(fn), starttime=t0 + 3600, endtime=t0 + 7200)
+    assert len(strm) == 1
+    assert_window_samples(strm, data, t0, t0 + 3600, t0 + 7200)
+
+    # multiplexed file is decoded completely, same selection
+    fn = tmp_path / 'multi.ms'
+    write_day_file(fn, channels=('BHZ', 'BH1'))
+    strm = read_mseed(str(fn), starttime=t0 + 3600, endtime=t0 + 7200)
+    assert sorted(tr.channel for tr in strm) == ['BH1', 'BHZ']
+    assert_window_samples(strm, data, t0, t0 + 3600, t0 + 7200)
@@ -0,0 +1,234 @@
+#######################################################################################################################
+# Copyright (C) 2024  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import os
+
+import numpy as np
+import obspy
+import pytest
+
+from ida.obspy.core.utcdatetime import UTCDateTime
+from ida.obspy.io.mseed.util import (build_record_index, load_record_index, write_record_index,
+                                     set_flags_in_fixed_headers, shift_time_of_file, RECORD_INDEX_SUFFIX,
+                                     _record_header_view)
+
+T0 = obspy.UTCDateTime(2020, 1, 1)
+
+
+def make_trace(channel='BHZ', starttime=T0, npts=20000, sampling_rate=20.0):
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': channel,
+              'sampling_rate': sampling_rate, 'starttime': starttime}
+    return obspy.Trace(np.arange(npts, dtype=np.int32) % 1000, header=header)
+
+
+def write_mseed(fn, traces, reclen=512, byteorder='>'):
+    obspy.Stream(traces).write(str(fn), format='MSEED', reclen=reclen, encoding='STEIM2', byteorder=byteorder)
+    return str(fn)
+
+
+def test_record_index_round_trip(tmp_path):
+
+    fn = write_mseed(tmp_path / 'multi.ms', [make_trace('BHZ'), make_trace('BHE')])
+
+    index = build_record_index(fn)
+    assert len(index) == os.path.getsize(fn) // 512
+    assert (index['offset'] == np.arange(len(index)) * 512).all()
+    assert set(index['channel']) == {'BHZ', 'BHE'}
+    assert index['npts'][index['channel'] == 'BHZ'].sum() == 20000
+    assert (index['sampling_rate'] == 20.0).all()
+
+    assert not os.path.exists(fn + RECORD_INDEX_SUFFIX)
+    ridx = load_record_index(fn)
+    assert os.path.exists(fn + RECORD_INDEX_SUFFIX)
+    np.testing.assert_array_equal(ridx.records, index)
+    assert ridx.seed_ids() == ['II.PFO.00.BHE', 'II.PFO.00.BHZ']
+    np.testing.assert_array_equal(load_record_index(fn, build=False).records, index)
+
+    # a modified file makes the sidecar out of date
+    write_mseed(fn, [make_trace('BHZ')])
+    with pytest.raises(IOError):
+        load_record_index(fn, build=False)
+    assert load_record_index(fn).seed_ids() == ['II.PFO.00.BHZ']
+
+    index_fn = write_record_index(fn, index_filename=str(tmp_path / 'other.npz'))
+    assert len(load_record_index(fn, index_filename=index_fn, build=False)) == len(build_record_index(fn))
+
+
+def test_record_index_gaps_and_availability(tmp_path):
+
+    # 1000 s of data, a 500 s gap and another 1000 s on BHZ, BHE without a gap
+    fn = write_mseed(tmp_path / 'gaps.ms', [make_trace('BHZ'), make_trace('BHZ', starttime=T0 + 1500),
+                                            make_trace('BHE', npts=50000)])
+    ridx = load_record_index(fn, write=False)
+    t0 = UTCDateTime(T0.timestamp)
+
+    gaps = ridx.get_gaps()
+    assert len(gaps) == 1
+    sid, gap_start, gap_end = gaps[0]
+    assert sid == 'II.PFO.00.BHZ'
+    assert gap_start.timestamp == pytest.approx((t0 + 1000).timestamp)
+    assert gap_end.timestamp == pytest.approx((t0 + 1500).timestamp)
+
+    spans = ridx.availability('II.PFO.00.BHZ')
+    assert [(round(start - t0), round(end - t0)) for _, start, end in spans] == [(0, 1000), (1500, 2500)]
+    assert [(round(start - t0), round(end - t0)) for _, start, end in ridx.availability('II.PFO.00.BHE')] == \
+        [(0, 2500)]
+
+    recs = ridx.select('II.PFO.00.BHZ', t0 + 1200, t0 + 1600)
+    assert len(recs) and (recs['channel'] == 'BHZ').all()
+    assert recs['starttime_ns'].min() >= int((t0 + 1500).timestamp * 1e9)
+    ranges = ridx.byte_ranges('II.PFO.00.BHZ', t0 + 1200, t0 + 1600)
+    assert sum(length for _, length in ranges) == 512 * len(recs)
+
+
+def test_record_index_blockette_100_sample_rate(tmp_path):
+
+    # not exactly representable by the fixed header rate factor and multiplier, written to blockette 100
+    fn = write_mseed(tmp_path / 'b100.ms', [make_trace(sampling_rate=20.000123)])
+
+    index = build_record_index(fn)
+    np.testing.assert_allclose(index['sampling_rate'], np.float32(20.000123))
+    duration_ns = np.round(index['npts'] * 1e9 / index['sampling_rate']).astype('i8')
+    np.testing.assert_array_equal(index['endtime_ns'] - index['starttime_ns'], duration_ns)
+
+
+def test_record_index_rejects_variable_record_lengths(tmp_path):
+
+    fn_512 = write_mseed(tmp_path / 'r512.ms', [make_trace('BHZ')], reclen=512)
+    fn_1024 = write_mseed(tmp_path / 'r1024.ms', [make_trace('BHE')], reclen=1024)
+    fn = str(tmp_path / 'mixed.ms')
+    with open(fn, 'wb') as fh:
+        for part in (fn_512, fn_1024):
+            with open(part, 'rb') as src:
+                fh.write(src.read())
+
+    with pytest.raises(ValueError, match='Variable record lengths'):
+        build_record_index(fn)
+
+
+def read_bytes(fn):
+    with open(fn, 'rb') as fh:
+        return fh.read()
+
+
+def to_ns(time):
+    return int(round(time.timestamp * 1e9))
+
+
+@pytest.mark.parametrize('byteorder', ['>', '<'])
+def test_set_flags_in_fixed_headers(tmp_path, byteorder):
+
+    fn = write_mseed(tmp_path / 'flags.ms', [make_trace('BHZ'), make_trace('BHE')], byteorder=byteorder)
+    original = read_bytes(fn)
+    t0 = UTCDateTime(T0.timestamp)
+    flags = {'II.PFO.00.BHZ': {'activity_flags': {'calib_signal': True,
+                                                  'event_in_progress': {'DURATION': [(t0 + 200, t0 + 300)]}},
+                               'io_clock_flags': {'clock_locked': True}}}
+
+    out_fn = str(tmp_path / 'out.ms')
+    set_flags_in_fixed_headers(fn, flags, output_file=out_fn)
+    assert read_bytes(fn) == original
+
+    # in place gives the same file
+    set_flags_in_fixed_headers(fn, flags)
+    assert read_bytes(fn) == read_bytes(out_fn)
+    assert len(read_bytes(fn)) == len(original)
+
+    index = build_record_index(fn)
+    bhz = index['channel'] == 'BHZ'
+    np.testing.assert_array_equal((index['activity_flags'] & 0x01) != 0, bhz)
+    np.testing.assert_array_equal((index['io_clock_flags'] & 0x20) != 0, bhz)
+    in_event = bhz & (index['endtime_ns'] > to_ns(t0 + 200)) & (index['starttime_ns'] <= to_ns(t0 + 300))
+    assert 0 < in_event.sum() < bhz.sum()
+    np.testing.assert_array_equal((index['activity_flags'] & 0x40) != 0, in_event)
+
+    # wildcard id applies to all records
+    set_flags_in_fixed_headers(fn, {'...': {'data_qual_flags': {'glitches_detected': True}}})
+    assert ((build_record_index(fn)['data_quality_flags'] & 0x08) != 0).all()
+
+    # headers other than the flags are untouched
+    before = build_record_index(write_mseed(tmp_path / 'orig.ms', [make_trace('BHZ'), make_trace('BHE')],
+                                            byteorder=byteorder))
+    for field in ('starttime_ns', 'endtime_ns', 'npts', 'channel', 'encoding'):
+        np.testing.assert_array_equal(index[field], before[field])
+
+
+def test_set_flags_in_fixed_headers_partial_record(tmp_path):
+
+    fn = write_mseed(tmp_path / 'partial.ms', [make_trace()])
+    with open(fn, 'ab') as fh:
+        fh.write(b'\x00' * 100)
+    original = read_bytes(fn)
+
+    with pytest.raises(IOError, match='All records must be 512 bytes long'):
+        set_flags_in_fixed_headers(fn, {'...': {'activity_flags': {'calib_signal': True}}})
+    assert read_bytes(fn) == original
+
+
+@pytest.mark.parametrize('byteorder', ['>', '<'])
+def test_shift_time_of_file(tmp_path, byteorder):
+
+    fn = write_mseed(tmp_path / 'shift.ms', [make_trace('BHZ'), make_trace('BHE')], byteorder=byteorder)
+    original = read_bytes(fn)
+    before = build_record_index(fn)
+
+    out_fn = str(tmp_path / 'out.ms')
+    shift_time_of_file(fn, out_fn, 12345)
+    assert read_bytes(fn) == original
+    after = build_record_index(out_fn)
+    np.testing.assert_array_equal(after['starttime_ns'] - before['starttime_ns'], 1234500000)
+    np.testing.assert_array_equal(after['npts'], before['npts'])
+
+    # in place gives the same file
+    shift_time_of_file(fn, fn, 12345)
+    assert read_bytes(fn) == read_bytes(out_fn)
+
+
+@pytest.mark.parametrize('byteorder', ['>', '<'])
+def test_shift_time_of_file_short_last_record(tmp_path, byteorder):
+
+    fn = write_mseed(tmp_path / 'short.ms', [make_trace()], byteorder=byteorder)
+    nrecs = len(read_bytes(fn)) // 512
+    # cut the last record down to its header and some data
+    with open(fn, 'r+b') as fh:
+        fh.truncate((nrecs - 1) * 512 + 100)
+    original = read_bytes(fn)
+
+    out_fn = str(tmp_path / 'out.ms')
+    shift_time_of_file(fn, out_fn, -500)
+    shifted = read_bytes(out_fn)
+    assert len(shifted) == len(original)
+
+    buf = np.frombuffer(shifted, dtype=np.uint8)
+    hdrs = _record_header_view(buf, nrecs - 1, 512, byteorder)
+    last_hdr = _record_header_view(buf, 1, 100, byteorder, offset=(nrecs - 1) * 512)
+    assert (hdrs['time_correction'] == -500).all()
+    assert last_hdr['time_correction'][0] == -500
+    # data of the short record is kept
+    assert shifted[(nrecs - 1) * 512 + 48:] == original[(nrecs - 1) * 512 + 48:]
+
+    # less than a header left over is copied unchanged
+    with open(fn, 'r+b') as fh:
+        fh.truncate((nrecs - 1) * 512 + 20)
+    with pytest.warns(UserWarning, match='excessive byte'):
+        shift_time_of_file(fn, out_fn, -500)
+    assert read_bytes(out_fn)[-20:] == read_bytes(fn)[-20:]
@@ -7,16 +7,19 @@ from __future__ import (absolute_import, division, print_function,
 from future.builtins import *  # NOQA
 from future.utils import native_str
 
-import collections
+import collections.abc
 import ctypes as C
+import io
 import math
 import os
+import shutil
 import sys
+import tempfile
 import warnings
 from datetime import datetime
 from struct import pack, unpack
 
-# import numpy as np
+import numpy as np
 from numpy import empty, fromfile, array, int32, uint8, uint16
 
 from ida.obspy.core.utcdatetime import UTCDateTime
@@ -614,14 +617,21 @@ def _unpack_steim_2(data_string, npts, swapflag=0, verbose=0):
     return datasamples
 
 
-def set_flags_in_fixed_headers(filename, flags):
+def set_flags_in_fixed_headers(filename, flags, output_file=None):
     """
     Updates a given MiniSEED file with some fixed header flags.
 
+    The flags of all records are computed and written together through a
+    structured view of the memory-mapped record headers. The result is
+    written to a temporary file that then atomically replaces output_file
+    (filename itself by default). All records must have the same length.
+
     :type filename: string
     :param filename: Name of the MiniSEED file to be changed
     :type flags: dict
     :param flags: The flags to update in the MiniSEED file
+    :type output_file: string
+    :param output_file: Name of the updated file. Defaults to filename.
 
         Flags are stored as a nested dictionary::
 
@@ -755,156 +765,79 @@ def set_flags_in_fixed_headers(filename, flags):
                 flags_bytes[net][sta][loc][cha][flag_group][flag_name] = \
                     corrected_flag
 
-    # Open file
-    with open(filename, 'r+b') as mseed_file:
-        # Run through all records
-        while mseed_file.tell() < filesize:
-            record_start = mseed_file.tell()
-
-            # Ignore sequence number and data header
-            mseed_file.seek(8, os.SEEK_CUR)
-            # Read identifier
-            sta = mseed_file.read(5).strip()
-            loc = mseed_file.read(2).strip()
-            chan = mseed_file.read(3).strip()
-            net = mseed_file.read(2).strip()
-
-            # Search the nested dict for the network identifier
-            if net in flags_bytes:
-                dict_to_use = flags_bytes[net]
-            elif wildcard in flags_bytes:
-                dict_to_use = flags_bytes[wildcard]
-            else:
-                dict_to_use = None
-
-            # Search the nested dict for the station identifier
-            if dict_to_use is not None and sta in dict_to_use:
-                dict_to_use = dict_to_use[sta]
-            elif dict_to_use is not None and wildcard in dict_to_use:
-                dict_to_use = dict_to_use[wildcard]
-            else:
-                dict_to_use = None
-
-            # Search the nested dict for the location identifier
-            if dict_to_use is not None and loc in dict_to_use:
-                dict_to_use = dict_to_use[loc]
-            elif dict_to_use is not None and wildcard in dict_to_use:
-                dict_to_use = dict_to_use[wildcard]
-            else:
-                dict_to_use = None
-
-            # Search the nested dict for the channel identifier
-            if dict_to_use is not None and chan in dict_to_use:
-                flags_value = dict_to_use[chan]
-            elif dict_to_use is not None and wildcard in dict_to_use:
-                flags_value = dict_to_use[wildcard]
-            else:
-                flags_value = None
-
-            if flags_value is not None:
-                # Calculate the real start and end of the record
-                recstart = mseed_file.read(10)
-                (yr, doy, hr, mn, sec, _, mil) = unpack(native_str(">HHBBBBH"),
-                                                        recstart)
-                # Transformation to UTCDatetime()
-                recstart = UTCDateTime(year=yr, julday=doy, hour=hr, minute=mn,
-                                       second=sec, microsecond=mil*100)
-                # Read data to date begin and end of record
-                (nb_samples, fact, mult) = unpack(native_str(">Hhh"),
-                                                  mseed_file.read(6))
-
-                # Manage time correction
-                act_flags = unpack(native_str(">B"), mseed_file.read(1))[0]
-                time_correction_applied = bool(act_flags & 2)
-                (_, _, _, time_correction) = unpack(native_str(">BBBl"),
-                                                    mseed_file.read(7))
-                if (time_correction_applied is False) and time_correction:
-                    # Time correction is in units of 0.0001 seconds.
-                    recstart += time_correction * 0.0001
-
-                # Manage blockette's datation informations
-                # Search for blockette 100's "Actual sample rate" field
-                samp_rate = _search_flag_in_blockette(mseed_file, 4, 100, 4, 1)
-                if samp_rate is not None:
-                    samp_rate = unpack(native_str(">b"), samp_rate)
-                # Search for blockette 1001's "microsec" field
-                microsec = _search_flag_in_blockette(mseed_file, 4, 1001, 5, 1)
-                if microsec is not None:
-                    microsec = unpack(native_str(">b"), microsec)[0]
-                else:
-                    microsec = 0
-
-                realstarttime = recstart + microsec*0.000001
-
-                # If samprate not set via blockette 100 calculate the sample
-                # rate according to the SEED manual.
-                if samp_rate is None:
-                    if (fact > 0) and (mult) > 0:
-                        samp_rate = float(fact * mult)
-                    elif (fact > 0) and (mult) < 0:
-                        samp_rate = -1.0 * float(fact) / float(mult)
-                    elif (fact < 0) and (mult) > 0:
-                        samp_rate = -1.0 * float(mult) / float(fact)
-                    elif (fact < 0) and (mult) < 0:
-                        samp_rate = -1.0 / float(fact * mult)
-                    else:
-                        # if everything is unset or 0 set sample rate to 1
-                        samp_rate = 1
-
-                # date of the last sample is recstart+samp_rate*(nb_samples-1)
-                # We assume here that a record with samples [0, 1, ..., n]
-                # has a period [ date_0, date_n+1 [  AND NOT [ date_0, date_n ]
-                realendtime = recstart + samp_rate * (nb_samples)
-
-                # Convert flags to bytes : activity
-                if 'activity_flags' in flags_value:
-                    act_flag = _convert_flags_to_raw_byte(
-                        FIXED_HEADER_ACTIVITY_FLAGS,
-                        flags_value['activity_flags'],
-                        realstarttime, realendtime)
-                else:
-                    act_flag = 0
-
-                # Convert flags to bytes : i/o and clock
-                if 'io_clock_flags' in flags_value:
-                    io_clock_flag = _convert_flags_to_raw_byte(
-                        FIXED_HEADER_IO_CLOCK_FLAGS,
-                        flags_value['io_clock_flags'],
-                        realstarttime, realendtime)
-                else:
-                    io_clock_flag = 0
-
-                # Convert flags to bytes : data quality flags
-                if 'data_qual_flags' in flags_value:
-                    data_qual_flag = _convert_flags_to_raw_byte(
-                        FIXED_HEADER_DATA_QUAL_FLAGS,
-                        flags_value['data_qual_flags'],
-                        realstarttime, realendtime)
-                else:
-                    data_qual_flag = 0
-
-                flagsbytes = pack("BBB", act_flag,
-                                  io_clock_flag, data_qual_flag)
-                # Go back right before the fixed header flags
-                mseed_file.seek(-8, os.SEEK_CUR)
-                # Update flags*
-                mseed_file.write(flagsbytes)
-                # Seek to first blockette
-                mseed_file.seek(9, os.SEEK_CUR)
-            else:
-                # Seek directly to first blockette
-                mseed_file.seek(28, os.SEEK_CUR)
-
-            # Read record length in blockette 1000 to seek to the next record
-            reclen_pow = _search_flag_in_blockette(mseed_file, 0, 1000, 6, 1)
-
-            if reclen_pow is None:
-                msg = "Invalid MiniSEED file. No blockette 1000 was found."
-                raise IOError(msg)
-            else:
-                reclen_pow = unpack(native_str("B"), reclen_pow)[0]
-                reclen = 2**reclen_pow
-                mseed_file.seek(record_start + reclen, os.SEEK_SET)
+    info = get_record_information(filename)
+    record_length = info['record_length']
+    byteorder = info['byteorder']
+    if filesize % record_length:
+        msg = "Invalid MiniSEED file. All records must be %i bytes long." % \
+            record_length
+        raise IOError(msg)
+
+    def lookup(level_dict, key):
+        # exact identifier first, then the wildcard
+        if level_dict is None:
+            return None
+        if key in level_dict:
+            return level_dict[key]
+        if wildcard in level_dict:
+            return level_dict[wildcard]
+        return None
+
+    def set_flags(buf):
+        nrecs = len(buf) // record_length
+        raw = buf.reshape(nrecs, record_length)
+        hdrs = _record_header_view(buf, nrecs, record_length, byteorder)
+        recnos = np.arange(nrecs)
+
+        ids = np.stack([np.char.strip(np.char.decode(hdrs[field], 'ascii'))
+                        for field in ('network', 'station', 'location',
+                                      'channel')], axis=1)
+        uniq_ids, id_ndx = np.unique(ids, axis=0, return_inverse=True)
+        id_ndx = id_ndx.ravel()
+        rec_flags = []
+        for net, sta, loc, chan in uniq_ids.tolist():
+            rec_flags.append(lookup(lookup(lookup(lookup(
+                flags_bytes, net), sta), loc), chan))
+        if all(flags_value is None for flags_value in rec_flags):
+            return
+
+        # Calculate the real start and end of the records
+        recstart = _record_start_ns(hdrs)
+        # blockette 1001's "microsec" field
+        b1001 = _find_blockettes(raw, recnos, hdrs, byteorder, 1001)
+        recstart += _blockette_values(raw, recnos, b1001, 5, 'i1',
+                                      0).astype('i8') * 1000
+        # blockette 100's "Actual sample rate" field, else from fixed header
+        b100 = _find_blockettes(raw, recnos, hdrs, byteorder, 100)
+        samp_rate = _blockette_values(raw, recnos, b100, 4, byteorder + 'f4',
+                                      0.0).astype('f8')
+        samp_rate = np.where(b100 >= 0, samp_rate,
+                             _samp_rate_from_headers(hdrs))
+        # if everything is unset or 0 set sample rate to 1
+        samp_rate[samp_rate <= 0] = 1.0
+        # We assume here that a record with samples [0, 1, ..., n]
+        # has a period [ date_0, date_n+1 [  AND NOT [ date_0, date_n ]
+        recend = recstart + np.round(
+            hdrs['npts'] * 1e9 / samp_rate).astype('i8')
+
+        for flag_group, field, expected_flags in (
+                ('activity_flags', 'activity_flags',
+                 FIXED_HEADER_ACTIVITY_FLAGS),
+                ('io_clock_flags', 'io_clock_flags',
+                 FIXED_HEADER_IO_CLOCK_FLAGS),
+                ('data_qual_flags', 'data_quality_flags',
+                 FIXED_HEADER_DATA_QUAL_FLAGS)):
+            new_bytes = hdrs[field].copy()
+            for ndx, flags_value in enumerate(rec_flags):
+                if flags_value is None:
+                    continue
+                in_id = id_ndx == ndx
+                new_bytes[in_id] = _convert_flags_to_raw_bytes(
+                    expected_flags, flags_value.get(flag_group, {}),
+                    recstart[in_id], recend[in_id])
+            hdrs[field] = new_bytes
+
+    _edit_records_atomically(filename, output_file or filename, set_flags)
 
 
 def _check_flag_value(flag_value):
@@ -931,7 +864,7 @@ def _check_flag_value(flag_value):
 
 
     This function then returns all datation events as a list of tuples
-    [(start1, end1), ...] to ease the work of _convert_flags_to_raw_byte. Bool
+    [(start1, end1), ...] to ease the work of _convert_flags_to_raw_bytes. Bool
     values are unchanged, instant events become a tuple
     (event_date, event_date).
 
@@ -954,7 +887,7 @@ def _check_flag_value(flag_value):
         utc_val = UTCDateTime(flag_value)
         corrected_flag = [(utc_val, utc_val)]
 
-    elif isinstance(flag_value, collections.Mapping):
+    elif isinstance(flag_value, collections.abc.Mapping):
         # dict allowed if it has the right format
         corrected_flag = []
         for flag_key in flag_value:
@@ -966,7 +899,7 @@ def _check_flag_value(flag_value):
                     # Single value : ensure it's UTCDateTime and store it
                     utc_val = UTCDateTime(inst_values)
                     corrected_flag.append((utc_val, utc_val))
-                elif isinstance(inst_values, collections.Sequence):
+                elif isinstance(inst_values, collections.abc.Sequence):
                     # Several instant values : check their types
                     # and add each of them
                     for value in inst_values:
@@ -986,7 +919,7 @@ def _check_flag_value(flag_value):
                 # Expecting either a list of tuples (start, end) or
                 # a list of (start1, end1, start1, end1)
                 dur_values = flag_value[flag_key]
-                if isinstance(dur_values, collections.Sequence):
+                if isinstance(dur_values, collections.abc.Sequence):
                     if len(dur_values) != 0:
                         # Check first item
                         if isinstance(dur_values[0], datetime) or \
@@ -1029,10 +962,10 @@ def _check_flag_value(flag_value):
                                     raise ValueError(msg)
                                 next(duration_iter)
 
-                        elif isinstance(dur_values[0], collections.Sequence):
+                        elif isinstance(dur_values[0], collections.abc.Sequence):
                             # List of tuples (start, end)
                             for value in dur_values:
-                                if not isinstance(value, collections.Sequence):
+                                if not isinstance(value, collections.abc.Sequence):
                                     msg = "Incorrect type %s for flag duration"
                                     raise ValueError(msg % str(type(value)))
                                 elif len(value) != 2:
@@ -1082,129 +1015,31 @@ def _check_flag_value(flag_value):
     return corrected_flag
 
 
-def _search_flag_in_blockette(mseed_file_desc, first_blockette_offset,
-                              blockette_number, field_offset, field_length):
-    """
-    Search for a given flag in a given blockette for the current record.
-
-    This is a utility function for set_flags_in_fixed_headers and is not
-    designed to be called by someone else.
-
-    This function uses the file descriptor``mseed_file_desc``, seeks
-    ``first_blockette_offset`` to go to the first blockette, reads through all
-    the blockettes until it finds the one with number ``blockette_number``,
-    then skips ``field_offset`` bytes to read ``field_length`` bytes and
-    returns them. If the blockette does not exist, it returns None
-
-    Please note that this function does not decommute the binary value into an
-    exploitable data (int, float, string, ...)
-    :type mseed_file_desc: File object
-    :param mseed_file_desc: a File descriptor to the current miniseed file.
-    The value of mseed_file_desc.tell() is set back by this funcion before
-    returning, use in multithread applications at your own risk.
-    :type first_blockette_offset: int
-    :param first_blockette_offset: tells the function where the first blockette
-    of the record is compared to the mseed_file_desc current position in the
-    file. A positive value means the blockette is after the current position.
-    :type blockette_number: int
-    :param blockette_number: the blockette number to search for
-    :type field_offset: int
-    :param field_offset: how many bytes we have to skip before attaining the
-    wanted field. Please note that it also counts blockette number and next
-    blockette index's field.
-    :type field_length: int
-    :param field_length: length of the wanted field, in bytes
-    :return: bytes containing the field's value in this record
-
+def _convert_flags_to_raw_bytes(expected_flags, user_flags, recstart,
+                                recend):
     """
-    previous_position = mseed_file_desc.tell()
-
-    try:
-        # Go to first blockette
-        mseed_file_desc.seek(first_blockette_offset, os.SEEK_CUR)
-        mseed_record_start = mseed_file_desc.tell() - 48
-        read_data = mseed_file_desc.read(4)
-        # Read info in the first blockette
-        [cur_blkt_number, next_blkt_offset] = unpack(native_str(">HH"),
-                                                     read_data)
-
-        while cur_blkt_number != blockette_number \
-                and next_blkt_offset != 0:
-            # Nothing here, read next blockette
-            mseed_file_desc.seek(mseed_record_start + next_blkt_offset,
-                                 os.SEEK_SET)
-            read_data = mseed_file_desc.read(4)
-            [cur_blkt_number, next_blkt_offset] = unpack(native_str(">HH"),
-                                                         read_data)
-
-        if cur_blkt_number == blockette_number:
-            # Blockette found: we want to skip ``field_offset`` bytes but we
-            # have already read 4 of the offset to get informations about the
-            # current blockette, so we remove them from skipped data
-            mseed_file_desc.seek(field_offset - 4, os.SEEK_CUR)
-            returned_bytes = mseed_file_desc.read(field_length)
-        else:
-            returned_bytes = None
-
-    finally:
-        mseed_file_desc.seek(previous_position, os.SEEK_SET)
-
-    return returned_bytes
-
-
-def _convert_flags_to_raw_byte(expected_flags, user_flags, recstart, recend):
-    """
-    Converts a flag dictionary to a byte, ready to be encoded in a MiniSEED
-    header.
-
-    This is a utility function for set_flags_in_fixed_headers and is not
-    designed to be called by someone else.
+    Converts user requested flags of one flag group to the raw flag byte of
+    each record, given arrays of record start and end times in epoch
+    nanoseconds.
 
-    expected_signals describes all the possible bit names for the user flags
-    and their place in the result byte. Expected: dict { exponent: bit_name }.
-    The fixed header flags are available in obspy.io.mseed.headers as
-    FIXED_HEADER_ACTIVITY_FLAGS, FIXED_HEADER_DATA_QUAL_FLAGS and
-    FIXED_HEADER_IO_CLOCK_FLAGS.
-
-    This expects a user_flags as a dictionary { bit_name : value }. bit_name is
-    compared to the expected_signals, and its value is converted to bool.
-    Missing values are considered false.
-
-    :type expected_flags: dict {int: str}
-    :param expected_flags: every possible flag in this field, with its offset
-    :type user_flags: dict {str: bool}
-    :param user_flags: user defined flags and its value
-    :type recstart: UTCDateTime
-    :param recstart: date of the first sample of the current record
-    :type recstart: UTCDateTime
-    :param recend: date of the last sample of the current record
-    :return: raw int value for the flag group
+    :return: uint8 array of raw flag group values, one per record
     """
-
-    flag_byte = 0
+    flag_bytes = np.zeros(len(recstart), dtype=uint8)
 
     for (bit, key) in expected_flags.items():
-        use_in_this_record = False
-        if key in user_flags:
-            if isinstance(user_flags[key], bool) and user_flags[key]:
-                # Boolean value, we accept it for all records
-                use_in_this_record = True
-            elif isinstance(user_flags[key], collections.Sequence):
-                # List of tuples (start, end)
-                use_in_this_record = False
-                for tuple_value in user_flags[key]:
-                    # Check wether this record is concerned
-                    event_start = tuple_value[0]
-                    event_end = tuple_value[1]
-
-                    if(event_start < recend) and (recstart <= event_end):
-                        use_in_this_record = True
-                        break
-
-        if use_in_this_record:
-            flag_byte += 2**bit
+        if key not in user_flags:
+            continue
+        if isinstance(user_flags[key], bool):
+            use_in_record = np.full(len(recstart), user_flags[key])
+        else:
+            # List of tuples (start, end)
+            use_in_record = np.zeros(len(recstart), dtype=bool)
+            for event_start, event_end in user_flags[key]:
+                use_in_record |= (_to_ns(event_start) < recend) & \
+                    (recstart <= _to_ns(event_end))
+        flag_bytes[use_in_record] |= 2 ** bit
 
-    return flag_byte
+    return flag_bytes
 
 
 @deprecated("'shiftTimeOfFile' has been renamed to "
@@ -1239,15 +1074,16 @@ def shift_time_of_file(input_file, output_file, timeshift):
     :param timeshift: The time-shift to be applied in 0.0001, e.g. 1E-4
         seconds. Use an integer number.
 
-    Please do NOT use identical input and output files because if something
-    goes wrong, your data WILL be corrupted/destroyed. Also always check the
-    resulting output file.
+    The output is written to a temporary file next to output_file that is
+    renamed over it when complete, so input and output file may be the same
+    to edit a file in place. Always check the resulting output file.
 
     .. rubric:: Technical details
 
-    The function will loop over every record and change the "Time correction"
-    field in the fixed section of the MiniSEED data header by the specified
-    amount. Unfortunately a further flag (bit 1 in the "Activity flags" field)
+    The function will change the "Time correction" field in the fixed section
+    of the MiniSEED data header of every record by the specified amount,
+    using a structured view of all record headers of the memory-mapped
+    file. Unfortunately a further flag (bit 1 in the "Activity flags" field)
     determines whether or not the time correction has already been applied to
     the record start time. If it has not, all is fine and changing the "Time
     correction" field is enough. Otherwise the actual time also needs to be
@@ -1267,110 +1103,48 @@ def shift_time_of_file(input_file, output_file, timeshift):
     # Get the necessary information from the file.
     info = get_record_information(input_file)
     record_length = info["record_length"]
-
     byteorder = info["byteorder"]
-    sys_byteorder = "<" if (sys.byteorder == "little") else ">"
-    do_swap = False if (byteorder == sys_byteorder) else True
-
-    # This is in this scenario somewhat easier to use than BytesIO because one
-    # can directly modify the data array.
-    data = fromfile(input_file, dtype=uint8)
-    array_length = len(data)
-    record_offset = 0
-    # Loop over every record.
-    while True:
-        remaining_bytes = array_length - record_offset
-        if remaining_bytes < 48:
-            if remaining_bytes > 0:
-                msg = "%i excessive byte(s) in the file. " % remaining_bytes
-                msg += "They will be appended to the output file."
-                warnings.warn(msg)
-            break
-        # Use a slice for the current record.
-        current_record = data[record_offset: record_offset + record_length]
-        record_offset += record_length
-
-        activity_flags = current_record[36]
-        is_time_correction_applied = bool(activity_flags & 2)
-
-        current_time_shift = current_record[40:44]
-        current_time_shift.dtype = int32
-        if do_swap:
-            current_time_shift = current_time_shift.byteswap(False)
-        current_time_shift = current_time_shift[0]
-
-        # If the time correction has been applied, but there is no actual
-        # time correction, then simply set the time correction applied
-        # field to false and process normally.
-        # This should rarely be the case.
-        if current_time_shift == 0 and is_time_correction_applied:
-            # This sets bit 2 of the activity flags to 0.
-            current_record[36] = current_record[36] & (~2)
-            is_time_correction_applied = False
-        # This is the case if the time correction has been applied. This
-        # requires some more work by changing both, the actual time and the
-        # time correction field.
-        elif is_time_correction_applied:
-            msg = "The timeshift can only be applied by actually changing the "
-            msg += "time. This is experimental. Please make sure the output "
-            msg += "file is correct."
+
+    def shift_records(buf):
+        nrecs, remaining_bytes = divmod(len(buf), record_length)
+        views = [_record_header_view(buf, nrecs, record_length, byteorder)]
+        if remaining_bytes >= 48:
+            # a short last record still gets its header shifted
+            views.append(_record_header_view(buf, 1, remaining_bytes,
+                                             byteorder,
+                                             offset=nrecs * record_length))
+        elif remaining_bytes > 0:
+            msg = "%i excessive byte(s) in the file. " % remaining_bytes
+            msg += "They will be appended to the output file."
             warnings.warn(msg)
-            # The whole process is not particularly fast or optimized but
-            # instead intends to avoid errors.
-            # Get the time variables.
-            time = current_record[20:30]
-            year = time[0:2]
-            julday = time[2:4]
-            hour = time[4:5]
-            minute = time[5:6]
-            second = time[6:7]
-            msecs = time[8:10]
-            # Change dtype of multibyte values.
-            year.dtype = uint16
-            julday.dtype = uint16
-            msecs.dtype = uint16
-            if do_swap:
-                year = year.byteswap(False)
-                julday = julday.byteswap(False)
-                msecs = msecs.byteswap(False)
-            dtime = UTCDateTime(year=year[0], julday=julday[0], hour=hour[0],
-                                minute=minute[0], second=second[0],
-                                microsecond=msecs[0] * 100)
-            dtime += (float(timeshift) / 10000)
-            year[0] = dtime.year
-            julday[0] = dtime.julday
-            hour[0] = dtime.hour
-            minute[0] = dtime.minute
-            second[0] = dtime.second
-            msecs[0] = dtime.microsecond / 100
-            # Swap again.
-            if do_swap:
-                year = year.byteswap(False)
-                julday = julday.byteswap(False)
-                msecs = msecs.byteswap(False)
-            # Change dtypes back.
-            year.dtype = uint8
-            julday.dtype = uint8
-            msecs.dtype = uint8
-            # Write to current record.
-            time[0:2] = year[:]
-            time[2:4] = julday[:]
-            time[4] = hour[:]
-            time[5] = minute[:]
-            time[6] = second[:]
-            time[8:10] = msecs[:]
-            current_record[20:30] = time[:]
-
-        # Now modify the time correction flag.
-        current_time_shift += timeshift
-        current_time_shift = array([current_time_shift], int32)
-        if do_swap:
-            current_time_shift = current_time_shift.byteswap(False)
-        current_time_shift.dtype = uint8
-        current_record[40:44] = current_time_shift[:]
-
-    # Write to the output file.
-    data.tofile(output_file)
+
+        for hdrs in views:
+            applied = (hdrs['activity_flags'] & 2) != 0
+            # If the time correction has been applied, but there is no
+            # actual time correction, then simply set the time correction
+            # applied field to false and process normally.
+            # This should rarely be the case.
+            unset = applied & (hdrs['time_correction'] == 0)
+            hdrs['activity_flags'][unset] &= ~2 & 0xFF
+            applied &= ~unset
+
+            # The time correction has been applied to these records so the
+            # actual time has to be changed as well as the time correction.
+            if applied.any():
+                msg = "The timeshift can only be applied by actually " \
+                      "changing the time. This is experimental. Please " \
+                      "make sure the output file is correct."
+                warnings.warn(msg)
+                shifted_ns = _btime_to_ns(hdrs[applied]) + timeshift * 100000
+                for field, vals in zip(
+                        ('year', 'julday', 'hour', 'minute', 'second',
+                         'fract'), _ns_to_btime(shifted_ns)):
+                    hdrs[field][applied] = vals
+
+            # Now modify the time correction field.
+            hdrs['time_correction'] += timeshift
+
+    _edit_records_atomically(input_file, output_file, shift_records)
 
 
 def _convert_and_check_encoding_for_writing(encoding):
@@ -1408,6 +1182,429 @@ def _convert_and_check_encoding_for_writing(encoding):
     return encoding
 
 
+# dtype of the 48 byte fixed section of data header, prefix with byte order
+_FIXED_HEADER_FIELDS = [
+    ('sequence_number', 'S6'), ('dataquality', 'S1'), ('reserved', 'S1'),
+    ('station', 'S5'), ('location', 'S2'), ('channel', 'S3'),
+    ('network', 'S2'), ('year', '{}u2'), ('julday', '{}u2'), ('hour', 'u1'),
+    ('minute', 'u1'), ('second', 'u1'), ('unused', 'u1'), ('fract', '{}u2'),
+    ('npts', '{}u2'), ('samp_rate_factor', '{}i2'),
+    ('samp_rate_mult', '{}i2'), ('activity_flags', 'u1'),
+    ('io_clock_flags', 'u1'), ('data_quality_flags', 'u1'),
+    ('number_of_blockettes', 'u1'), ('time_correction', '{}i4'),
+    ('data_offset', '{}u2'), ('blockette_offset', '{}u2')]
+
+# one row per record of a sidecar record index. Times are epoch nanoseconds,
+# endtime_ns is the time after the last sample of the record.
+RECORD_INDEX_DTYPE = np.dtype([
+    ('offset', 'i8'), ('network', 'U2'), ('station', 'U5'),
+    ('location', 'U2'), ('channel', 'U3'), ('dataquality', 'U1'),
+    ('starttime_ns', 'i8'), ('endtime_ns', 'i8'), ('npts', 'i4'),
+    ('sampling_rate', 'f8'), ('encoding', 'i2'), ('record_length', 'i4'),
+    ('activity_flags', 'u1'), ('io_clock_flags', 'u1'),
+    ('data_quality_flags', 'u1')])
+
+RECORD_INDEX_SUFFIX = '.ridx.npz'
+
+
+def _record_header_view(buf, nrecs, record_length, byteorder, offset=0):
+    """
+    Structured view of the fixed headers of nrecs records of record_length
+    bytes in buf (e.g. a numpy.memmap of the file). Assigning to its fields
+    writes through to buf.
+    """
+    names = [name for name, _ in _FIXED_HEADER_FIELDS]
+    formats = [np.dtype(fmt.format(byteorder))
+               for _, fmt in _FIXED_HEADER_FIELDS]
+    offsets = np.cumsum([0] + [fmt.itemsize for fmt in formats[:-1]])
+    hdr_dtype = np.dtype({'names': names, 'formats': formats,
+                          'offsets': offsets.tolist(),
+                          'itemsize': record_length})
+    return np.ndarray((nrecs,), dtype=hdr_dtype, buffer=buf, offset=offset)
+
+
+def _find_blockettes(raw, recnos, hdrs, byteorder, blockette_type):
+    """
+    Offset within each record (rows recnos of the N x record_length raw
+    array, headers hdrs) of the first blockette of blockette_type, -1 if
+    there is none. All records are searched together, one step along the
+    blockette chains at a time.
+    """
+    reclen = raw.shape[1]
+    u2 = np.dtype(byteorder + 'u2')
+    found = np.full(len(recnos), -1, dtype='i8')
+    cur = hdrs['blockette_offset'].astype('i8')
+    for _ in range(int(hdrs['number_of_blockettes'].max(initial=0))):
+        todo = np.nonzero((found < 0) & (cur >= 48) & (cur + 4 <= reclen))[0]
+        if not len(todo):
+            break
+        blkt = np.ascontiguousarray(
+            raw[recnos[todo][:, None], cur[todo][:, None] + np.arange(4)])
+        blkt_type = blkt[:, 0:2].copy().view(u2).ravel()
+        blkt_next = blkt[:, 2:4].copy().view(u2).ravel()
+        hit = blkt_type == blockette_type
+        found[todo[hit]] = cur[todo[hit]]
+        cur[todo] = np.where(hit, 0, blkt_next)
+    return found
+
+
+def _blockette_values(raw, recnos, blkt_offsets, field_offset, dtype,
+                      default):
+    """
+    Value of dtype at field_offset in the blockettes at blkt_offsets (as
+    from _find_blockettes), default where there is none.
+    """
+    dtype = np.dtype(dtype)
+    values = np.full(len(recnos), default, dtype=dtype.newbyteorder('='))
+    has = np.nonzero(blkt_offsets >= 0)[0]
+    if len(has):
+        pos = blkt_offsets[has][:, None] + field_offset + \
+            np.arange(dtype.itemsize)
+        field = np.ascontiguousarray(raw[recnos[has][:, None], pos])
+        values[has] = field.view(dtype).ravel()
+    return values
+
+
+def _btime_to_ns(hdrs):
+    """Record start times of the fixed headers as epoch nanoseconds"""
+    days = (hdrs['year'].astype('i8') - 1970).astype('datetime64[Y]') \
+        .astype('datetime64[D]') + (hdrs['julday'].astype('i8') - 1)
+    time_ns = days.astype('datetime64[ns]').astype('i8')
+    time_ns += (hdrs['hour'].astype('i8') * 3600 +
+                hdrs['minute'].astype('i8') * 60 +
+                hdrs['second'].astype('i8')) * 1000000000
+    time_ns += hdrs['fract'].astype('i8') * 100000
+    return time_ns
+
+
+def _record_start_ns(hdrs):
+    """
+    Record start times of the fixed headers as epoch nanoseconds including
+    the time correction unless flagged as already applied
+    """
+    start_ns = _btime_to_ns(hdrs)
+    not_applied = (hdrs['activity_flags'] & 0x02) == 0
+    start_ns += np.where(not_applied,
+                         hdrs['time_correction'].astype('i8') * 100000, 0)
+    return start_ns
+
+
+def _ns_to_btime(time_ns):
+    """Year, julday, hour, minute, second and 0.0001 s fraction arrays"""
+    time_ns = np.asarray(time_ns, dtype='i8')
+    days = time_ns.astype('datetime64[ns]').astype('datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    julday = (days - years.astype('datetime64[D]')).astype('i8') + 1
+    day_ns = time_ns - days.astype('datetime64[ns]').astype('i8')
+    secs = day_ns // 1000000000
+    return (years.astype('i8') + 1970, julday, secs // 3600,
+            (secs // 60) % 60, secs % 60,
+            (day_ns % 1000000000) // 100000)
+
+
+def _edit_records_atomically(input_file, output_file, edit):
+    """
+    Copies input_file to a temporary file next to output_file, calls
+    edit(buf) with a writable uint8 memmap of the copy and then renames the
+    copy to output_file. output_file may be input_file; it is only replaced
+    once all edits succeeded.
+    """
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_file = tempfile.mkstemp(
+        prefix='.' + os.path.basename(output_file) + '.', dir=out_dir)
+    os.close(fd)
+    try:
+        shutil.copyfile(input_file, tmp_file)
+        shutil.copymode(input_file, tmp_file)
+        if os.path.getsize(tmp_file):
+            buf = np.memmap(tmp_file, dtype=uint8, mode='r+')
+            edit(buf)
+            buf.flush()
+            del buf
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def build_record_index(filename, endian=None):
+    """
+    Scans all records of a Mini-SEED file with fixed length records once and
+    returns a structured array (RECORD_INDEX_DTYPE) with a row per data
+    record.
+
+    The fixed headers of all records are decoded together with NumPy.
+    Encoding is taken from blockette 1000 (-1 if missing). Sample rates come
+    from blockette 100 if present, else from the fixed header rate factor and
+    multiplier. Start times include the header time correction unless flagged
+    as already applied and the blockette 1001 microseconds.
+
+    :type filename: str
+    :param filename: Mini-SEED file name
+    :param endian: If given, the header byte order will be enforced. Can be
+        either "<" or ">". If None, it will be determined automatically.
+    :rtype: :class:`numpy.ndarray`
+    """
+    info = get_record_information(filename, endian=endian)
+    bo = info['byteorder']
+    reclen = info['record_length']
+    filesize = os.path.getsize(filename)
+    if filesize % reclen:
+        msg = "File size of '%s' is not a multiple of its record length %i" \
+            % (filename, reclen)
+        raise ValueError(msg)
+
+    nrecs = filesize // reclen
+    if not nrecs:
+        return np.empty(0, dtype=RECORD_INDEX_DTYPE)
+    buf = np.memmap(filename, dtype=uint8, mode='r')
+    raw = buf.reshape(nrecs, reclen)
+    hdrs = _record_header_view(buf, nrecs, reclen, bo)
+
+    # only data records, skip any SEED control headers
+    recnos = np.nonzero(np.isin(hdrs['dataquality'],
+                                [b'D', b'R', b'Q', b'M']))[0]
+    hdrs = hdrs[recnos]
+
+    b1000 = _find_blockettes(raw, recnos, hdrs, bo, 1000)
+    encoding = _blockette_values(raw, recnos, b1000, 4, 'u1', 255)
+    encoding = np.where(b1000 >= 0, encoding, -1).astype('i2')
+    reclen_exp = _blockette_values(raw, recnos, b1000, 6, 'u1', 0)
+    b1000_reclen = np.where(b1000 >= 0, 2 ** reclen_exp.astype('i8'), reclen)
+    if np.any(b1000_reclen != reclen):
+        msg = "Variable record lengths in '%s' are not supported" % filename
+        raise ValueError(msg)
+
+    # blockette 100's actual sample rate, else from factor and multiplier as
+    # defined by SEED
+    b100 = _find_blockettes(raw, recnos, hdrs, bo, 100)
+    samp_rate = _blockette_values(raw, recnos, b100, 4, bo + 'f4',
+                                  0.0).astype('f8')
+    samp_rate = np.where(b100 >= 0, samp_rate, _samp_rate_from_headers(hdrs))
+
+    start_ns = _record_start_ns(hdrs)
+    # blockette 1001's "microsec" field
+    b1001 = _find_blockettes(raw, recnos, hdrs, bo, 1001)
+    start_ns += _blockette_values(raw, recnos, b1001, 5, 'i1',
+                                  0).astype('i8') * 1000
+
+    npts = hdrs['npts'].astype('i4')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        duration_ns = np.where(samp_rate > 0, npts * 1e9 / samp_rate, 0.0)
+
+    index = np.empty(len(recnos), dtype=RECORD_INDEX_DTYPE)
+    index['offset'] = recnos * reclen
+    for field in ('network', 'station', 'location', 'channel', 'dataquality'):
+        index[field] = np.char.strip(np.char.decode(hdrs[field], 'ascii'))
+    index['starttime_ns'] = start_ns
+    index['endtime_ns'] = start_ns + np.round(duration_ns).astype('i8')
+    index['npts'] = npts
+    index['sampling_rate'] = samp_rate
+    index['encoding'] = encoding
+    index['record_length'] = reclen
+    index['activity_flags'] = hdrs['activity_flags']
+    index['io_clock_flags'] = hdrs['io_clock_flags']
+    index['data_quality_flags'] = hdrs['data_quality_flags']
+
+    del hdrs, raw, buf
+    return index
+
+
+def _samp_rate_from_headers(hdrs):
+    """Sample rates from fixed header factor and multiplier as defined by SEED"""
+    fact = hdrs['samp_rate_factor'].astype('f8')
+    mult = hdrs['samp_rate_mult'].astype('f8')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.select(
+            [(fact > 0) & (mult > 0), (fact > 0) & (mult < 0),
+             (fact < 0) & (mult > 0), (fact < 0) & (mult < 0)],
+            [fact * mult, -fact / mult, -mult / fact, 1.0 / (fact * mult)],
+            default=0.0)
+
+
+def write_record_index(filename, index=None, index_filename=None):
+    """
+    Writes the sidecar record index of a Mini-SEED file, building it first
+    if not given. Defaults to filename + RECORD_INDEX_SUFFIX.
+
+    :rtype: str
+    :return: index file name
+    """
+    if index is None:
+        index = build_record_index(filename)
+    if index_filename is None:
+        index_filename = filename + RECORD_INDEX_SUFFIX
+    stat = os.stat(filename)
+
+    tmp_filename = '%s.%i.tmp' % (index_filename, os.getpid())
+    with open(tmp_filename, 'wb') as fh:
+        np.savez(fh, records=index, source_size=stat.st_size,
+                 source_mtime_ns=stat.st_mtime_ns)
+    os.replace(tmp_filename, index_filename)
+
+    return index_filename
+
+
+def load_record_index(filename, index_filename=None, build=True,
+                      write=True):
+    """
+    Returns the :class:`RecordIndex` of a Mini-SEED file from its sidecar
+    index. A missing or out of date sidecar is rebuilt if build is True and
+    then written if write is True.
+    """
+    if index_filename is None:
+        index_filename = filename + RECORD_INDEX_SUFFIX
+    stat = os.stat(filename)
+
+    index = None
+    try:
+        with np.load(index_filename, allow_pickle=False) as sidecar:
+            if int(sidecar['source_size']) == stat.st_size and \
+                    int(sidecar['source_mtime_ns']) == stat.st_mtime_ns:
+                index = sidecar['records']
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+
+    if index is None:
+        if not build:
+            msg = "No current record index for '%s'" % filename
+            raise IOError(msg)
+        index = build_record_index(filename)
+        if write:
+            try:
+                write_record_index(filename, index, index_filename)
+            except (IOError, OSError) as e:
+                msg = "Unable to write record index '%s': %s" % (
+                    index_filename, e)
+                warnings.warn(msg)
+
+    return RecordIndex(filename, index)
+
+
+class RecordIndex(object):
+    """
+    Record level index of a Mini-SEED file for time window reads, gap and
+    availability queries without rescanning the file.
+    """
+    def __init__(self, filename, records):
+        self.filename = filename
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def ids(self):
+        """SEED id of each record"""
+        recs = self.records
+        dot = np.array('.', dtype='U1')
+        return np.char.add(np.char.add(np.char.add(np.char.add(np.char.add(
+            np.char.add(recs['network'], dot), recs['station']), dot),
+            recs['location']), dot), recs['channel'])
+
+    def seed_ids(self):
+        return sorted(set(self.ids.tolist()))
+
+    def select(self, seed_id=None, starttime=None, endtime=None):
+        """
+        Records of seed_id (all if None) with samples between starttime and
+        endtime, in file order.
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        if seed_id is not None:
+            mask &= self.ids == seed_id
+        if starttime is not None:
+            mask &= self.records['endtime_ns'] > _to_ns(starttime)
+        if endtime is not None:
+            mask &= self.records['starttime_ns'] <= _to_ns(endtime)
+        return self.records[mask]
+
+    def byte_ranges(self, seed_id=None, starttime=None, endtime=None):
+        """
+        (offset, length) of the selected records with adjacent records
+        merged.
+        """
+        recs = self.select(seed_id, starttime, endtime)
+        if not len(recs):
+            return []
+        offsets = recs['offset']
+        ends = offsets + recs['record_length']
+        breaks = np.nonzero(offsets[1:] != ends[:-1])[0] + 1
+        starts = np.concatenate(([0], breaks))
+        stops = np.concatenate((breaks, [len(recs)])) - 1
+        return [(int(offsets[i]), int(ends[j] - offsets[i]))
+                for i, j in zip(starts, stops)]
+
+    def availability(self, seed_id=None, tolerance=0.5):
+        """
+        Contiguous spans as (seed id, start, end) UTCDateTimes. Records are
+        contiguous if the next one starts within tolerance samples of the end
+        of the previous one.
+        """
+        return self._spans(seed_id, tolerance)[0]
+
+    def get_gaps(self, seed_id=None, tolerance=0.5):
+        """
+        Gaps as (seed id, gap start, gap end) UTCDateTimes, gap start being
+        the time after the last sample before the gap.
+        """
+        return self._spans(seed_id, tolerance)[1]
+
+    def _spans(self, seed_id, tolerance):
+        ids = self.ids
+        spans = []
+        gaps = []
+        for sid in ([seed_id] if seed_id is not None else self.seed_ids()):
+            recs = self.records[ids == sid]
+            if not len(recs):
+                continue
+            recs = recs[np.argsort(recs['starttime_ns'], kind='stable')]
+            with np.errstate(divide='ignore'):
+                tol_ns = np.where(recs['sampling_rate'] > 0,
+                                  tolerance * 1e9 / recs['sampling_rate'], 0)
+            # running max so records inside earlier ones do not open gaps
+            ends = np.maximum.accumulate(recs['endtime_ns'])
+            brk = np.nonzero(recs['starttime_ns'][1:] - ends[:-1] >
+                             tol_ns[:-1])[0] + 1
+            first = np.concatenate(([0], brk))
+            last = np.concatenate((brk, [len(recs)])) - 1
+            for i, j in zip(first, last):
+                spans.append((sid, _from_ns(recs['starttime_ns'][i]),
+                              _from_ns(ends[j])))
+            for i in brk:
+                gaps.append((sid, _from_ns(ends[i - 1]),
+                             _from_ns(recs['starttime_ns'][i])))
+        return spans, gaps
+
+    def read(self, starttime=None, endtime=None, seed_id=None, **kwargs):
+        """
+        Reads only the records needed for the window through _read_mseed.
+        Returns the same trace list as _read_mseed (None if nothing found);
+        like _read_mseed, the selection is at record granularity.
+        """
+        from .core import _read_mseed
+
+        ranges = self.byte_ranges(seed_id, starttime, endtime)
+        if not ranges:
+            return None
+        chunks = []
+        with open(self.filename, 'rb') as fh:
+            for offset, length in ranges:
+                fh.seek(offset)
+                chunks.append(fh.read(length))
+        return _read_mseed(io.BytesIO(b''.join(chunks)), starttime=starttime,
+                           endtime=endtime, sourcename=seed_id, **kwargs)
+
+
+def _to_ns(time):
+    return int(round(UTCDateTime(time).timestamp * 1e9))
+
+
+def _from_ns(time_ns):
+    return UTCDateTime(int(time_ns) / 1e9)
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod(exclude_empty=True)
\ No newline at end of file
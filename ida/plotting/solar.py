@@ -20,16 +20,18 @@
 # documentation of the contribution by Project IDA, Institute of Geophysics and
 # Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################
-import tempfile
 import datetime
 import os
+import sys
 import matplotlib.pyplot as plt
 from matplotlib.dates import date2num, DateFormatter
 import matplotlib.dates as mdates
 from matplotlib.ticker import (AutoMinorLocator)
 import numpy as np
-from obspy import read
-from ida.utils import msget
+from fabulous.color import red, bold
+from obspy import Stream
+from obspy.io.mseed import InternalMSEEDError
+from ida.utils import msget_stream
 
 
 SOLAR_SOH_PLOT_CHANLOCS = [
@@ -104,14 +106,12 @@ def gen_station_solar_soh_fig(sta, start_dt, end_dt):
 
         arc_dir = os.environ.get('IDA_ARCHIVE_MS_DIR', '/ida/archive/ms')
 
-        # send trimmed output to tempfile for pipping to stdout
-        outtf = tempfile.NamedTemporaryFile(delete=False)
-
-        msget(arc_dir, sta, chan, loc, start_dt, end_dt, outfn=outtf.name)
-
-        stream = read(outtf.name)
-
-        os.remove(outtf.name)
+        try:
+            stream = msget_stream(arc_dir, sta, chan, loc, start_dt, end_dt)
+        except InternalMSEEDError as err:
+            # plot channel empty rather than losing the whole figure
+            print(red(bold(err)), file=sys.stderr)
+            stream = Stream()
 
         # Note all plots in a single column
         ax = fig.add_subplot("{}1{}".format(str(plot_cnt), str(ndx + 1)))
@@ -0,0 +1,219 @@
+#######################################################################################################################
+# Copyright (C) 2016  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+"""On-disk store of timeseries in fixed duration, memory-mappable .npy chunks"""
+import json
+import os
+
+import numpy as np
+
+from ida.obspy.core.utcdatetime import UTCDateTime
+from ida.signals.stream import IDAStream
+from ida.signals.trace import IDATrace, _epoch_ns
+
+# per chunk table of the trace segments stored in it
+CHUNK_SEGMENT_DTYPE = np.dtype([('start_ns', 'i8'), ('npts', 'i8'), ('offset', 'i8')])
+
+
+class TraceChunkStore(object):
+    """Directory of timeseries split into fixed duration chunks, one directory per NSLC:
+
+        <root>/<net>.<sta>.<loc>.<chan>/meta.json           sampling rate, dtype and chunk duration
+        <root>/<net>.<sta>.<loc>.<chan>/<chunk>.npy         samples of chunk number <chunk>
+        <root>/<net>.<sta>.<loc>.<chan>/<chunk>.seg.npy     (start_ns, npts, offset) of each trace segment in chunk
+
+    Chunk <chunk> holds the samples from <chunk> * chunk_seconds to (<chunk> + 1) * chunk_seconds after the epoch.
+    Reading a time window memory-maps only the chunks it overlaps, so multi-year series can be worked on
+    a window at a time.
+    """
+
+    def __init__(self, root, chunk_seconds=86400):
+        """
+        :param root: Store directory, created if necessary
+        :type root: str
+        :param chunk_seconds: Duration of chunks for new channels. Existing channels keep their own.
+        :type chunk_seconds: int
+        """
+
+        self.root = root
+        self.chunk_seconds = int(chunk_seconds)
+        os.makedirs(root, exist_ok=True)
+
+    def ids(self):
+        """Sorted SEED ids of the channels in the store"""
+
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, name, 'meta.json')))
+
+    def _meta(self, seed_id):
+
+        with open(os.path.join(self.root, seed_id, 'meta.json'), 'rt') as metafl:
+            return json.load(metafl)
+
+    def _chunk_fns(self, seed_id, chunk):
+
+        base = os.path.join(self.root, seed_id, '{:08d}'.format(chunk))
+        return base + '.npy', base + '.seg.npy'
+
+    def _chunks(self, seed_id):
+
+        return sorted(int(name[:-len('.seg.npy')]) for name in os.listdir(os.path.join(self.root, seed_id))
+                      if name.endswith('.seg.npy'))
+
+    def write(self, traces):
+        """Add traces to the store. Segments already stored with the same start and sample count are skipped.
+
+        The segments of all traces are grouped by chunk first so each chunk file is rewritten only once.
+
+        :param traces: Traces to add
+        :type traces: ida.signals.stream.IDAStream or list of ida.signals.trace.IDATrace
+        """
+
+        metas = {}
+        chunk_segments = {}
+        for tr in traces:
+            seed_id = tr.id
+            meta = metas.get(seed_id)
+            if meta is None:
+                meta = metas[seed_id] = self._write_meta(seed_id, tr)
+            if (meta['sampling_rate'] != tr.sampling_rate) or (np.dtype(meta['dtype']) != tr.data.dtype):
+                raise ValueError('Trace {} sampling rate {} or dtype {} differs from store {} {}'.format(
+                    seed_id, tr.sampling_rate, tr.data.dtype, meta['sampling_rate'], meta['dtype']))
+
+            chunk_ns = meta['chunk_seconds'] * 1000000000
+            ns_per_sample = 1e9 / tr.sampling_rate
+            start_ns = tr.starttime_ns
+            ndx = 0
+            while ndx < tr.npts:
+                sample_ns = start_ns + int(round(ndx * ns_per_sample))
+                chunk = sample_ns // chunk_ns
+                # first sample at or after the next chunk boundary
+                end_ndx = min(tr.npts, int(np.ceil(((chunk + 1) * chunk_ns - start_ns) / ns_per_sample)))
+                end_ndx = max(end_ndx, ndx + 1)
+                chunk_segments.setdefault((seed_id, chunk), []).append((sample_ns, tr.data[ndx:end_ndx]))
+                ndx = end_ndx
+
+        for (seed_id, chunk), segments in chunk_segments.items():
+            self._add_segments(seed_id, chunk, segments)
+
+    def _write_meta(self, seed_id, tr):
+        """Stored meta data of seed_id, written from trace tr for a new channel"""
+
+        chan_dir = os.path.join(self.root, seed_id)
+        if os.path.exists(os.path.join(chan_dir, 'meta.json')):
+            return self._meta(seed_id)
+
+        meta = {'sampling_rate': tr.sampling_rate, 'dtype': tr.data.dtype.str, 'chunk_seconds': self.chunk_seconds}
+        os.makedirs(chan_dir, exist_ok=True)
+        _atomic_write(os.path.join(chan_dir, 'meta.json'), lambda fl: fl.write(json.dumps(meta).encode()))
+        return meta
+
+    def _add_segments(self, seed_id, chunk, segments):
+        """Append (start_ns, data) segments to a chunk, rewriting its files once"""
+
+        data_fn, seg_fn = self._chunk_fns(seed_id, chunk)
+        if os.path.exists(seg_fn):
+            segs = np.load(seg_fn)
+            chunk_data = np.load(data_fn)
+        else:
+            segs = np.empty(0, dtype=CHUNK_SEGMENT_DTYPE)
+            chunk_data = np.empty(0, dtype=segments[0][1].dtype)
+
+        stored = set(zip(segs['start_ns'].tolist(), segs['npts'].tolist()))
+        new_segs = []
+        new_data = []
+        offset = len(chunk_data)
+        for start_ns, data in segments:
+            if (start_ns, len(data)) in stored:
+                continue
+            stored.add((start_ns, len(data)))
+            new_segs.append((start_ns, len(data), offset))
+            new_data.append(data)
+            offset += len(data)
+        if not new_segs:
+            return
+
+        segs = np.concatenate((segs, np.array(new_segs, dtype=CHUNK_SEGMENT_DTYPE)))
+        segs = segs[np.argsort(segs['start_ns'], kind='stable')]
+        chunk_data = np.concatenate([chunk_data] + new_data)
+
+        _atomic_write(data_fn, lambda fl: np.save(fl, chunk_data))
+        _atomic_write(seg_fn, lambda fl: np.save(fl, segs))
+
+    def read(self, seed_id, starttime=None, endtime=None, merge=True):
+        """Traces of seed_id within starttime..endtime, memory-mapping only the chunks overlapping the window.
+
+        :param seed_id: NET.STA.LOC.CHAN of channel
+        :type seed_id: str
+        :param starttime: Start of window, open if None
+        :type starttime: UTCDateTime
+        :param endtime: End of window, open if None
+        :type endtime: UTCDateTime
+        :param merge: Merge contiguous segments, eg across chunk boundaries, into in-memory traces. Segments that
+            need no merging, and all segments if merge is False, are read-only views of the memory-mapped chunks.
+        :type merge: bool
+        :rtype: ida.signals.stream.IDAStream
+        """
+
+        meta = self._meta(seed_id)
+        chunk_ns = meta['chunk_seconds'] * 1000000000
+        net, sta, loc, chan = seed_id.split('.')
+
+        chunks = self._chunks(seed_id)
+        if starttime is not None:
+            # segments starting in the preceding chunk may not extend past it
+            first = (_epoch_ns(starttime) // chunk_ns) - 1
+            chunks = [chunk for chunk in chunks if chunk >= first]
+        if endtime is not None:
+            last = _epoch_ns(endtime) // chunk_ns
+            chunks = [chunk for chunk in chunks if chunk <= last]
+
+        traces = []
+        for chunk in chunks:
+            data_fn, seg_fn = self._chunk_fns(seed_id, chunk)
+            segs = np.load(seg_fn)
+            chunk_data = np.load(data_fn, mmap_mode='r')
+            for start_ns, npts, offset in segs.tolist():
+                header = {'network': net, 'station': sta, 'location': loc, 'channel': chan,
+                          'sampling_rate': meta['sampling_rate'], 'starttime': UTCDateTime(start_ns / 1e9)}
+                tr = IDATrace(header, data=chunk_data[offset:offset + npts])
+                tr = tr.view(tr.sample_index(starttime) if starttime is not None else 0,
+                             tr.sample_index(endtime) if endtime is not None else None)
+                if tr.npts:
+                    traces.append(tr)
+
+        strm = IDAStream(traces=traces)
+        if merge:
+            strm.merge()
+
+        return strm
+
+
+def _atomic_write(fn, write):
+
+    tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+    try:
+        with open(tmp_fn, 'wb') as fl:
+            write(fl)
+        os.replace(tmp_fn, fn)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
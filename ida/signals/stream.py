@@ -21,16 +21,60 @@
 #######################################################################################################################
 
 import re
-from ida.signals.trace import IDATrace
+from functools import lru_cache, reduce
+
+import numpy as np
+
+from ida.signals.trace import IDATrace, _epoch_ns
+
+
+@lru_cache(maxsize=256)
+def _compile_selector(pattern):
+    """Compiled regular expression for a select() pattern, or None if the pattern can only match itself"""
+    if re.escape(pattern) == pattern:
+        return None
+    return re.compile(pattern)
+
+
+def _matches(pattern, value):
+    regex = _compile_selector(pattern)
+    if regex is None:
+        return value == pattern
+    return regex.fullmatch(value) is not None
+
+
+class _TraceList(list):
+    """list of the traces of an IDAStream counting its modifications, so the stream can tell when its
+    NSLC index is out of date"""
+
+    def __init__(self, traces=()):
+        super().__init__(traces)
+        self.version = 0
+
+
+def _counting(name):
+    method = getattr(list, name)
+
+    def counted(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    counted.__name__ = name
+    return counted
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'remove', 'pop',
+              'clear', 'sort', 'reverse'):
+    setattr(_TraceList, _name, _counting(_name))
+
 
 class IDAStream(object):
 
     def __init__(self, traces=None):
-        self._traces = []
         if isinstance(traces, IDATrace):
-            self._traces = [traces]
-        if traces:
-            self._traces.extend(traces)
+            traces = [traces]
+        self._traces = _TraceList(traces or ())
+        self.reindex()
 
 
     @property
@@ -40,48 +84,97 @@ class IDAStream(object):
 
     @traces.setter
     def traces(self, traces):
-        self._traces = traces
+        self._traces = traces if isinstance(traces, _TraceList) else _TraceList(traces)
+        self.reindex()
+
+
+    def reindex(self):
+        """Rebuild the (network, station, location, channel) index used by select().
+
+        The index is maintained by append() and remove_trace() and rebuilt automatically on the next lookup
+        after a trace is renamed or the traces list is changed directly.
+        """
+        self._nslc_index = {}
+        self._seq = {}
+        self._id_versions = {}
+        self._next_seq = 0
+        for trace in self._traces:
+            self._index_trace(trace)
+        self._mark_indexed()
+
+
+    def _mark_indexed(self):
+        self._indexed_list = self._traces
+        self._indexed_list_version = self._traces.version
+
+
+    def _check_index(self):
+        """Rebuild the NSLC index if the traces list changed or a trace was renamed since it was indexed"""
+        if (self._traces is not self._indexed_list) or (self._traces.version != self._indexed_list_version) or \
+                any(trace._id_version != self._id_versions[id(trace)] for trace in self._traces):
+            self.reindex()
+
+
+    def _index_trace(self, trace):
+        nslc = (trace.network, trace.station, trace.location, trace.channel)
+        self._nslc_index.setdefault(nslc, []).append(trace)
+        self._seq[id(trace)] = self._next_seq
+        self._id_versions[id(trace)] = trace._id_version
+        self._next_seq += 1
 
 
     def append(self, trace):
         if not isinstance(trace, IDATrace):
             raise TypeError('trace must be of type IDATrace')
 
-        self.traces.append(trace)
+        self._check_index()
+        self._traces.append(trace)
+        self._index_trace(trace)
+        self._mark_indexed()
 
 
-    def select(self, station=None, channel=None, location=None, component=None):
+    def select(self, station=None, channel=None, location=None, component=None, network=None):
 
         # A new Stream object is returned but the traces it contains are just aliases to the traces of the original stream.
         # Does not copy the data but only passes a reference.
 
-        # all matching done using regular expressions (module re)
+        # all matching done using regular expressions (module re), against the distinct
+        # (network, station, location, channel) ids of the stream rather than every trace
 
-        traces = []
-        for trace in self:
-            # skip trace if any given criterion is not matched
-            if station is not None:
-                station = station.upper()
-                if not re.fullmatch(station, trace.station):
-                    continue
+        if network is not None:
+            network = network.upper()
+        if station is not None:
+            station = station.upper()
+        if channel is not None:
+            channel = channel.upper()
+        if component is not None:
+            component = component.upper()
 
-            if location is not None:
-                if not re.fullmatch(location, trace.location):
-                    continue
-
-            if channel is not None:
-                channel = channel.upper()
-                if not re.fullmatch(channel, trace.channel):
-                    continue
+        self._check_index()
 
-            if component is not None:
-                component = component.upper()
-                if len(trace.channel) < 3:
-                    continue
-                if not (trace.channel[-1] == component):
+        patterns = (network, station, location, channel)
+        if component is None and all((pat is not None) and (_compile_selector(pat) is None) for pat in patterns):
+            keys = [patterns] if patterns in self._nslc_index else []
+        else:
+            keys = []
+            for nslc in self._nslc_index:
+                # skip id if any given criterion is not matched
+                if not all((pat is None) or _matches(pat, val) for pat, val in zip(patterns, nslc)):
                     continue
-
-            traces.append(trace)
+                if component is not None:
+                    chan = nslc[3]
+                    if len(chan) < 3:
+                        continue
+                    if not (chan[-1] == component):
+                        continue
+                keys.append(nslc)
+
+        if len(keys) == 1:
+            traces = list(self._nslc_index[keys[0]])
+        else:
+            # keep stream order
+            traces = sorted((trace for nslc in keys for trace in self._nslc_index[nslc]),
+                            key=lambda trace: self._seq[id(trace)])
 
         return self.__class__(traces=traces)
 
@@ -90,21 +183,188 @@ class IDAStream(object):
         if not isinstance(trace, IDATrace):
             raise TypeError('trace must be of type IDATrace')
 
-        return trace in self.traces
+        self._check_index()
+        nslc = (trace.network, trace.station, trace.location, trace.channel)
+        return any(tr is trace for tr in self._nslc_index.get(nslc, []))
 
 
     def remove_trace(self, trace):
         if not isinstance(trace, IDATrace):
             raise TypeError('trace must be of type IDATrace')
 
-        self.traces.remove(trace)
+        self._check_index()
+        self._traces.remove(trace)
+        nslc = (trace.network, trace.station, trace.location, trace.channel)
+        nslc_traces = self._nslc_index.get(nslc, [])
+        for ndx, tr in enumerate(nslc_traces):
+            if tr is trace:
+                del nslc_traces[ndx]
+                break
+        if not nslc_traces:
+            self._nslc_index.pop(nslc, None)
+        if trace not in self._traces:
+            self._seq.pop(id(trace), None)
+            self._id_versions.pop(id(trace), None)
+        self._mark_indexed()
+
+
+    def _header_arrays(self):
+        """Per trace NSLC sort rank, start and end (epoch ns), sampling rate and npts as arrays"""
+
+        self._check_index()
+        nslc_rank = {nslc: ndx for ndx, nslc in enumerate(sorted(self._nslc_index))}
+        cnt = len(self._traces)
+        codes = np.fromiter((nslc_rank[(tr.network, tr.station, tr.location, tr.channel)] for tr in self._traces),
+                            dtype=np.int64, count=cnt)
+        start = np.fromiter((tr.starttime_ns for tr in self._traces), dtype=np.int64, count=cnt)
+        rate = np.fromiter((tr.sampling_rate for tr in self._traces), dtype=np.float64, count=cnt)
+        npts = np.fromiter((tr.npts for tr in self._traces), dtype=np.int64, count=cnt)
+        end = start + np.round(npts * 1e9 / rate).astype(np.int64)
+
+        return codes, start, end, rate, npts
+
+
+    def _sorted_headers(self):
+        """Trace order sorting by (NSLC, starttime) and the header arrays in that order,
+        plus the gap (ns, negative for overlaps) to each following trace of the same NSLC and sampling rate"""
+
+        codes, start, end, rate, npts = self._header_arrays()
+        order = np.lexsort((start, codes))
+        codes, start, end, rate, npts = codes[order], start[order], end[order], rate[order], npts[order]
+        same = (codes[1:] == codes[:-1]) & (rate[1:] == rate[:-1])
+        gap_ns = start[1:] - end[:-1]
+
+        return order, start, rate, npts, same, gap_ns
+
+
+    def sort(self):
+        """Sort traces in place by network, station, location, channel and starttime.
+
+        :return: self
+        :rtype: IDAStream
+        """
+
+        order = self._sorted_headers()[0]
+        self.traces = [self._traces[ndx] for ndx in order]
+
+        return self
+
+
+    def get_gaps(self, min_gap=None):
+        """Gaps and overlaps between traces with the same NSLC and sampling rate.
+
+        Adjacent traces are contiguous if the next trace starts within half a sample of the endtime of the previous one.
+
+        :param min_gap: Only report gaps (not overlaps) of at least min_gap seconds
+        :type min_gap: float
+        :return: List of [network, station, location, channel, gap start, gap end, duration (s), sample count],
+            duration and sample count negative for overlaps, in (NSLC, starttime) order
+        :rtype: list
+        """
+
+        order, start, rate, npts, same, gap_ns = self._sorted_headers()
+        rate = rate[1:]
+        flagged = same & (np.abs(gap_ns) >= 0.5e9 / rate)
+        if min_gap is not None:
+            flagged &= gap_ns >= min_gap * 1e9
+
+        gaps = []
+        for ndx in np.flatnonzero(flagged):
+            prev_tr = self._traces[order[ndx]]
+            next_tr = self._traces[order[ndx + 1]]
+            gaps.append([prev_tr.network, prev_tr.station, prev_tr.location, prev_tr.channel,
+                         prev_tr.endtime, next_tr.starttime,
+                         gap_ns[ndx] / 1e9, int(round(gap_ns[ndx] * rate[ndx] / 1e9))])
+
+        return gaps
+
+
+    def merge(self, fill_value=None):
+        """Merge runs of traces with the same NSLC and sampling rate into single traces, in place.
+
+        Contiguous traces (see get_gaps) are always merged. If fill_value is given, traces separated by gaps are
+        merged too, with the gaps filled with fill_value. Overlapping traces are never merged. Each merged trace
+        gets one preallocated sample buffer and the header of the first trace of its run. The stream ends up
+        sorted by (NSLC, starttime).
+
+        :param fill_value: Value for samples in gaps between merged traces
+        :type fill_value: int or float
+        :return: self
+        :rtype: IDAStream
+        """
+
+        order, start, rate, npts, same, gap_ns = self._sorted_headers()
+        if not len(order):
+            return self
+
+        # whole samples missing between adjacent traces
+        gap_samples = np.round(gap_ns * rate[1:] / 1e9).astype(np.int64)
+        if fill_value is None:
+            joins = same & (gap_samples == 0)
+        else:
+            joins = same & (gap_samples >= 0)
+        run_starts = np.concatenate(([0], np.flatnonzero(~joins) + 1, [len(order)]))
+        # sample offset of each trace within its merged run
+        offsets = np.concatenate(([0], npts[:-1] + gap_samples))
+
+        traces = []
+        for first, last in zip(run_starts[:-1], run_starts[1:]):
+            run = [self._traces[ndx] for ndx in order[first:last]]
+            if len(run) == 1:
+                traces.append(run[0])
+                continue
+
+            run_offsets = np.cumsum(offsets[first:last]) - offsets[first]
+            data = np.empty(run_offsets[-1] + npts[last - 1],
+                            dtype=reduce(np.promote_types, (tr.data.dtype for tr in run)))
+            if np.any(gap_samples[first:last - 1]):
+                data.fill(fill_value)
+            for tr, offset in zip(run, run_offsets):
+                data[offset:offset + tr.npts] = tr.data
+
+            merged = run[0].view()
+            merged.data = data
+            traces.append(merged)
+
+        self.traces = traces
+
+        return self
+
+
+    def slice(self, starttime=None, endtime=None):
+        """New stream with the traces overlapping starttime..endtime, each trimmed to the time window.
+
+        Traces are views of the original samples and share their headers (copy-on-write).
+
+        :param starttime: Start of time window, open if None
+        :type starttime: UTCDateTime
+        :param endtime: End of time window, open if None
+        :type endtime: UTCDateTime
+        :rtype: IDAStream
+        """
+
+        codes, start, end, rate, npts = self._header_arrays()
+        keep = np.ones(len(self._traces), dtype=bool)
+        if starttime is not None:
+            keep &= end > _epoch_ns(starttime)
+        if endtime is not None:
+            keep &= start < _epoch_ns(endtime)
+
+        traces = []
+        for ndx in np.flatnonzero(keep):
+            tr = self._traces[ndx]
+            start_ndx = tr.sample_index(starttime) if starttime is not None else 0
+            end_ndx = tr.sample_index(endtime) if endtime is not None else None
+            traces.append(tr.view(start_ndx, end_ndx))
+
+        return self.__class__(traces=traces)
 
 
     def __len__(self):
         return len(self.traces)
 
     def __iter__(self):
-        return list(self.traces).__iter__()
+        return iter(self._traces)
 
     def __getitem__(self, index):
         """
@@ -0,0 +1,78 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import numpy as np
+
+from ida.obspy.core.utcdatetime import UTCDateTime
+
+from ida.signals import chunkstore
+from ida.signals.chunkstore import TraceChunkStore
+from ida.signals.stream import IDAStream
+from ida.signals.trace import IDATrace
+
+
+def test_chunk_store_window(tmp_path):
+
+    t0 = UTCDateTime(2020, 1, 1, 12)
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': 'LHZ',
+              'sampling_rate': 1.0, 'starttime': t0}
+    # 3 days of samples, then another day after a one day gap
+    traces = [IDATrace(header, data=np.arange(3 * 86400, dtype=np.int32)),
+              IDATrace(dict(header, starttime=t0 + 4 * 86400), data=np.arange(86400, dtype=np.int32))]
+    store = TraceChunkStore(str(tmp_path), chunk_seconds=86400)
+    store.write(IDAStream(traces))
+    store.write(traces[1:])
+
+    assert store.ids() == ['II.PFO.00.LHZ']
+    assert len(list(tmp_path.joinpath('II.PFO.00.LHZ').glob('*.seg.npy'))) == 6
+
+    strm = store.read('II.PFO.00.LHZ', t0 + 86000, t0 + 87000)
+    assert len(strm) == 1
+    assert strm[0].starttime == t0 + 86000 and strm[0].npts == 1000
+    np.testing.assert_array_equal(strm[0].data, np.arange(86000, 87000))
+
+    strm = store.read('II.PFO.00.LHZ', merge=False)
+    assert [tr.npts for tr in strm] == [43200, 86400, 86400, 43200, 43200, 43200]
+    strm = store.read('II.PFO.00.LHZ')
+    assert [(tr.starttime - t0, tr.npts) for tr in strm] == [(0, 3 * 86400), (4 * 86400, 86400)]
+
+
+def test_chunk_store_writes_each_chunk_once(tmp_path, monkeypatch):
+
+    t0 = UTCDateTime(2020, 1, 1)
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': 'LHZ', 'sampling_rate': 1.0}
+    # 48 contiguous hours, each trace given twice
+    traces = [IDATrace(dict(header, starttime=t0 + hour * 3600),
+                       data=np.arange(hour * 3600, (hour + 1) * 3600, dtype=np.int32)) for hour in range(48)]
+    store = TraceChunkStore(str(tmp_path), chunk_seconds=86400)
+
+    written = []
+    atomic_write = chunkstore._atomic_write
+    monkeypatch.setattr(chunkstore, '_atomic_write', lambda fn, write: (written.append(fn), atomic_write(fn, write)))
+    store.write(traces + traces)
+
+    # meta.json plus samples and segment table of 2 chunks
+    assert len(written) == 5
+    assert len(np.load(str(tmp_path / 'II.PFO.00.LHZ' / '{:08d}.seg.npy'.format(18262)))) == 24
+    strm = store.read('II.PFO.00.LHZ')
+    assert len(strm) == 1 and strm[0].npts == 48 * 3600
+    np.testing.assert_array_equal(strm[0].data, np.arange(48 * 3600))
@@ -0,0 +1,133 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import numpy as np
+from obspy import UTCDateTime
+
+from ida.signals.stream import IDAStream
+from ida.signals.trace import IDATrace
+
+
+def make_trace(channel, location='00', starttime=UTCDateTime(2020, 1, 1), npts=100, sampling_rate=1.0):
+    header = {'network': 'II', 'station': 'PFO', 'location': location, 'channel': channel,
+              'sampling_rate': sampling_rate, 'starttime': starttime}
+    return IDATrace(header, data=np.arange(npts, dtype=np.int32))
+
+
+def test_select():
+
+    strm = IDAStream([make_trace(chan, loc) for loc in ('00', '10') for chan in ('BHZ', 'BH1', 'BH2', 'CCF')])
+    strm.append(make_trace('BHZ', '00', starttime=UTCDateTime(2020, 1, 2)))
+
+    assert len(strm.select(station='pfo', channel='bhz', location='00')) == 2
+    assert [tr.location for tr in strm.select(channel='BHZ')] == ['00', '10', '00']
+    assert [tr.id for tr in strm.select(channel='CC[FS]')] == ['II.PFO.00.CCF', 'II.PFO.10.CCF']
+    assert [tr.channel for tr in strm.select(location='10', component='1')] == ['BH1']
+    assert len(strm.select(network='IU')) == 0
+    assert len(strm.select(network='ii', channel='BHZ')) == 3
+
+    for tr in strm.select(location='10'):
+        strm.remove_trace(tr)
+    assert len(strm) == 5
+    assert len(strm.select(location='10')) == 0
+
+
+def test_select_after_renames_and_list_changes():
+
+    strm = IDAStream([make_trace(chan) for chan in ('BHZ', 'BH1', 'BH2')])
+    assert len(strm.select(channel='BHZ')) == 1
+
+    strm[1].channel = 'BHZ'
+    assert [tr.channel for tr in strm.select(channel='BHZ')] == ['BHZ', 'BHZ']
+    strm[2].header['location'] = '10'
+    assert len(strm.select(location='00')) == 2
+    assert strm.has_trace(strm[2])
+
+    strm.traces.append(make_trace('LHZ'))
+    assert len(strm.select(channel='LHZ')) == 1
+    strm.traces[0] = make_trace('VHZ')
+    assert len(strm.select(channel='VHZ')) == 1
+    assert len(strm.select(channel='BHZ')) == 1
+    del strm.traces[-1]
+    assert len(strm.select(channel='LHZ')) == 0
+
+    strm.append(make_trace('LHZ'))
+    strm.remove_trace(strm[0])
+    assert [tr.channel for tr in strm.select(channel='.HZ')] == ['BHZ', 'LHZ']
+
+
+def test_rename_only_reindexes_streams_holding_trace(monkeypatch):
+
+    strm = IDAStream([make_trace(chan) for chan in ('BHZ', 'BH1')])
+    other = IDAStream([make_trace(chan) for chan in ('LHZ', 'LH1')])
+
+    reindexed = []
+    reindex = IDAStream.reindex
+    monkeypatch.setattr(IDAStream, 'reindex', lambda self: (reindexed.append(self), reindex(self)))
+
+    strm[1].channel = 'BH2'
+    assert len(other.select(channel='LHZ')) == 1
+    assert [tr.channel for tr in strm.select(channel='BH2')] == ['BH2']
+    # besides the streams select returns, only the stream holding the renamed trace is reindexed
+    assert not any(stream is other for stream in reindexed)
+    assert sum(stream is strm for stream in reindexed) == 1
+
+
+def test_merge_gaps_slice():
+
+    t0 = UTCDateTime(2020, 1, 1)
+    strm = IDAStream([make_trace('BHZ', starttime=t0 + 200), make_trace('BH1', starttime=t0),
+                      make_trace('BHZ', starttime=t0 + 100), make_trace('BHZ', starttime=t0),
+                      make_trace('BHZ', starttime=t0 + 310), make_trace('BH1', starttime=t0 + 150)])
+
+    assert [(tr.channel, tr.starttime - t0) for tr in strm.sort()][:3] == [('BH1', 0), ('BH1', 150), ('BHZ', 0)]
+
+    gaps = strm.get_gaps()
+    assert [(gap[3], gap[4] - t0, gap[6], gap[7]) for gap in gaps] == [('BH1', 100, 50, 50), ('BHZ', 300, 10, 10)]
+    assert strm.get_gaps(min_gap=20)[0][3] == 'BH1'
+
+    sliced = strm.slice(t0 + 50, t0 + 250)
+    assert [(tr.channel, tr.starttime - t0, tr.npts) for tr in sliced] == \
+        [('BH1', 50, 50), ('BH1', 150, 100), ('BHZ', 50, 50), ('BHZ', 100, 100), ('BHZ', 200, 50)]
+    assert np.shares_memory(sliced[2].data, strm[2].data)
+
+    strm.merge()
+    assert [(tr.channel, tr.starttime - t0, tr.npts) for tr in strm] == \
+        [('BH1', 0, 100), ('BH1', 150, 100), ('BHZ', 0, 300), ('BHZ', 310, 100)]
+    np.testing.assert_array_equal(strm[2].data, np.tile(np.arange(100), 3))
+
+    strm.merge(fill_value=-1)
+    assert [tr.npts for tr in strm] == [250, 410]
+    assert (strm[1].data[300:310] == -1).all() and strm[1].data.dtype == np.int32
+
+
+def test_merge_many_fragments():
+
+    # more fragments than numpy accepts as separate arguments
+    t0 = UTCDateTime(2020, 1, 1)
+    strm = IDAStream([make_trace('BHZ', starttime=t0 + ndx * 10, npts=10) for ndx in range(40)])
+    strm[5].data = strm[5].data.astype(np.float64)
+
+    strm.merge()
+    assert len(strm) == 1
+    assert strm[0].npts == 400 and strm[0].data.dtype == np.float64
+    np.testing.assert_array_equal(strm[0].data, np.tile(np.arange(10), 40))
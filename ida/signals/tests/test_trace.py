@@ -0,0 +1,103 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import numpy as np
+from obspy import UTCDateTime
+
+from ida.signals.trace import IDATrace
+
+
+def make_trace(npts=1000, sampling_rate=20.0):
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': 'BHZ',
+              'sampling_rate': sampling_rate, 'starttime': UTCDateTime(2020, 1, 1), 'npts': npts}
+    return IDATrace(header, data=np.arange(npts, dtype=np.int32))
+
+
+def test_trim_is_view():
+
+    tr = make_trace()
+    orig = tr.data
+    tr.trim(tr.starttime + 3.3, tr.endtime)
+
+    assert tr.npts == 934
+    assert tr.data[0] == 66
+    assert tr.starttime == UTCDateTime(2020, 1, 1, 0, 0, 3, 300000)
+    assert np.shares_memory(tr.data, orig)
+
+
+def test_trim_copy():
+
+    tr = make_trace()
+    orig = tr.data
+    tr.trim(tr.starttime + 4.0, tr.starttime + 5.0, copy=True)
+
+    assert tr.npts == 20
+    np.testing.assert_array_equal(tr.data, np.arange(80, 100))
+    assert not np.shares_memory(tr.data, orig)
+
+
+def test_header_copy_on_write():
+
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': 'BHZ',
+              'sampling_rate': 20.0, 'starttime': UTCDateTime(2020, 1, 1), 'npts': 100,
+              'mseed': {'dataquality': 'D'}}
+    tr1 = IDATrace(header, data=np.arange(100))
+    tr2 = IDATrace(header, data=np.arange(100))
+
+    tr1.channel = 'BH1'
+    tr1.trim_index(10)
+    tr2.header['mseed']['dataquality'] = 'Q'
+
+    assert (tr1.channel, tr1.npts, tr2.channel, tr2.npts) == ('BH1', 90, 'BHZ', 100)
+    assert header['channel'] == 'BHZ' and header['npts'] == 100
+    assert header['mseed']['dataquality'] == 'D'
+
+
+def test_typed_fields_and_header_view():
+
+    tr = make_trace()
+    assert tr.endtime == UTCDateTime(2020, 1, 1, 0, 0, 50)
+    assert tr.starttime_ns == UTCDateTime(2020, 1, 1).ns
+
+    tr.header['sampling_rate'] = 40
+    tr.header['starttime'] = UTCDateTime(2020, 1, 2)
+    assert tr.sampling_rate == 40.0
+    assert tr.endtime == UTCDateTime(2020, 1, 2, 0, 0, 25)
+    assert tr.endtime_ns == UTCDateTime(2020, 1, 2, 0, 0, 25).ns
+
+    header = dict(tr.header)
+    assert header['npts'] == 1000 and header['channel'] == 'BHZ'
+    assert IDATrace(header, data=tr.data).id == 'II.PFO.00.BHZ'
+
+
+def test_start_ns_precision():
+
+    # nanosecond start times are beyond float epoch seconds
+    starttime = UTCDateTime(ns=1577836800123456789)
+    header = {'network': 'II', 'station': 'PFO', 'location': '00', 'channel': 'BHZ',
+              'sampling_rate': 1000.0, 'starttime': starttime}
+    tr = IDATrace(header, data=np.arange(1000, dtype=np.int32))
+
+    assert tr.starttime_ns == 1577836800123456789
+    assert tr.endtime_ns == 1577836801123456789
+    assert tr.sample_index(UTCDateTime(ns=1577836800124056789)) == 1
+    assert tr.sample_index(UTCDateTime(ns=1577836800124856789)) == 1
@@ -0,0 +1,126 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import pytest
+import numpy as np
+from obspy import Trace, UTCDateTime
+from scipy.signal import resample_poly
+from obspy.signal.filter import lowpass
+
+from ida.instruments import TRIAXIAL_TRANSFORMS, XFRM_TYPE_XYZ2UVW, XFRM_TYPE_UVW2ENZ_ABS, XFRM_TYPE_XYZ2ENZ_ABS
+from ida.signals.utils import time_offset_fft, channel_xform, xform_components
+
+
+@pytest.fixture
+def noise_100hz():
+    rng = np.random.default_rng(42)
+    return lowpass(rng.standard_normal(100 * 3000), 5.0, 100.0)
+
+
+def shifted(data, sr, shift_secs):
+    """data delayed so that shifted(t) == data(t + shift_secs)"""
+    times = np.arange(len(data)) / sr
+    return np.interp(times + shift_secs, times, data)
+
+
+@pytest.mark.parametrize("shift_secs", [0.0, 1.2345, -0.4321])
+def test_time_offset_fft_subsample(noise_100hz, shift_secs):
+
+    tr1 = Trace(noise_100hz.copy(), header={'sampling_rate': 100.0, 'station': 'STA1'})
+    tr2 = Trace(shifted(noise_100hz, 100.0, shift_secs), header={'sampling_rate': 100.0, 'station': 'STA2'})
+
+    offset, val, _, emsg = time_offset_fft(tr1, tr2, UTCDateTime(0) + 500, UTCDateTime(0) + 1500,
+                                           max_shift=120.0)
+
+    assert emsg == ''
+    assert val > 0.99
+    assert offset == pytest.approx(shift_secs, abs=0.002)
+
+
+def test_time_offset_fft_different_sample_rates(noise_100hz):
+
+    tr1 = Trace(resample_poly(noise_100hz, 2, 5), header={'sampling_rate': 40.0, 'station': 'STA1'})
+    tr2 = Trace(shifted(noise_100hz, 100.0, 0.7654), header={'sampling_rate': 100.0, 'station': 'STA2'})
+
+    offset, val, _, emsg = time_offset_fft(tr1, tr2, UTCDateTime(0) + 500, UTCDateTime(0) + 1500,
+                                           max_shift=120.0)
+
+    assert emsg == ''
+    assert val > 0.99
+    assert offset == pytest.approx(0.7654, abs=0.002)
+
+
+@pytest.mark.parametrize("grid_offset", [0.004, -0.0037, 0.0125])
+def test_time_offset_fft_off_grid(noise_100hz, grid_offset):
+
+    # same signal sampled on grids grid_offset secs apart, with correct start times
+    tr1 = Trace(noise_100hz.copy(), header={'sampling_rate': 100.0, 'station': 'STA1'})
+    tr2 = Trace(shifted(noise_100hz, 100.0, grid_offset),
+                header={'sampling_rate': 100.0, 'station': 'STA2', 'starttime': UTCDateTime(0) + grid_offset})
+
+    offset, val, _, emsg = time_offset_fft(tr1, tr2, UTCDateTime(0) + 500, UTCDateTime(0) + 1500,
+                                           max_shift=120.0)
+
+    assert emsg == ''
+    assert val > 0.99
+    assert offset == pytest.approx(0.0, abs=0.001)
+
+
+def test_time_offset_fft_window_not_covered(noise_100hz):
+
+    tr1 = Trace(noise_100hz.copy(), header={'sampling_rate': 100.0, 'station': 'STA1'})
+    tr2 = Trace(noise_100hz[60000:].copy(), header={'sampling_rate': 100.0, 'station': 'STA2',
+                                                    'starttime': UTCDateTime(0) + 600})
+
+    offset, val, corrfun, emsg = time_offset_fft(tr1, tr2, UTCDateTime(0) + 500, UTCDateTime(0) + 1500)
+    assert (offset, val, len(corrfun)) == (0, 0.0, 0)
+    assert 'does not cover the correlation window' in emsg
+
+
+@pytest.mark.parametrize("seis_model", sorted(TRIAXIAL_TRANSFORMS))
+def test_channel_xform_fused_matches_two_step(seis_model):
+
+    rng = np.random.default_rng(7)
+    xfrms = TRIAXIAL_TRANSFORMS[seis_model]
+    trs = [Trace(rng.integers(-2**20, 2**20, 1000).astype(np.int32), header={'channel': 'BH' + chn})
+           for chn in '21Z']
+
+    uvw = channel_xform(trs, xfrms[XFRM_TYPE_XYZ2UVW])
+    two_step = channel_xform(uvw, xfrms[XFRM_TYPE_UVW2ENZ_ABS])
+    fused = channel_xform(trs, xfrms[XFRM_TYPE_XYZ2ENZ_ABS])
+
+    assert [tr.stats.channel for tr in fused] == ['BH2', 'BH1', 'BHZ']
+    for tr_fused, tr_two_step in zip(fused, two_step):
+        np.testing.assert_allclose(tr_fused.data, tr_two_step.data, rtol=1e-12, atol=1e-6)
+
+
+def test_xform_components_in_place():
+
+    rng = np.random.default_rng(7)
+    comps = rng.standard_normal((3, 500))
+    xfrm = TRIAXIAL_TRANSFORMS[sorted(TRIAXIAL_TRANSFORMS)[0]][XFRM_TYPE_XYZ2UVW]
+    expected = np.asarray(xfrm) @ comps
+
+    res = xform_components(comps, xfrm, out=comps)
+
+    assert res is comps
+    np.testing.assert_allclose(comps, expected)
@@ -20,13 +20,96 @@
 # by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################################################
 
+from collections.abc import MutableMapping
+
 import numpy as np
-import copy
 
-class IDATrace(object):
+from ida.obspy.core.utcdatetime import UTCDateTime
+
+# header keys held in typed IDATrace fields rather than in the header dict
+TRACE_HEADER_FIELDS = ('network', 'station', 'location', 'channel', 'starttime', 'sampling_rate', 'npts')
+
+
+def _epoch_ns(time):
+    """Epoch nanoseconds of an obspy UTCDateTime, or of an ida.obspy UTCDateTime via its float timestamp"""
+    time_ns = getattr(time, 'ns', None)
+    if time_ns is not None:
+        return int(time_ns)
+    return int(round(time.timestamp * 1e9))
+
+
+class IDATraceHeader(MutableMapping):
+    """dict style view of an IDATrace header, for code written against the original header dict.
+
+    Keys in TRACE_HEADER_FIELDS read and write the typed trace fields, any other keys (eg 'mseed') the
+    trace's dict of extra header values.
+    """
+
+    __slots__ = ('_trace',)
+
+    def __init__(self, trace):
+        self._trace = trace
+
+    def __getitem__(self, key):
+        if key in TRACE_HEADER_FIELDS:
+            return getattr(self._trace, key)
+        if key in self._trace._extra:
+            # values may be mutable (eg 'mseed' dict)
+            return self._trace._own_extra()[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in TRACE_HEADER_FIELDS:
+            setattr(self._trace, key, value)
+        else:
+            self._trace._own_extra()[key] = value
+
+    def __delitem__(self, key):
+        if key in TRACE_HEADER_FIELDS:
+            raise KeyError('Can not delete IDATrace header field {}'.format(key))
+        del self._trace._own_extra()[key]
+
+    def __iter__(self):
+        yield from TRACE_HEADER_FIELDS
+        for key in self._trace._extra:
+            if key not in TRACE_HEADER_FIELDS:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
-    def __init__(self, header, data=None):
-        self._header = copy.deepcopy(header)
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class IDATrace(object):
+    """Timeseries with its SEED identifier, start time (held as epoch ns), sampling rate and sample count in typed
+    fields. The endtime is cached until one of these changes. Other header values (eg 'mseed') stay in a dict
+    shared with the header passed in until first modified (copy-on-write).
+    """
+
+    __slots__ = ('_network', '_station', '_location', '_channel', '_id_version', '_start_ns', '_starttime',
+                 '_sampling_rate', '_npts', '_endtime', '_extra', '_extra_owned', '_data')
+
+    def __init__(self, header=None, data=None):
+        if header is None:
+            header = {}
+        elif not isinstance(header, dict):
+            header = dict(header)
+
+        self._network = header.get('network', '')
+        self._station = header.get('station', '')
+        self._location = header.get('location', '')
+        self._channel = header.get('channel', '')
+        # bumped when the SEED id changes, so an IDAStream can tell its NSLC index is out of date
+        self._id_version = 0
+        starttime = header.get('starttime')
+        self._set_start(starttime if starttime is not None else UTCDateTime(0))
+        self._sampling_rate = float(header.get('sampling_rate', 1.0))
+        self._extra = header
+        self._extra_owned = False
+
+        self._data = np.array([])
         if isinstance(data, np.ndarray):
             self._data = data
         elif isinstance(data, list):
@@ -34,6 +117,25 @@ class IDATrace(object):
         elif data:
             raise TypeError('IDATrace data must be None or of type list or numpy.ndarray')
 
+        self._npts = int(header.get('npts', len(self._data)))
+
+
+    def _set_start(self, starttime):
+        self._starttime = starttime
+        self._start_ns = _epoch_ns(starttime)
+        self._endtime = None
+
+
+    def _own_extra(self):
+        """Extra header values private to this trace, copied from the shared dict on first use"""
+        if not self._extra_owned:
+            extra = {key: val for key, val in self._extra.items() if key not in TRACE_HEADER_FIELDS}
+            if 'mseed' in extra:
+                extra['mseed'] = dict(extra['mseed'])
+            self._extra = extra
+            self._extra_owned = True
+        return self._extra
+
 
     @property
     def data(self):
@@ -43,92 +145,184 @@ class IDATrace(object):
     @data.setter
     def data(self, data):
         self._data = data
-        self._header['npts'] = len(data)
+        self.npts = len(data)
 
 
     @property
     def header(self):
-            return self._header
+        return IDATraceHeader(self)
 
 
     @property
     def sampling_rate(self):
-        return self.header['sampling_rate']
+        return self._sampling_rate
 
-    @property
-    def station(self):
-        return self._header['station']
+
+    @sampling_rate.setter
+    def sampling_rate(self, sampling_rate):
+        self._sampling_rate = float(sampling_rate)
+        self._endtime = None
 
 
     @property
     def starttime(self):
-        return self._header['starttime']
+        return self._starttime
+
+
+    @starttime.setter
+    def starttime(self, starttime):
+        self._set_start(starttime)
+
+
+    @property
+    def starttime_ns(self):
+        """starttime as integer epoch nanoseconds"""
+        return self._start_ns
+
+
+    @property
+    def npts(self):
+        return self._npts
+
+
+    @npts.setter
+    def npts(self, npts):
+        self._npts = int(npts)
+        self._endtime = None
 
 
     @property
     def network(self):
-        return self._header['network']
+        return self._network
+
+
+    @network.setter
+    def network(self, net):
+        self._network = net
+        self._id_version += 1
 
 
     @property
-    def location(self):
-        return self._header['location']
+    def station(self):
+        return self._station
 
 
+    @station.setter
+    def station(self, sta):
+        self._station = sta
+        self._id_version += 1
+
 
     @property
-    def npts(self):
-        return self._header['npts']
+    def location(self):
+        return self._location
+
+
+    @location.setter
+    def location(self, loc):
+        self._location = loc
+        self._id_version += 1
 
 
     @property
     def channel(self):
-        return self._header['channel']
+        return self._channel
 
 
     @channel.setter
     def channel(self, chan):
-        self.header['channel'] = chan
+        self._channel = chan
+        self._id_version += 1
 
     def mseed(self):
-        return self._header['mseed']
+        return self._own_extra()['mseed']
 
 
     @property
     def byteorder(self):
-        return self._header['mseed']['byteorder']
+        return self._extra['mseed']['byteorder']
 
 
     @property
     def record_length(self):
-        return self._header['mseed']['record_length']
+        return self._extra['mseed']['record_length']
 
 
     @property
     def encoding(self):
-        return self._header['mseed']['encoding']
+        return self._extra['mseed']['encoding']
 
 
     @property
     def dataquality(self):
-        return self._header['mseed']['dataquality']
+        return self._extra['mseed']['dataquality']
 
 
     @property
     def filesize(self):
-        return self._header['mseed']['filesize']
+        return self._extra['mseed']['filesize']
 
 
     @property
     def number_of_records(self):
-        return self._header['mseed']['number_of_records']
+        return self._extra['mseed']['number_of_records']
 
     @property
     def endtime(self):
-        return self.starttime + self.npts / self.sampling_rate
+        if self._endtime is None:
+            self._endtime = self._starttime + self._npts / self._sampling_rate
+        return self._endtime
+
 
+    @property
+    def endtime_ns(self):
+        """endtime as integer epoch nanoseconds"""
+        return self._start_ns + int(round(self._npts * 1e9 / self._sampling_rate))
+
+
+    def sample_index(self, time):
+        """Index of the sample nearest to time. May be outside of 0..npts."""
+        # via epoch nanoseconds so time may be an obspy or ida.obspy UTCDateTime
+        return int(round((_epoch_ns(time) - self._start_ns) * self._sampling_rate / 1e9))
+
+
+    def trim_index(self, start_ndx=0, end_ndx=None, copy=False):
+        """Keep samples start_ndx:end_ndx (clipped to the trace) in constant time.
+
+        data becomes a view of the current samples unless copy is True.
+        """
+
+        npts = self._npts
+        if end_ndx is None:
+            end_ndx = npts
+        start_ndx = min(max(start_ndx, 0), npts)
+        end_ndx = min(max(end_ndx, start_ndx), npts)
 
-    def trim(self, starttime, endtime):
+        data = self._data[start_ndx:end_ndx]
+        if copy:
+            data = data.copy()
+
+        if start_ndx:
+            self._set_start(self._starttime + start_ndx / self._sampling_rate)
+        self.data = data
+
+
+    def view(self, start_ndx=0, end_ndx=None):
+        """New trace of samples start_ndx:end_ndx (clipped to this trace) sharing this trace's samples and
+        extra header values (copy-on-write)."""
+
+        trace = IDATrace.__new__(IDATrace)
+        for slot in IDATrace.__slots__:
+            setattr(trace, slot, getattr(self, slot))
+        # both traces now share the extra header dict, neither may modify it in place
+        self._extra_owned = False
+        trace._extra_owned = False
+        trace.trim_index(start_ndx, end_ndx)
+
+        return trace
+
+
+    def trim(self, starttime, endtime, copy=False):
 
         if starttime < self.starttime:
             raise ValueError('Trimmed starttime must be >= current starttime.')
@@ -139,12 +333,7 @@ class IDATrace(object):
         if endtime < starttime:
             raise ValueError('Endtime can not be before starttime.')
 
-        startdelta = starttime - self.starttime
-        enddelta = endtime - self.endtime  # will be 0 or negative
-
-        self._header['starttime'] = starttime
-        sr = self.sampling_rate
-        self.data = self.data[int(sr * startdelta):int(sr * enddelta)]
+        self.trim_index(self.sample_index(starttime), self.sample_index(endtime), copy=copy)
 
 
     def get_id(self):
@@ -166,8 +355,7 @@ class IDATrace(object):
         >>> print(tr.id)
         BW.MANZ..EHZ
         """
-        out = "{network}.{station}.{location}.{channel}"
-        return out.format(**self.header)
+        return '{}.{}.{}.{}'.format(self._network, self._station, self._location, self._channel)
 
     id = property(get_id)
 
@@ -19,15 +19,24 @@
 # If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
 # by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################################################
+from fractions import Fraction
+import hashlib
 import logging
+import os
+import os.path
 
-from obspy.core import Trace, Stream  #, UTCDateTime
+from obspy.core import Trace, Stream, UTCDateTime
 from obspy.signal.cross_correlation import correlate, xcorr_max
-from scipy.signal import freqs
+from obspy.signal.filter import bandpass
+from obspy.signal.invsim import evalresp
+from scipy.fft import next_fast_len
+from scipy.signal import freqs, detrend, resample_poly
+from scipy.signal.windows import tukey
 from scipy.signal.ltisys import zpk2tf
 from numpy import array, ndarray, isclose, abs, mod, divide, multiply, pi, exp, cos, sin, \
-        angle, absolute, complex128, asarray, less
-from numpy.fft import rfft
+        angle, absolute, complex128, asarray, less, float64, concatenate, sqrt, dot, argmax, conj
+from numpy import linspace, load, save, empty, matmul
+from numpy.fft import rfft, irfft
 
 from fabulous.color import red, bold
 
@@ -72,6 +81,177 @@ def time_offset(trace1, trace2, bpfreqmin=0.1, bpfreqmax=1.0, winsize=1000):
 
     return offset, val, corrfun, ''
 
+def time_offset_fft(trace1, trace2, starttime, endtime, bpfreqmin=0.1, bpfreqmax=2.0, max_shift=None):
+    """ Timeseries time offset computed with FFT cross correlation over a window,
+        refined to sub-sample precision.
+
+        Only the window from starttime to endtime (plus padding for the filter to settle) is
+        taken from each trace. The windows are detrended, tapered and bandpassed and, if the
+        sampling rates differ, the higher rate window is resampled to the lower rate. The full
+        traces are never filtered or resampled.
+
+        The correlation peak is refined with a parabola through the peak and its two
+        neighboring lags. The fraction of a sample between the two traces' sample grids is
+        accounted for, so traces with correct start times give an offset of 0.
+
+        Returns offset in seconds that when added to trace2 the actual time of events
+        will be the same, as time_offset().
+
+        :param trace1: Trace with reference time base
+        :type trace1: obspy.Trace
+        :param trace2: Trace whose time offset is computed
+        :type trace2: obspy.Trace
+        :param starttime: Start of correlation window
+        :type starttime: UTCDateTime
+        :param endtime: End of correlation window
+        :type endtime: UTCDateTime
+        :param bpfreqmin: Bandpass low corner (hz)
+        :type bpfreqmin: float
+        :param bpfreqmax: Bandpass high corner (hz)
+        :type bpfreqmax: float
+        :param max_shift: Largest offset (secs) searched. Default is the window length
+        :type max_shift: float
+        :return: (offset in secs, max correlation value, correlation function, error msg).
+            (0, 0.0, [], error msg) if the offset can not be computed, eg when either trace
+            does not fully cover starttime..endtime
+        :rtype: (float, float, numpy.ndarray, str)
+    """
+
+    common_sr = min(trace1.stats.sampling_rate, trace2.stats.sampling_rate)
+    if bpfreqmax >= common_sr / 2.0:
+        msg = 'Bandpass max freq must be below nyquist of the lowest sampling rate. Cannot compute time_offset.'
+        print(red(bold(msg)))
+        return 0, 0.0, [], msg
+
+    # pad window so filter transients fall outside of it
+    pad = 2.0 / bpfreqmin
+
+    windows = []
+    residuals = []
+    for trace in (trace1, trace2):
+        sr = trace.stats.sampling_rate
+        win_tr = trace.slice(starttime - pad, endtime + pad)
+        if win_tr.stats.npts == 0:
+            msg = 'Trace {} does not cover the correlation window {} - {}. Cannot compute time_offset.'.format(
+                trace.id, starttime, endtime)
+            print(red(bold(msg)))
+            return 0, 0.0, [], msg
+
+        data = detrend(win_tr.data.astype(float64), type='linear')
+        data *= tukey(len(data), alpha=0.1)
+        data = bandpass(data, bpfreqmin, bpfreqmax, sr, zerophase=True)
+
+        if sr != common_sr:
+            ratio = Fraction(common_sr / sr).limit_denominator(1000)
+            data = resample_poly(data, ratio.numerator, ratio.denominator)
+
+        # drop padding, starting each window at the sample nearest to starttime. The window then
+        # starts residual secs before starttime, which is removed from the offset below
+        first_pos = (starttime - win_tr.stats.starttime) * common_sr
+        first = int(round(first_pos))
+        last = first + int(round((endtime - starttime) * common_sr))
+        if (first < 0) or (last > len(data)):
+            msg = 'Trace {} does not cover the correlation window {} - {}. Cannot compute time_offset.'.format(
+                trace.id, starttime, endtime)
+            print(red(bold(msg)))
+            return 0, 0.0, [], msg
+        windows.append(data[first:last])
+        residuals.append((first_pos - first) / common_sr)
+
+    win1, win2 = windows
+    if (len(win1) < 3) or (len(win2) < 3):
+        msg = 'Correlation window too short. Cannot compute time_offset.'
+        print(red(bold(msg)))
+        return 0, 0.0, [], msg
+
+    # cc[k] = sum(win1[n + k] * win2[n]), positive lags first then negative lags
+    nfft = next_fast_len(len(win1) + len(win2) - 1)
+    cc = irfft(rfft(win1, nfft) * conj(rfft(win2, nfft)), nfft)
+    norm = sqrt(dot(win1, win1) * dot(win2, win2))
+    if norm == 0:
+        msg = 'Correlation window has no signal. Cannot compute time_offset.'
+        print(red(bold(msg)))
+        return 0, 0.0, [], msg
+    cc /= norm
+
+    max_lag = min(len(win1), len(win2)) - 1
+    if max_shift is not None:
+        max_lag = min(max_lag, int(max_shift * common_sr))
+    corrfun = concatenate((cc[nfft - max_lag:], cc[:max_lag + 1]))
+
+    peak = argmax(absolute(corrfun))
+    val = corrfun[peak]
+
+    # parabolic interpolation of peak location
+    delta = 0.0
+    if 0 < peak < len(corrfun) - 1:
+        y0, y1, y2 = corrfun[peak - 1], corrfun[peak], corrfun[peak + 1]
+        denom = y0 - 2.0 * y1 + y2
+        if denom != 0:
+            delta = 0.5 * (y0 - y2) / denom
+
+    # the sample lag is between the windows' own starts, which differ by the sub-sample
+    # residuals when the two traces are not sampled on a common grid
+    offset = (peak - max_lag + delta) / common_sr - (residuals[0] - residuals[1])
+
+    return offset, val, corrfun, ''
+
+def cached_evalresp(t_samp, nfft, filename, date, station='*', channel='*', network='*', locid='*',
+                    units='VEL', freq=False, cache_dir=None):
+    """ obspy.signal.invsim.evalresp with an on-disk cache of the evaluated responses.
+
+        Responses are stored as .npy files named by a SHA-256 hash of the RESP file content
+        and all of the evalresp parameters, so an edited RESP file never matches a stale entry.
+        Cached responses are memory-mapped (read-only) on load.
+
+        :param t_samp: Sampling interval in seconds
+        :type t_samp: float
+        :param nfft: Number of FFT points of signal which needs correction
+        :type nfft: int
+        :param filename: SEED RESP-filename
+        :type filename: str
+        :param date: Date of interest
+        :type date: UTCDateTime
+        :param units: Output units. One of 'DIS', 'VEL', 'ACC' or 'DEF'
+        :type units: str
+        :param freq: Return frequencies too
+        :type freq: bool
+        :param cache_dir: Cache directory. Defaults to env IDA_EVALRESP_CACHE_DIR
+            or ~/.cache/ida/evalresp
+        :type cache_dir: str
+        :return: complex frequency response of length nfft // 2 + 1 (and frequencies, if freq is True)
+        :rtype: numpy.ndarray or (numpy.ndarray, numpy.ndarray)
+    """
+
+    if not cache_dir:
+        cache_dir = os.environ.get('IDA_EVALRESP_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'ida', 'evalresp'))
+
+    hasher = hashlib.sha256()
+    with open(filename, 'rb') as respfl:
+        hasher.update(respfl.read())
+    hasher.update(repr((float(t_samp), int(nfft), str(UTCDateTime(date)),
+                        station, channel, network, locid, units.upper())).encode())
+    cache_fn = os.path.join(cache_dir, hasher.hexdigest() + '.npy')
+
+    try:
+        resp = load(cache_fn, mmap_mode='r')
+    except (OSError, ValueError):
+        resp = evalresp(t_samp, nfft, filename, date, station=station, channel=channel,
+                        network=network, locid=locid, units=units)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_fn = '{}.{}.tmp'.format(cache_fn, os.getpid())
+            with open(tmp_fn, 'wb') as cachefl:
+                save(cachefl, resp)
+            os.replace(tmp_fn, cache_fn)
+        except OSError as e:
+            logging.warning('Unable to cache evalresp response in {}: {}'.format(cache_dir, e))
+
+    if freq:
+        return resp, linspace(0, 1 / (t_samp * 2.0), nfft // 2 + 1)
+    return resp
+
 def taper_high_freq_resp(resp, taper_fraction):
     """
     This comes from idaresponse/resp.c where highest 5% of complex frequency response
@@ -182,8 +362,37 @@ def invert_signal(channel, seis_model):
 #
 def trim_stream(src_stream, left=0, right=0):
 
-    for trace in src_stream:
-        trace.trim(trace.stats.starttime + left, trace.stats.endtime - right)
+    index_trim_stream(src_stream, left=left, right=right)
+
+
+def index_trim_stream(traces, left=0, right=0, copy=False):
+    """Trim left seconds from the start and right seconds from the end of each trace using sample indexes.
+
+    Offsets are computed once per trace and the trace data become views of the original samples
+    unless copy is True. Works with obspy Stream/Traces and IDAStream/IDATraces.
+
+    :param traces: Traces to trim in place
+    :type traces: obspy.core.stream.Stream or ida.signals.stream.IDAStream
+    :param left: Seconds to remove from start of each trace
+    :type left: float
+    :param right: Seconds to remove from end of each trace
+    :type right: float
+    :param copy: Copy the kept samples instead of referencing them
+    :type copy: bool
+    """
+
+    for trace in traces:
+        if hasattr(trace, 'trim_index'):
+            sr = trace.sampling_rate
+            trace.trim_index(int(round(left * sr)), trace.npts - int(round(right * sr)), copy=copy)
+        else:
+            sr = trace.stats.sampling_rate
+            npts = trace.stats.npts
+            start_ndx = min(max(int(round(left * sr)), 0), npts)
+            end_ndx = min(max(npts - int(round(right * sr)), start_ndx), npts)
+            data = trace.data[start_ndx:end_ndx]
+            trace.stats.starttime += start_ndx / sr
+            trace.data = data.copy() if copy else data
 
 
 def ntrim_stream(traces, left=0, right=0):
@@ -233,35 +442,56 @@ def normalize_response(freq_resp, freqlist, norm_freq):
     return normed, scale, ndx
 
 
-def channel_xform(trace_tpl, xfrm):
+def xform_components(data_tpl, xfrm, out=None):
+    """ Apply 3x3 transform xfrm to three equal length component timeseries with a single matmul.
+
+        :param data_tpl: 3 component arrays (or a 3 x N array) in ENZ (21Z, XYZ) order
+        :type data_tpl: tuple of ndarray or ndarray
+        :param xfrm: 3x3 transformation matrix
+        :type xfrm: list or ndarray
+        :param out: Optional 3 x N float64 array for the result. May be data_tpl itself to transform in place.
+        :type out: ndarray
+        :return: 3 x N array of transformed components
+        :rtype: ndarray
+    """
+
+    if isinstance(data_tpl, ndarray) and (data_tpl.ndim == 2) and (data_tpl.dtype == float64):
+        comps = data_tpl
+    else:
+        npts = len(data_tpl[0])
+        comps = out if (out is not None) and (out is not data_tpl) else empty((3, npts), dtype=float64)
+        for ndx in range(3):
+            comps[ndx] = data_tpl[ndx]
+
+    # matmul buffers internally when out overlaps its input
+    return matmul(asarray(xfrm, dtype=float64), comps, out=out)
+
+
+def channel_xform(trace_tpl, xfrm, out=None):
+    """ Transform three component traces with 3x3 matrix xfrm.
+
+        :param trace_tpl: Traces in ENZ (aka 21Z and XYZ for triaxial seis output) order
+        :type trace_tpl: tuple of Trace
+        :param xfrm: 3x3 transformation matrix
+        :type xfrm: list or ndarray
+        :param out: Optional 3 x N float64 array to hold the transformed data.
+            The returned traces' data are rows of this array.
+        :type out: ndarray
+        :return: Transformed traces with channels ending in '2', '1' and 'Z'
+        :rtype: tuple of Trace
+    """
 
-    #  traces and xfrms assumed to be ENZ (aka 21Z and XYZ for triaxial seis output) order
     chn_2chrs = trace_tpl[0].stats.channel[:2]
 
-    tr_2 = Trace(header=trace_tpl[0].stats.copy(), data=(multiply(trace_tpl[0].data, xfrm[0][0]) +
-                                                         multiply(trace_tpl[1].data, xfrm[0][1]) +
-                                                         multiply(trace_tpl[2].data, xfrm[0][2]))
-                   )
-    tr_2.stats.channel = chn_2chrs + '2'
-
-    tr_1 = Trace(header=trace_tpl[0].stats.copy(), data=(multiply(trace_tpl[0].data, xfrm[1][0]) +
-                                                         multiply(trace_tpl[1].data, xfrm[1][1]) +
-                                                         multiply(trace_tpl[2].data, xfrm[1][2]))
-    )
-    tr_1.stats.channel = chn_2chrs + '1'
-
-    tr_z = Trace(header=trace_tpl[0].stats.copy(), data=(multiply(trace_tpl[0].data, xfrm[2][0]) +
-                                                         multiply(trace_tpl[1].data, xfrm[2][1]) +
-                                                         multiply(trace_tpl[2].data, xfrm[2][2]))
-    )
-    tr_z.stats.channel = chn_2chrs + 'Z'
-
-    # if isinstance(trace_tpl, ida.calibration.qcal_utils.QCalData):
-    #     output_trace_tpl = ida.calibration.qcal_utils.QCalData(east=tr_E, north=tr_N, vertical=tr_Z, input=trace_tpl.input.copy())
-    # else:
-    output_trace_tpl = (tr_2, tr_1, tr_z)
-
-    return output_trace_tpl
+    xfrmd = xform_components([tr.data for tr in trace_tpl], xfrm, out=out)
+
+    output_traces = []
+    for ndx, chn_3rd in enumerate('21Z'):
+        tr = Trace(header=trace_tpl[0].stats.copy(), data=xfrmd[ndx])
+        tr.stats.channel = chn_2chrs + chn_3rd
+        output_traces.append(tr)
+
+    return tuple(output_traces)
 
 
 def unpack_paz(paz, paz_map):
@@ -0,0 +1,47 @@
+#######################################################################################################################
+# Copyright (C) 2018  Regents of the University of California
+#
+# This is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License (GNU GPL) as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in LICENSE.TXT in the root of the source code repository.
+# Additionally, it can be found at http://www.gnu.org/licenses/.
+#
+# NOTES: Per GNU GPLv3 terms:
+#   * This notice must be kept in this source file
+#   * Changes to the source must be clearly noted with date & time of change
+#
+# If you use this software in a product, an explicit acknowledgment in the product documentation of the contribution
+# by Project IDA, Institute of Geophysics and Planetary Physics, UCSD would be appreciated but is not required.
+#######################################################################################################################
+
+import os
+from datetime import datetime
+
+from ida.utils import arc_raw_ms_files
+
+
+def make_day_files(root, names):
+    for sta, yr, jday, name in names:
+        day_dir = root / sta / str(yr) / '{:03d}'.format(jday)
+        day_dir.mkdir(parents=True, exist_ok=True)
+        (day_dir / name).write_bytes(b'')
+
+
+def test_arc_raw_ms_files_network(tmp_path):
+
+    make_day_files(tmp_path, [('anmo', 2020, 1, 'IU.ANMO.00.BHZ.2020.001'),
+                              ('anmo', 2020, 2, 'IU.ANMO.00.BHZ.2020.002'),
+                              ('anmo', 2020, 2, 'II.ANMO.00.BHZ.2020.002'),
+                              ('anmo', 2020, 3, 'IU.ANMO.00.BHZ.2020.003')])
+
+    files = arc_raw_ms_files(str(tmp_path), 'iu', 'ANMO', 'bhz', '00', datetime(2020, 1, 1), datetime(2020, 1, 2))
+    assert [os.path.basename(f) for f in files] == ['IU.ANMO.00.BHZ.2020.001', 'IU.ANMO.00.BHZ.2020.002']
+
+    files = arc_raw_ms_files(str(tmp_path), 'II', 'ANMO', 'BHZ', '00', datetime(2020, 1, 1), datetime(2020, 1, 3))
+    assert [os.path.basename(f) for f in files] == ['II.ANMO.00.BHZ.2020.002']
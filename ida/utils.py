@@ -21,6 +21,7 @@
 # Planetary Physics, UCSD would be appreciated but is not required.
 #######################################################################################
 import calendar
+from concurrent.futures import ThreadPoolExecutor
 import os.path
 import sys
 import shutil
@@ -110,11 +111,54 @@ def i10get(i10_arc_dir, sta, chan_list, startime, endtime, outfn=None, **kwargs)
                 sys.exit(1)
 
 
+def msget_stream(ms_arc_dir, sta, chan, loc, start_dt, end_dt, net='II', **kwargs):
+    """Function to retrieve IDA raw, pre-QC'd, MINISEED data for a specified NET, STA, CHAN,
+    LOC between starttime and endtime from IDA local miniseed archive as an obspy Stream.
+
+    Parameters
+    ----------
+    ms_arc_dir : str
+        path to root of miniseed archive directory tree with
+        structure: <ms_arc_dir>/sta/year/oday
+    sta: str
+        Station code (case insensitive)
+    chan: str
+        Channel code (case insensitive)
+    loc: str
+        Location code
+    start_dt: datetime.datetime
+        Start time of desired data set. Assumed to be UTC.
+    end_dt: datetime.datetime
+        End time of desired data set. Assumed to be UTC.
+    net: str
+        Network code. Default 'II'
+
+    kwargs: dict
+        Extra keyword args
+
+    Returns
+    -------
+    obspy.Stream
+        Data trimmed to start_dt..end_dt. Empty if no archive files found.
+
+    """
+
+    from obspy import UTCDateTime
+
+    ms_file_list = arc_raw_ms_files(ms_arc_dir, net, sta.lower(), chan.lower(), loc.lower(),
+                                    start_dt, end_dt)
+
+    msfinal = read_arc_ms_files(ms_file_list, UTCDateTime(start_dt), UTCDateTime(end_dt))
+    msfinal.trim(UTCDateTime(start_dt), UTCDateTime(end_dt), nearest_sample=False)
+
+    return msfinal
+
+
 def msget(ms_arc_dir, sta, chan, loc, start_dt, end_dt, outfn=None, net='II', **kwargs):
     """Function to retrieve IDA raw, pre-QC'd, MINISEED data for a specified NET, STA, CHAN,
     LOC between starttime and endtime from IDA local miniseed archive.
 
-    Output is streamed STDOUT unless outfn is supplied.
+    Output is streamed STDOUT unless outfn is supplied. Use msget_stream to get the data in memory.
 
     Parameters
     ----------
@@ -146,45 +190,73 @@ def msget(ms_arc_dir, sta, chan, loc, start_dt, end_dt, outfn=None, net='II', **
 
     """
 
-
-    from obspy import read, Stream, UTCDateTime
     from obspy.io.mseed import InternalMSEEDError
 
-    ms_file_list = arc_raw_ms_files(ms_arc_dir, net, sta.lower(), chan.lower(), loc.lower(),
-                                    start_dt, end_dt)
+    try:
+        msfinal = msget_stream(ms_arc_dir, sta, chan, loc, start_dt, end_dt, net=net, **kwargs)
+    except InternalMSEEDError as err:
+        print(red(bold(err)), file=sys.stderr)
+        return
 
-    if ms_file_list:
+    if not msfinal:
+        print(red(bold(
+            'No MINISEED data found for {} {} {} {}'.format(sta, chan+loc, start_dt.isoformat(), end_dt.isoformat())
+        )), file=sys.stderr)
+        return
 
-        msfinal = Stream()
-        try:
-            for msfile in ms_file_list:
-                msfinal += read(msfile, format='MSEED')
+    try:
+        if outfn:
+            msfinal.write(outfn, format='MSEED')
+        else:
+            # encoded records go straight to stdout
+            msfinal.write(sys.stdout.buffer, format='MSEED')
+            sys.stdout.buffer.flush()
+    except InternalMSEEDError as err:
+        print(red(bold(err)), file=sys.stderr)
 
-            msfinal.trim(UTCDateTime(start_dt), UTCDateTime(end_dt), nearest_sample=False)
 
-            if not outfn:
-                # send trimmed output to tempfile for pipping to stdout
-                outtf = tempfile.NamedTemporaryFile(delete=False)
-                msout = outtf.name
-            else:
-                msout = outfn
+def read_arc_ms_files(ms_file_list, starttime=None, endtime=None, max_workers=None):
+    """Read archive miniseed day files concurrently into a single Stream.
+
+    Files are decoded in a thread pool (the miniseed decoder runs outside of the GIL). Only records
+    within starttime..endtime are decoded from the first and last file and the traces of all files
+    are collected into the Stream in one pass, in ms_file_list order.
 
-            msfinal.write(msout, format='MSEED')
+    Parameters
+    ----------
+    ms_file_list: list
+        Miniseed file names in time order, as from arc_raw_ms_files
+    starttime: obspy.UTCDateTime, None
+        Trim data in first file to start at starttime
+    endtime: obspy.UTCDateTime, None
+        Trim data in last file to end at endtime
+    max_workers: int, None
+        Maximum number of files read at once. Default is number of CPUs.
 
-        except InternalMSEEDError as err:
-            print(red(bold(err)), file=sys.stderr)
+    Returns
+    -------
+    obspy.Stream
 
-        if not outfn:
-            # send to stdout
-            res = subprocess.run('cat ' + msout, shell=True, stderr=subprocess.PIPE, universal_newlines=True)
-            if res.returncode != 0:
-                print(red(bold('ERROR streaming MINISEED data to stdout.')), file=sys.stderr)
-            os.remove(outtf.name)
-    else:
-        print(red(bold(
-            'No MINISEED data found for {} {} {} {}'.format(sta, chan+loc, start_dt.isoformat(), end_dt.isoformat())
-        )), file=sys.stderr)
+    """
+
+    from obspy import read, Stream
+
+    if not ms_file_list:
+        return Stream()
+
+    last_ndx = len(ms_file_list) - 1
+
+    def read_day(ndx_msfile):
+        ndx, msfile = ndx_msfile
+        return read(msfile, format='MSEED', nearest_sample=False,
+                    starttime=starttime if ndx == 0 else None,
+                    endtime=endtime if ndx == last_ndx else None).traces
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(ms_file_list))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        day_traces = list(executor.map(read_day, enumerate(ms_file_list)))
 
+    return Stream(traces=[tr for traces in day_traces for tr in traces])
 
 
 def mstrim(starttime=None, endtime=None, infn=None, outfn=None):
@@ -295,7 +367,7 @@ def arc_raw_ms_files(raw_root_dir, net, sta, chan, loc, start_dt, end_dt):
                     sta,
                     str(yr),
                     f"{dy:0>3}",
-                    f"II.{sta.upper()}.{loc}.{chan.upper()}.{yr}.{dy:0>3}"
+                    f"{net.upper()}.{sta.upper()}.{loc}.{chan.upper()}.{yr}.{dy:0>3}"
                 )
                 if Path(afile).exists() and os.path.isfile(afile):
                     filelist.append(os.path.join(afile))